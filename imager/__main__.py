@@ -24,8 +24,15 @@ def parse():
     argparse is the built-in error checking and help menu.
     """
     parser = argparse.ArgumentParser(prog='imager',description='Application to process an image file.')
-    parser.add_argument('image', type=str, nargs='?', help='the image file to process')
+    parser.add_argument('image', type=str, nargs='?', help='the image file to process (a quoted pattern like "*.jpg" for batch)')
     parser.add_argument('-e','--encode', action='store_true',  help='encode a text file into an image')
+    parser.add_argument('-d','--decode', action='store_true',  help='decode a hidden message from an image')
+    parser.add_argument('-m','--message', type=str, help='the file to hide (encoding without the GUI)')
+    parser.add_argument('-o','--output',  type=str, help='the output file for encoding or decoding (a folder for batch)')
+    parser.add_argument('-b','--batch',   action='store_true', help='apply actions to every matching file without the GUI')
+    parser.add_argument('-a','--action',  type=str, action='append', default=[], help='an action for batch, like pixellate:10 (repeat for more)')
+    parser.add_argument('-w','--workers', type=int, help='the number of worker processes for batch')
+    parser.add_argument('-p','--pipeline', type=str, help='a JSON file of actions for batch (implies --batch)')
     parser.add_argument('-t','--test',   action='store_true',  help='run a unit test on Image and Editor')
     parser.add_argument('-g','--grade',   action='store_true', help='grade the assignment')
     return parser.parse_args()
@@ -67,25 +74,126 @@ def grade(image):
         print('The grading program is not currently installed.')
 
 
-def encode(image):
+def encode(image, text=None, output=None):
     """
     Encodes the given text file into the specified image
     
     While it is possible for the user to omit an image file, this function will fail
     in that case.  However, the output file is still optional.  It will simply use
-    'output.png' if it is missing.
+    'output.png' if it is missing.  If the output file ends in .npy, it is saved in the
+    native format instead of as a PNG.
+    
+    If the text file is missing, this function launches the encoder GUI instead.
+    Otherwise, the file is streamed into the image a chunk at a time, so it may be
+    any (binary) file that fits in the image.  If it does not fit, nothing is saved
+    and the program exits with status 1.
     
     Parameter image: The image file to store the text message
     Precondition: image is a filename string or None
     
     Parameter text: The text file containing the message to encode
-    Precondition: text is a filename string
+    Precondition: text is a filename string or None
     
     Parameter output: The output file for saving the encoded message
     Precondition: output is a filename string or None
     """
-    from encoder import launch
-    launch(image)
+    if text is None:
+        from encoder import launch
+        launch(image)
+        return
+    
+    import sys
+    import imagefile
+    import a6editor
+    editor = a6editor.Editor(imagefile.read_image(image))
+    with open(text,'rb') as stream:
+        if not editor.encodeStream(stream):
+            print('The message in '+repr(text)+' could not be encoded',file=sys.stderr)
+            sys.exit(1)
+    imagefile.write_image(editor.getCurrent(), 'output.png' if output is None else output)
+
+
+def decode(image, output=None):
+    """
+    Decodes the message hidden in the specified image
+    
+    The message is streamed to the output file a chunk at a time.  If the output file
+    is missing, the message is written to the standard output.  If there is no message,
+    the program exits with status 1.
+    
+    Parameter image: The image file storing the message
+    Precondition: image is a filename string
+    
+    Parameter output: The output file for the decoded message
+    Precondition: output is a filename string or None
+    """
+    import sys
+    import imagefile
+    import a6editor
+    editor = a6editor.Editor(imagefile.read_image(image))
+    if output is None:
+        result = editor.decodeStream(sys.stdout.buffer)
+    else:
+        with open(output,'wb') as stream:
+            result = editor.decodeStream(stream)
+    if result is None:
+        print('No message was detected',file=sys.stderr)
+        sys.exit(1)
+
+
+def batch(pattern, actions, output=None, workers=None, pipeline=None):
+    """
+    Performs the given actions on every file matching pattern, without the GUI
+    
+    The results are saved as PNG files in the output folder, which is 'output' if it
+    is missing.  The files are processed by several worker processes (see the module
+    batch), and the time for each file is reported as it is finished.  Files already
+    processed by an earlier run with the same actions are skipped, unless they have
+    changed.
+    
+    The actions of the pipeline file (if any) are performed first.
+    
+    If the pattern is missing, an action is not valid, or the number of workers is not
+    positive, nothing is processed and the program exits with status 2.  If any file could not be processed, the program
+    exits with status 1, so that scripts can tell when a batch has failed.
+    
+    Parameter pattern: The pattern of the files to process (like 'photos/*.jpg')
+    Precondition: pattern is a string or None
+    
+    Parameter actions: The actions to perform in order (like 'monochromify:True')
+    Precondition: actions is a list of strings
+    
+    Parameter output: The output folder
+    Precondition: output is a string or None
+    
+    Parameter workers: The number of worker processes
+    Precondition: workers is an int > 0 or None
+    
+    Parameter pipeline: The JSON pipeline file
+    Precondition: pipeline is a string or None
+    """
+    import sys
+    import glob
+    import batch
+    if pattern is None:
+        print('Batch processing needs a pattern of files to process',file=sys.stderr)
+        sys.exit(2)
+    
+    try:
+        actions = [batch.parse_action(action) for action in actions]
+        if pipeline:
+            actions = batch.load_pipeline(pipeline)+actions
+    except (OSError, ValueError) as e:
+        print(e,file=sys.stderr)
+        sys.exit(2)
+    
+    if not workers is None and workers < 1:
+        print('The number of workers must be at least 1, not '+str(workers),file=sys.stderr)
+        sys.exit(2)
+    
+    files = sorted(file for file in glob.glob(pattern,recursive=True) if os.path.isfile(file))
+    if batch.run(files,'output' if output is None else output,actions,workers):
+        sys.exit(1)
 
 
 def execute():
@@ -102,9 +210,14 @@ def execute():
     elif args.grade:
         grade(image)
     elif args.encode:
-        encode(image)
+        encode(image,args.message,args.output)
+    elif args.decode:
+        decode(image,args.output)
+    elif args.batch or args.pipeline:
+        batch(image,args.action,args.output,args.workers,args.pipeline)
     else:
         launchgui(image)
 
-# Do it
-execute()
\ No newline at end of file
+# Do it (but not when imported by the worker processes in parallel)
+if __name__ == '__main__':
+    execute()
\ No newline at end of file
@@ -13,7 +13,58 @@ Date:    October 20, 2017 (Python 3 Version)
 Names: Debasmita Bhattacharya (db758) and Myka Umali (meu22)
 Date Completed: 15 November 2017
 """
+import pixels
+import a6image
 import a6history
+import convolution
+import dihedral
+import fixedpoint
+import pointops
+import rank
+import resample
+
+
+# Lookup tables for steganography. _HIDE[d][c] is the color value c with its last
+# digit replaced by d (stepping down by 10 if that overflows), while _DIGIT[c] is the
+# last digit of c.
+_HIDE  = [bytes((c//10)*10+d if (c//10)*10+d <= 255 else (c//10)*10+d-10
+                for c in range(256)) for d in range(10)]
+_DIGIT = bytes(c%10 for c in range(256))
+
+# The lookup table for tone adjustments that leaves each value unchanged
+_IDENTITY = bytes(range(256))
+
+
+def _cutoff(counts, limit):
+    """
+    Returns: the first value whose count brings the running total above limit
+    
+    Parameter counts: A histogram
+    Precondition: counts is a list of 256 ints, whose sum is more than limit
+    
+    Parameter limit: The number of values to skip
+    Precondition: limit is an int >= 0
+    """
+    total = 0
+    for value, count in enumerate(counts):
+        total += count
+        if total > limit:
+            return value
+    return 255
+
+
+# The operations waiting on an image that has none: no point operations (see the module
+# pointops) and no symmetry (see the module dihedral)
+_WAITING = ([], dihedral.IDENTITY)
+
+
+class Cancelled(Exception):
+    """
+    An exception raised by an Editor operation that was cancelled (see Editor.cancel)
+    
+    The image being edited is left half done.  The caller should undo the edit.
+    """
+    pass
 
 
 class Editor(a6history.ImageHistory):
@@ -34,97 +85,271 @@ class Editor(a6history.ImageHistory):
     edit history (which is inherited from ImageHistory).
     """
     
+    # The number of bytes (or pixels) to process at a time when streaming a message,
+    # and the number of pixels between checkpoints in operations done a pixel at a time
+    CHUNK = 65536
+    
+    # The operations that may be run on horizontal strips of the image (see the module
+    # parallel).  Each value is the number of rows (the halo) that a strip needs from
+    # the strips above and below it, or a function computing the halo from the
+    # operation arguments.  Operations not listed here depend on the whole image.
+    HALO = {'invert': 0, 'monochromify': 0, 'reflectHori': 0,
+            'convolve': lambda kernel, edge='clamp': None if edge == 'wrap' else len(kernel)//2,
+            'blur': lambda radius: sum(convolution.box_radii(radius)),
+            'unsharpMask': lambda radius, amount=1: sum(convolution.box_radii(radius)),
+            'sharpen': 1, 'edges': 1, 'median': lambda radius: radius,
+            'erode': lambda radius: radius, 'dilate': lambda radius: radius,
+            'opening': lambda radius: 2*radius, 'closing': lambda radius: 2*radius}
+    
+    # GETTERS
+    def getCurrent(self, flush=True):
+        """
+        Returns: The most recent edit
+        
+        Point operations (like invert) and symmetries (like transpose) are not applied
+        right away, but are composed and applied together when the image is next needed
+        (see the modules pointops and dihedral).  So this method applies them first,
+        unless flush is False.  In that case, the image may not be up to date, and may
+        not even have the right width (see isPending).
+        
+        Parameter flush: Whether to apply any waiting operations first
+        Precondition: flush is a bool
+        """
+        if flush:
+            self._flush()
+        return self._history[-1]
+    
+    
+    def isPending(self):
+        """
+        Returns: True if the most recent edit has not yet been applied to its image
+        
+        This is the case when there are point operations or symmetries waiting, or when
+        the edit still shares its image with the previous one (see increment).
+        """
+        image = self._history[-1]
+        return (self._pending[-1] != _WAITING or
+                any(other is image for other in self._history[:-1]))
+    
+    
+    def getWaiting(self):
+        """
+        Returns: The operations waiting on the most recent edit, as a pair (stages, turn)
+        
+        The stages are the point operations (see the module pointops) and turn is the
+        symmetry (see the module dihedral).  These are applied to getCurrent(False) to
+        get the up to date image.
+        """
+        return self._pending[-1]
+    
+    
+    def isCancelled(self):
+        """
+        Returns: True if the operation on the most recent edit has been cancelled
+        """
+        return self._cancelled
+    
+    
+    def getHalo(self, op, *args):
+        """
+        Returns: the halo operation op needs to be run on strips, or None if it cannot be
+        
+        See the class attribute HALO for more information.
+        
+        Parameter op: the name of the operation
+        Precondition: op is a string
+        
+        Parameter(s) *args: the arguments to the operation
+        Precondition: args are valid arguments for op
+        """
+        if not op in self.HALO:
+            return None
+        halo = self.HALO[op]
+        return halo(*args) if callable(halo) else halo
+    
+    
+    def histogram(self, luma=True):
+        """
+        Returns: the histograms of the current image as a list [red, green, blue, luma]
+        
+        Each histogram is a list of 256 ints, where element v is the number of pixels
+        with that value.  The luma of a pixel is its overall brightness, which is the
+        grey value that monochromify gives it (see fixedpoint.monochrome).  Computing it
+        takes as long as the color channels together, so it can be left off.
+        
+        The values are counted directly from the bytes of the image, so this is much
+        faster than looking at each pixel.
+        
+        Parameter luma: Whether to include the luma histogram
+        Precondition: luma is a bool
+        """
+        from collections import Counter
+        
+        buffer = self.getCurrent().getPixels().buffer
+        planes = [buffer[channel::3] for channel in range(3)]
+        if luma:
+            planes.append(fixedpoint.monochrome(planes,False)[0])
+        
+        result = []
+        for plane in planes:
+            counts = Counter(plane)
+            result.append([counts[value] for value in range(256)])
+        return result
+    
+    
+    # INITIALIZER
+    def __init__(self, original):
+        """
+        Initializer: Creates an editor for the given image.
+        
+        Parameter original: The image to edit
+        Precondition: original is an Image object
+        """
+        super().__init__(original)
+        self._pending = [_WAITING]
+        self._cancelled = False
+    
+    
+    # EDIT METHODS
+    def undo(self):
+        """
+        Returns: True if the latest edit can be undone, False otherwise.
+        
+        See ImageHistory for more information.
+        """
+        if super().undo():
+            self._pending.pop(-1)
+            return True
+        return False
+    
+    
+    def clear(self):
+        """
+        Deletes the entire edit history, restoring the original image.
+        
+        See ImageHistory for more information.
+        """
+        super().clear()
+        self._pending = [_WAITING]
+    
+    
+    def increment(self):
+        """
+        Adds a new edit to the edit history.
+        
+        Unlike ImageHistory, this does not copy the image right away.  The new edit
+        shares the image of the previous one (along with any waiting operations) until
+        it is needed by getCurrent.  So a chain of point operations and symmetries, each
+        with its own edit, costs only one copy and one pass over the image.
+        
+        The new edit starts out with no cancel request (see cancel).
+        """
+        self._history.append(self._history[-1])
+        self._pending.append(self._pending[-1])
+        self._cancelled = False
+        if len(self._history) > self.MAX_HISTORY:
+            self._history.pop(0)
+            self._pending.pop(0)
+    
+    
+    def restore(self, image):
+        """
+        Replaces the most recent edit with the given image.
+        
+        This is for results that were computed earlier (see the module memo).  Any
+        operations waiting on the old image are dropped.  It does not add to the edit
+        history, so call increment first to keep the old image.
+        
+        Parameter image: The new current image
+        Precondition: image is an Image object not used by any other edit
+        """
+        assert isinstance(image, a6image.Image), repr(image)+' is not an Image'
+        self._setCurrent(image)
+    
+    
+    def cancel(self):
+        """
+        Asks the operation running on the most recent edit to stop.
+        
+        This is meant to be called from another thread.  The operation is not stopped
+        right away.  Instead, it raises Cancelled at its next checkpoint (before each
+        row, band of pixels, or strip), leaving the edit half done.  The request lasts
+        until the next call to increment.
+        """
+        self._cancelled = True
+    
+    
+    def checkpoint(self):
+        """
+        Raises Cancelled if the operation on the most recent edit has been cancelled.
+        
+        Long running operations call this regularly, so that they can be stopped.
+        """
+        if self._cancelled:
+            raise Cancelled()
+    
+    
     # PROVIDED ACTIONS (STUDY THESE)
     def invert(self):
         """
         Inverts the current image, replacing each element with its color complement
+        
+        This is a point operation, so it is fused with any others that follow it, and
+        applied when the image is next needed (see getCurrent).
         """
-        current = self.getCurrent()
-        for pos in range(current.getLength()):
-            rgb = current.getFlatPixel(pos)
-            red   = 255 - rgb[0]
-            green = 255 - rgb[1]
-            blue  = 255 - rgb[2]
-            rgb = (red,green,blue) # New pixel value
-            current.setFlatPixel(pos,rgb)
+        self._defer(stage=pointops.INVERT)
     
     
     def transpose(self):
         """
         Transposes the current image
         
-        Transposing is tricky, as it is hard to remember which values have been changed 
-        and which have not.  To simplify the process, we copy the current image and use
-        that as a reference.  So we change the current image with setPixel, but read
-        (with getPixel) from the copy.
+        The pixels are not moved right away.  The transpose is composed with any other
+        symmetries around it, and the pixels are moved only once, when the image is
+        next needed (see getCurrent).
         
         The transposed image will be drawn on the screen immediately afterwards.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-        
-        for row in range(current.getHeight()):
-            for col in range(current.getWidth()):
-                current.setPixel(row,col,original.getPixel(col,row))
+        self._defer(element=dihedral.TRANSPOSE)
     
     
     def reflectHori(self):
         """
         Reflects the current image around the horizontal middle.
+        
+        Like transpose, this is applied when the image is next needed.
         """
-        current = self.getCurrent()
-        for h in range(current.getWidth()//2):
-            for row in range(current.getHeight()):
-                k = current.getWidth()-1-h
-                current.swapPixels(row,h,row,k)
+        self._defer(element=dihedral.REFLECT_HORI)
     
     
     def rotateRight(self):
         """
-        Rotates the current image left by 90 degrees.
+        Rotates the current image right by 90 degrees.
         
-        Technically, we can implement this via a transpose followed by a vertical
-        reflection. However, this is slow, so we use the faster strategy below.
+        Like transpose, this is applied when the image is next needed.  So four of
+        these in a row never move a pixel.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-        
-        for row in range(current.getHeight()):
-            for col in range(current.getWidth()):
-                current.setPixel(row,col,original.getPixel(original.getHeight()
-                                                           -col-1,row))
+        self._defer(element=dihedral.ROTATE_RIGHT)
     
     
     def rotateLeft(self):
         """
         Rotates the current image left by 90 degrees.
         
-        Technically, we can implement this via a transpose followed by a vertical
-        reflection. However, this is slow, so we use the faster strategy below.
+        Like transpose, this is applied when the image is next needed.  So four of
+        these in a row never move a pixel.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-        
-        for row in range(current.getHeight()):
-            for col in range(current.getWidth()):
-                current.setPixel(row,col,original.getPixel(col,original.getWidth()
-                                                           -row-1))
+        self._defer(element=dihedral.ROTATE_LEFT)
     
     
     # ASSIGNMENT METHODS (IMPLEMENT THESE)
     def reflectVert(self):
         """ 
         Reflects the current image around the vertical middle.
+        
+        Like transpose, this is applied when the image is next needed.
         """
-        current = self.getCurrent()
-        for h in range(current.getHeight()//2):
-            for col in range(current.getWidth()):
-                k = current.getHeight()-1-h
-    
-                current.swapPixels(h,col,k,col)
+        self._defer(element=dihedral.REFLECT_VERT)
     
     
     def monochromify(self, sepia):
@@ -140,29 +365,15 @@ class Editor(a6history.ImageHistory):
         If sepia is True, it makes the same computations as before but sets green to
         0.6 * brightness and blue to 0.4 * brightness.
         
+        The arithmetic is done with integers, a whole channel at a time (see the module
+        fixedpoint).  But the result is exactly what the float formulas above give,
+        truncated with int().  This is a point operation, so it is fused with any
+        others around it, and applied when the image is next needed (see getCurrent).
+        
         Parameter sepia: Whether to use sepia tone instead of greyscale.
         Precondition: sepia is a bool
         """
-        if sepia == False:
-            current = self.getCurrent()
-            for pos in range(current.getLength()): 
-                rgb = current.getFlatPixel(pos)
-                red   = rgb[0]
-                green = rgb[1]
-                blue  = rgb[2]
-                brightness = 0.3 * red + 0.6 * green + 0.1 * blue
-                rgb = (int(brightness),int(brightness),int(brightness)) # New pixel value
-                current.setFlatPixel(pos,rgb)
-        elif sepia == True:
-            current = self.getCurrent()
-            for pos in range(current.getLength()): 
-                rgb = current.getFlatPixel(pos)
-                red   = rgb[0]
-                green = rgb[1]
-                blue  = rgb[2]
-                brightness = 0.3 * red + 0.6 * green + 0.1 * blue
-                rgb = (int(brightness),int(0.6*brightness),int(0.4*brightness)) # New pixel value
-                current.setFlatPixel(pos,rgb)
+        self._defer(stage=pointops.mono(sepia == True))
     
     
     def jail(self):
@@ -207,30 +418,26 @@ class Editor(a6history.ImageHistory):
         
         where d is the distance from the pixel to the center of the image and hfD 
         (for half diagonal) is the distance from the center of the image to any of 
-        the corners.
-        """
-        import pixels
+        the corners.  Pixels farther away than that (possible in long, thin images)
+        become black.
         
+        The arithmetic is done with integers, a band of CHUNK pixels at a time (see the
+        module fixedpoint).  But the result is exactly what the float formula above
+        gives, truncated with int().
+        """
+        from array import array
         current = self.getCurrent()
-        middlerow = current.getWidth()//2
-        middlecol = current.getHeight()//2
-        hfD = (current.getWidth()**2 + current.getHeight()**2)**0.5
-        
-        for row in range(current.getHeight()):
-            for col in range(current.getWidth()):
-                currentpixel = current.getPixel(row, col)
-                drow = (row - middlerow)**2
-                dcol = (col - middlecol)**2
-                d = (drow + dcol)**0.5
-                vigt = 1 - (d/hfD)**2
-                
-                darkred   = currentpixel[0] * vigt
-                darkgreen = currentpixel[1] * vigt
-                darkblue  = currentpixel[2] * vigt 
-                
-                vignette = (int(darkred),int(darkgreen),int(darkblue))
-                current.setPixel(row, col, vignette)
-                #current.setFlatPixel(pos,rgb) 
+        buffer  = current.getPixels().buffer
+        length  = current.getLength()
+        factors = fixedpoint.vignette_factors(current.getWidth(), current.getHeight())
+        for start in range(0, length, self.CHUNK):
+            self.checkpoint()
+            stop = min(start+self.CHUNK, length)
+            for channel in range(3):
+                band  = slice(start*3+channel, stop*3, 3)
+                scaled = fixedpoint.scale(buffer[band], factors[start:stop])
+                buffer[band] = array('B', scaled)
+            current.getPixels().mark(start, stop)
     
     
     def pixellate(self,step):
@@ -254,10 +461,402 @@ class Editor(a6history.ImageHistory):
         current = self.getCurrent()
         
         for y in range(0, current.getWidth(), step):
+            self.checkpoint()
             for x in range(0, current.getHeight(), step):
                     self._average(x, y, step)
                 
         
+    # TONE ADJUSTMENTS
+    def autoLevels(self, clip=0.005):
+        """
+        Stretches each color channel of the current image to the full range 0..255.
+        
+        The darkest and brightest clip fraction of the values in each channel are
+        ignored when finding its range, so that a few stray pixels do not spoil the
+        result.  The stretch is applied as a lookup table to each channel.
+        
+        Parameter clip: The fraction of values to ignore at either end
+        Precondition: clip is a number with 0 <= clip < 0.5
+        """
+        assert type(clip) in [int, float] and 0 <= clip < 0.5
+        
+        tables = []
+        for counts in self.histogram(False):
+            limit = int(sum(counts)*clip)
+            low  = _cutoff(counts, limit)
+            high = 255-_cutoff(counts[::-1], limit)
+            if high <= low:
+                tables.append(_IDENTITY)
+            else:
+                tables.append(bytes(min(255, max(0, ((value-low)*510+high-low)//(2*(high-low))))
+                                    for value in range(256)))
+        self._translate(tables)
+    
+    
+    def equalize(self):
+        """
+        Equalizes the histogram of each color channel of the current image.
+        
+        Each value is replaced by the fraction of values in its channel that are no
+        larger than it (scaled to 0..255), which spreads the most common values apart.
+        The result is applied as a lookup table to each channel.
+        """
+        from itertools import accumulate
+        
+        tables = []
+        for counts in self.histogram(False):
+            totals = list(accumulate(counts))
+            first  = next(total for total in totals if total)
+            spread = totals[-1]-first
+            if spread == 0:
+                tables.append(_IDENTITY)
+            else:
+                tables.append(bytes(max(0, ((total-first)*510+spread)//(2*spread))
+                                    for total in totals))
+        self._translate(tables)
+    
+    
+    # NEIGHBORHOOD FILTERS
+    def convolve(self, kernel, edge='clamp'):
+        """
+        Convolves the current image with the given kernel.
+        
+        The kernel is a 2D list of weights (a list of rows), centered on each pixel in
+        turn.  The new pixel is the weighted sum of the pixels under the kernel, rounded
+        and clamped to 0..255.  The weights are not normalized, so they should add up
+        to 1 to keep the brightness of the image.
+        
+        If the kernel is separable (every row is a multiple of the same row), the work
+        is done in two 1D passes.  If a pass is a box filter (all weights the same), it
+        uses running sums, so its cost does not depend on the size of the kernel.
+        
+        Parameter kernel: The weights to apply
+        Precondition: kernel is a non-empty list of equal length lists of numbers, with
+        an odd number of rows and columns
+        
+        Parameter edge: How to treat pixels past the edge of the image
+        Precondition: edge is one of 'clamp', 'reflect', 'wrap', or 'black'
+        """
+        assert type(kernel) == list and len(kernel) % 2 == 1
+        assert all(type(row) == list and len(row) == len(kernel[0]) for row in kernel)
+        assert len(kernel[0]) % 2 == 1
+        assert edge in convolution.EDGES, repr(edge)+' is not a valid edge mode'
+        
+        current = self.getCurrent()
+        buffer  = current.getPixels().buffer
+        width   = current.getWidth()
+        height  = current.getHeight()
+        for channel, plane in enumerate(convolution.planes(buffer)):
+            self.checkpoint()
+            plane = convolution.filter_plane(plane, width, height, kernel, edge,
+                                             checkpoint=self.checkpoint)
+            convolution.combine(buffer, plane, channel)
+            current.getPixels().mark(0, current.getLength()*(channel+1)//3)
+    
+    
+    def median(self, radius):
+        """
+        Replaces each pixel of the current image with the median of its neighborhood.
+        
+        The neighborhood is the square of pixels at most radius rows and columns away,
+        and each color channel is filtered separately.  This removes speckle noise
+        while keeping edges sharp.  The cost per pixel does not grow with the radius
+        (see the module rank).
+        
+        Parameter radius: The radius of the neighborhood in pixels
+        Precondition: radius is an int > 0
+        """
+        assert type(radius) == int and radius > 0
+        
+        current = self.getCurrent()
+        buffer  = current.getPixels().buffer
+        width   = current.getWidth()
+        height  = current.getHeight()
+        for channel, plane in enumerate(convolution.planes(buffer)):
+            self.checkpoint()
+            plane = rank.median_plane(plane, width, height, radius, checkpoint=self.checkpoint)
+            convolution.combine(buffer, plane, channel)
+            current.getPixels().mark(0, current.getLength()*(channel+1)//3)
+    
+    
+    def erode(self, radius):
+        """
+        Replaces each pixel of the current image with the minimum of its neighborhood.
+        
+        The neighborhood is the square of pixels at most radius rows and columns away,
+        and each color channel is filtered separately.  Dark areas grow and bright
+        specks disappear.  The cost does not depend on the radius (see the module rank).
+        
+        Parameter radius: The radius of the neighborhood in pixels
+        Precondition: radius is an int > 0
+        """
+        assert type(radius) == int and radius > 0
+        self._morph([rank.min_plane], radius)
+    
+    
+    def dilate(self, radius):
+        """
+        Replaces each pixel of the current image with the maximum of its neighborhood.
+        
+        The neighborhood is the square of pixels at most radius rows and columns away,
+        and each color channel is filtered separately.  Bright areas grow and dark
+        specks disappear.  The cost does not depend on the radius (see the module rank).
+        
+        Parameter radius: The radius of the neighborhood in pixels
+        Precondition: radius is an int > 0
+        """
+        assert type(radius) == int and radius > 0
+        self._morph([rank.max_plane], radius)
+    
+    
+    def opening(self, radius):
+        """
+        Erodes and then dilates the current image.
+        
+        This removes bright details smaller than the neighborhood, while leaving larger
+        shapes as they were.
+        
+        Parameter radius: The radius of the neighborhood in pixels
+        Precondition: radius is an int > 0
+        """
+        assert type(radius) == int and radius > 0
+        self._morph([rank.min_plane, rank.max_plane], radius)
+    
+    
+    def closing(self, radius):
+        """
+        Dilates and then erodes the current image.
+        
+        This fills in dark details smaller than the neighborhood (such as gaps in
+        scanned text), while leaving larger shapes as they were.
+        
+        Parameter radius: The radius of the neighborhood in pixels
+        Precondition: radius is an int > 0
+        """
+        assert type(radius) == int and radius > 0
+        self._morph([rank.max_plane, rank.min_plane], radius)
+    
+    
+    def blur(self, radius):
+        """
+        Blurs the current image with a Gaussian of standard deviation radius.
+        
+        The Gaussian is approximated by three box blurs in each direction.  Box blurs
+        use running sums, so large radii cost no more than small ones.
+        
+        Parameter radius: The standard deviation of the blur in pixels
+        Precondition: radius is a number > 0
+        """
+        assert type(radius) in [int, float] and radius > 0
+        
+        current = self.getCurrent()
+        buffer  = current.getPixels().buffer
+        width   = current.getWidth()
+        height  = current.getHeight()
+        for channel, plane in enumerate(convolution.planes(buffer)):
+            self.checkpoint()
+            plane, divisor = convolution.gaussian(plane, width, height, radius,
+                                                  checkpoint=self.checkpoint)
+            convolution.combine(buffer, plane, channel, divisor)
+            current.getPixels().mark(0, current.getLength()*(channel+1)//3)
+    
+    
+    def sharpen(self):
+        """
+        Sharpens the current image with the classic 3x3 sharpening kernel.
+        """
+        self.convolve([[0,-1,0],[-1,5,-1],[0,-1,0]])
+    
+    
+    def unsharpMask(self, radius, amount=1):
+        """
+        Sharpens the current image by subtracting a blurred copy of it.
+        
+        Each pixel becomes  original + amount * (original - blurred)  where the blurred
+        image is a Gaussian blur with standard deviation radius.
+        
+        Parameter radius: The standard deviation of the blur in pixels
+        Precondition: radius is a number > 0
+        
+        Parameter amount: The strength of the sharpening
+        Precondition: amount is a number >= 0
+        """
+        from itertools import repeat
+        from operator import add, sub, mul
+        assert type(radius) in [int, float] and radius > 0
+        assert type(amount) in [int, float] and amount >= 0
+        
+        current = self.getCurrent()
+        buffer  = current.getPixels().buffer
+        width   = current.getWidth()
+        height  = current.getHeight()
+        for channel, plane in enumerate(convolution.planes(buffer)):
+            self.checkpoint()
+            blurred, divisor = convolution.gaussian(plane, width, height, radius,
+                                                    checkpoint=self.checkpoint)
+            # Scale everything by divisor to stay in integers as long as possible
+            plane = list(map(mul, plane, repeat(divisor)))
+            detail = map(mul, map(sub, plane, blurred), repeat(amount))
+            convolution.combine(buffer, list(map(add, plane, detail)), channel, divisor)
+            current.getPixels().mark(0, current.getLength()*(channel+1)//3)
+    
+    
+    def edges(self):
+        """
+        Replaces the current image with its edges, using the Sobel operator.
+        
+        Each color channel becomes the magnitude of its gradient, so edges are bright
+        and flat areas are black.
+        """
+        from math import hypot
+        current = self.getCurrent()
+        buffer  = current.getPixels().buffer
+        width   = current.getWidth()
+        height  = current.getHeight()
+        sobelx  = [[-1,0,1],[-2,0,2],[-1,0,1]]
+        sobely  = [[-1,-2,-1],[0,0,0],[1,2,1]]
+        for channel, plane in enumerate(convolution.planes(buffer)):
+            self.checkpoint()
+            gradx = convolution.filter_plane(plane, width, height, sobelx,
+                                             checkpoint=self.checkpoint)
+            grady = convolution.filter_plane(plane, width, height, sobely,
+                                             checkpoint=self.checkpoint)
+            convolution.combine(buffer, list(map(hypot, gradx, grady)), channel)
+            current.getPixels().mark(0, current.getLength()*(channel+1)//3)
+    
+    
+    # GEOMETRY
+    def resize(self, width, height, method='bilinear'):
+        """
+        Resizes the current image to width x height.
+        
+        Unlike the other operations, this one replaces the current image with a new one,
+        as the number of pixels changes.  Undo restores the old size as usual.
+        
+        The method 'nearest' copies pixels and is the fastest.  The method 'bilinear'
+        blends the closest pixels, which is best for enlarging.  The method 'area'
+        averages every pixel covered, which is best for shrinking (and is even faster
+        when shrinking by a power of two).
+        
+        Parameter width: The new image width
+        Precondition: width is an int > 0
+        
+        Parameter height: The new image height
+        Precondition: height is an int > 0
+        
+        Parameter method: The resampling method
+        Precondition: method is one of 'nearest', 'bilinear', or 'area'
+        """
+        assert type(width) == int and width > 0
+        assert type(height) == int and height > 0
+        assert method in resample.METHODS, repr(method)+' is not a valid resampling method'
+        
+        current = self.getCurrent()
+        buffer  = resample.resize(current.getPixels().buffer, current.getWidth(),
+                                  current.getHeight(), width, height, method,
+                                  checkpoint=self.checkpoint)
+        data = pixels.Pixels.frombytes(buffer)
+        data.mark(0, len(data))
+        self._setCurrent(a6image.Image(data, width))
+    
+    
+    def affine(self, matrix, method='bilinear'):
+        """
+        Transforms the current image by the given matrix, about the center of the image.
+        
+        The matrix is a 2x2 list [[a,b],[c,d]].  The pixel x columns right and y rows
+        below the center moves to the position (a*x+b*y, c*x+d*y) relative to the
+        center.  The image keeps its size, so parts may be cut off, and new pixels
+        that come from outside of the image are black.
+        
+        The source of each new pixel is computed once per image size and matrix, and
+        then reused by later calls (see resample.affine_map).
+        
+        Parameter matrix: The transform
+        Precondition: matrix is an invertible 2x2 list of numbers
+        
+        Parameter method: The sampling method
+        Precondition: method is 'nearest' or 'bilinear'
+        """
+        assert type(matrix) == list and len(matrix) == 2
+        assert all(type(row) == list and len(row) == 2 for row in matrix)
+        assert all(type(value) in [int, float] for row in matrix for value in row)
+        assert method in ['nearest', 'bilinear'], repr(method)+' is not a valid sampling method'
+        
+        current = self.getCurrent()
+        buffer  = current.getPixels().buffer
+        table = resample.affine_map(current.getWidth(), current.getHeight(), matrix, method,
+                                    checkpoint=self.checkpoint)
+        for channel in range(3):
+            self.checkpoint()
+            resample.warp(buffer, table, channel)
+            current.getPixels().mark(0, current.getLength()*(channel+1)//3)
+    
+    
+    def rotate(self, angle, method='bilinear'):
+        """
+        Rotates the current image counter-clockwise by angle degrees about its center.
+        
+        The image keeps its size, so the corners are cut off and the new corners are
+        black.  This is meant for small corrections, like straightening a scan.
+        
+        Parameter angle: The angle to rotate in degrees
+        Precondition: angle is a number
+        
+        Parameter method: The sampling method
+        Precondition: method is 'nearest' or 'bilinear'
+        """
+        import math
+        assert type(angle) in [int, float]
+        
+        # Round so that right angles are exact
+        cos = round(math.cos(math.radians(angle)), 12)
+        sin = round(math.sin(math.radians(angle)), 12)
+        self.affine([[cos, sin], [-sin, cos]], method)
+    
+    
+    def shear(self, x, y=0, method='bilinear'):
+        """
+        Shears the current image about its center.
+        
+        Each row is shifted right by x times its distance below the center, and each
+        column is shifted down by y times its distance right of the center.
+        
+        Parameter x: The horizontal shear
+        Precondition: x is a number
+        
+        Parameter y: The vertical shear
+        Precondition: y is a number with x*y != 1
+        
+        Parameter method: The sampling method
+        Precondition: method is 'nearest' or 'bilinear'
+        """
+        assert type(x) in [int, float] and type(y) in [int, float]
+        self.affine([[1, x], [y, 1]], method)
+    
+    
+    def scale(self, x, y=None, method='bilinear'):
+        """
+        Scales the current image about its center, keeping the size of the image.
+        
+        Unlike resize, this zooms in (or out) on the image.  Zooming out leaves a black
+        border.
+        
+        Parameter x: The horizontal scale factor
+        Precondition: x is a number > 0
+        
+        Parameter y: The vertical scale factor (x if None)
+        Precondition: y is None or a number > 0
+        
+        Parameter method: The sampling method
+        Precondition: method is 'nearest' or 'bilinear'
+        """
+        y = x if y is None else y
+        assert type(x) in [int, float] and x > 0
+        assert type(y) in [int, float] and y > 0
+        self.affine([[x, 0], [0, y]], method)
+    
+    
     def encode(self, text):
         """
         Returns: True if it could hide the given text in the current image; False otherwise.
@@ -282,6 +881,8 @@ class Editor(a6history.ImageHistory):
             self._encode_starter()
             pos = 2
             for x in text:
+                if pos % self.CHUNK == 0:
+                    self.checkpoint()
                 num = ord(x)
                 self._encode_pixel(num, pos)
                 pos = pos +1
@@ -330,6 +931,8 @@ class Editor(a6history.ImageHistory):
         
         if red1%10 == green1%10 == blue1%10 == red2%10 == green2%10 == blue2%10 == 7:
             while x < current.getLength():
+                if x % self.CHUNK == 0:
+                    self.checkpoint()
                 #current_pix = current.getFlatPixel(x)
                 message = message + chr(self._decode_pixel(x))
                 x = x + 1
@@ -339,7 +942,199 @@ class Editor(a6history.ImageHistory):
             return None 
     
     
+    def encodeStream(self, stream):
+        """
+        Returns: True if it could hide the contents of stream in the current image;
+        False otherwise.
+        
+        This method is the streaming version of encode.  Instead of a string, it hides
+        the bytes read from a binary file.  The bytes are read CHUNK at a time and
+        written straight into the pixel buffer, so the message is never held in memory
+        all at once.  The message uses the same markers as encode, so a message of ASCII
+        text can be read back with either decode or decodeStream.
+        
+        If the stream is empty or the picture does not have enough pixels to store it,
+        this method returns False without storing the message.
+        
+        Parameter stream: the message to hide
+        Precondition: stream is a binary file-like object open for reading
+        """
+        from array import array
+        
+        current = self.getCurrent()
+        buffer  = current.getPixels().buffer
+        room = current.getLength()-5
+        size = self._stream_size(stream)
+        if size == 0 or (not size is None and size > room):
+            return False
+        
+        # If we do not know the size, we must be able to back out of an overflow
+        backup = array('B') if size is None else None
+        
+        pos = 2
+        chunk = stream.read(self.CHUNK)
+        while chunk:
+            self.checkpoint()
+            if pos+len(chunk) > room+2:
+                if not backup is None:
+                    buffer[6:6+len(backup)] = backup
+                return False
+            if not backup is None:
+                backup.extend(buffer[pos*3:(pos+len(chunk))*3])
+            self._encode_bytes(chunk, pos)
+            pos = pos + len(chunk)
+            chunk = stream.read(self.CHUNK)
+        
+        if pos == 2:
+            return False
+        self._encode_starter()
+        self._encode_pixel(777, pos)
+        self._encode_pixel(777, pos+1)
+        current.getPixels().mark(0, pos+2)
+        return True
+    
+    
+    def decodeStream(self, stream):
+        """
+        Returns: The number of bytes of the secret message written to stream.
+        
+        This method is the streaming version of decode.  It writes the message hidden
+        in the current image to a binary file, CHUNK bytes at a time.
+        
+        If no message is detected, or the message contains characters that are not
+        bytes (e.g. it was encoded from non-Latin text), it returns None.  In the latter
+        case, part of the message may have been written to stream already.
+        
+        Parameter stream: the file to write the message to
+        Precondition: stream is a binary file-like object open for writing
+        """
+        current = self.getCurrent()
+        length  = current.getLength()
+        if length < 2 or self._decode_pixel(0) != 777 or self._decode_pixel(1) != 777:
+            return None
+        
+        count = 0
+        pos = 2
+        while pos < length:
+            self.checkpoint()
+            output = bytearray()
+            for value in self._decode_pixels(pos, min(pos+self.CHUNK, length)):
+                if value < 256:
+                    output.append(value)
+                elif value == 777 and pos > 2 and self._find_end(pos):
+                    stream.write(output)
+                    return count+len(output)
+                else:
+                    return None
+                pos = pos + 1
+            stream.write(output)
+            count = count + len(output)
+        return None
+    
+    
     # HELPER FUNCTIONS
+    def _morph(self, steps, radius):
+        """
+        Applies a sequence of rank filters to each color channel of the current image.
+        
+        Parameter steps: The filters to apply, in order
+        Precondition: steps is a list of functions like rank.min_plane
+        
+        Parameter radius: The radius of the neighborhood in pixels
+        Precondition: radius is an int >= 0
+        """
+        from array import array
+        current = self.getCurrent()
+        buffer  = current.getPixels().buffer
+        width   = current.getWidth()
+        height  = current.getHeight()
+        for channel, plane in enumerate(convolution.planes(buffer)):
+            self.checkpoint()
+            for step in steps:
+                plane = step(plane, width, height, radius, checkpoint=self.checkpoint)
+            buffer[channel::3] = array('B', plane)
+            current.getPixels().mark(0, current.getLength()*(channel+1)//3)
+    
+    
+    def _translate(self, tables):
+        """
+        Replaces each value in the current image by its entry in a lookup table.
+        
+        Parameter tables: The lookup tables for the red, green and blue channels
+        Precondition: tables is a list of three bytes objects of length 256
+        """
+        from array import array
+        current = self.getCurrent()
+        buffer  = current.getPixels().buffer
+        for channel, table in enumerate(tables):
+            self.checkpoint()
+            buffer[channel::3] = array('B', bytes(buffer[channel::3]).translate(table))
+            current.getPixels().mark(0, current.getLength()*(channel+1)//3)
+    
+    
+    def _setCurrent(self, image):
+        """
+        Replaces the current image with the given one.
+        
+        This is for operations that change the number of pixels, and so cannot modify
+        the current image in place.  It does not add to the edit history.
+        
+        Parameter image: The new current image
+        Precondition: image is an Image object
+        """
+        self._history[-1] = image
+        self._pending[-1] = _WAITING
+    
+    
+    def _defer(self, stage=None, element=None):
+        """
+        Adds an operation to those waiting to be applied to the current image.
+        
+        Parameter stage: A point operation (see the module pointops)
+        Precondition: stage is a stage or None
+        
+        Parameter element: A symmetry (see the module dihedral)
+        Precondition: element is a dihedral element or None
+        """
+        stages, turn = self._pending[-1]
+        if not stage is None:
+            stages = pointops.append(stages, stage)
+        if not element is None:
+            turn = dihedral.compose(turn, element)
+        self._pending[-1] = (stages, turn)
+    
+    
+    def _flush(self):
+        """
+        Applies the waiting operations to the current image.
+        
+        If the current image is still shared with an earlier edit, it is copied first.
+        Point operations do not care where a pixel is, so they are done before moving
+        the pixels.
+        """
+        from array import array
+        current = self._history[-1]
+        stages, turn = self._pending[-1]
+        if any(other is current for other in self._history[:-1]):
+            current = current.copy()
+            self._history[-1] = current
+        if (stages, turn) == _WAITING:
+            return
+        
+        self._pending[-1] = _WAITING
+        buffer = current.getPixels().buffer
+        width  = current.getWidth()
+        height = current.getHeight()
+        planes = pointops.apply([buffer[channel::3] for channel in range(3)], stages)
+        for channel, plane in enumerate(planes):
+            if turn != dihedral.IDENTITY:
+                plane = dihedral.remap(plane, width, height, turn)
+            buffer[channel::3] = array('B', plane)
+            current.getPixels().mark(0, current.getLength()*(channel+1)//3)
+        if dihedral.swaps(turn):
+            current.setWidth(height)
+    
+    
     def _drawHBar(self, row, pixel):
         """
         Draws a horizontal bar on the current image at the given row.
@@ -354,6 +1149,7 @@ class Editor(a6history.ImageHistory):
         Parameter pixel: The pixel color to use
         Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
         """
+        self.checkpoint()
         current = self.getCurrent()
         for col in range(current.getWidth()):
             current.setPixel(row, col, pixel)
@@ -375,6 +1171,7 @@ class Editor(a6history.ImageHistory):
         Parameter pixel: The pixel color to use
         Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
         """
+        self.checkpoint()
         current = self.getCurrent()
         for row in range(current.getHeight()):
             current.setPixel(row, col, pixel)
@@ -540,4 +1337,64 @@ class Editor(a6history.ImageHistory):
             else: return False
         else:
             return False 
-    
\ No newline at end of file
+    
+    
+    def _encode_bytes(self, data, pos):
+        """
+        Hides the given bytes in the current image, starting at pixel pos.
+        
+        Each byte is hidden in one pixel, exactly as _encode_pixel would do it.  However,
+        this method works on the pixel buffer directly (with lookup tables) so that it
+        can keep up with large streams.
+        
+        Parameter data: the bytes to hide
+        Precondition: data is a bytes object
+        
+        Parameter pos: the first pixel position
+        Precondition: pos is an int >= 0 and pos+len(data) <= image length
+        """
+        buffer = self.getCurrent().getPixels().buffer
+        k = pos*3
+        for byte in data:
+            buffer[k  ] = _HIDE[byte//100][buffer[k]]
+            buffer[k+1] = _HIDE[(byte%100)//10][buffer[k+1]]
+            buffer[k+2] = _HIDE[byte%10][buffer[k+2]]
+            k = k + 3
+    
+    
+    def _decode_pixels(self, start, stop):
+        """
+        Returns: the list of numbers hidden in pixels start..stop-1 of the current image.
+        
+        This is the bulk version of _decode_pixel.  It reads the pixel buffer directly.
+        
+        Parameter start: the first pixel position
+        Precondition: start is an int with 0 <= start <= image length
+        
+        Parameter stop: the pixel position after the last one
+        Precondition: stop is an int with start <= stop <= image length
+        """
+        buffer = self.getCurrent().getPixels().buffer
+        digits = bytes(buffer[start*3:stop*3]).translate(_DIGIT)
+        return [r*100+g*10+b for r, g, b in zip(digits[0::3],digits[1::3],digits[2::3])]
+    
+    
+    def _stream_size(self, stream):
+        """
+        Returns: the number of bytes left in stream, or None if this cannot be known.
+        
+        The size can only be known for streams that support seeking, such as files
+        on disk.
+        
+        Parameter stream: the stream to measure
+        Precondition: stream is a binary file-like object open for reading
+        """
+        try:
+            if stream.seekable():
+                here = stream.tell()
+                size = stream.seek(0,2)-here
+                stream.seek(here)
+                return size
+        except (AttributeError, OSError):
+            pass
+        return None
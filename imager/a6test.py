@@ -37,6 +37,21 @@ def test_assert(func,args,message):
     return False
 
 
+def load_main():
+    """
+    Returns: The module __main__.py of this application, loaded under another name
+    
+    This gives the tests the command line functions, without running the application.
+    """
+    import os
+    import importlib.util
+    path = os.path.join(os.path.split(__file__)[0],'__main__.py')
+    spec = importlib.util.spec_from_file_location('imager_main',path)
+    main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(main)
+    return main
+
+
 def test_image_init():
     """
     Tests the __init__ method and getters for class Image
@@ -345,6 +360,982 @@ def test_hist_edit():
     cornell.assert_not_equals(id(bottom), id(hist._history[0]))
 
 
+def test_editor_stream():
+    """
+    Tests the methods encodeStream and decodeStream in class Editor
+    """
+    print('Testing editor message streams')
+    import io
+    import a6image
+    import a6editor
+    p = pixels.Pixels(60)
+    for pos in range(60):
+        p[pos] = ((pos*7) % 256, (pos*53) % 256, 250+pos % 6)
+    
+    # Stream in small chunks to test the chunk boundaries
+    message = bytes(range(250,256))+b'hidden'+bytes(range(0,40))
+    editor = a6editor.Editor(a6image.Image(p,6))
+    editor.CHUNK = 7
+    cornell.assert_true(editor.encodeStream(io.BytesIO(message)))
+    output = io.BytesIO()
+    cornell.assert_equals(len(message),editor.decodeStream(output))
+    cornell.assert_equals(message,output.getvalue())
+    
+    # Text messages are compatible both ways
+    editor.clear()
+    editor.encode('abc')
+    output = io.BytesIO()
+    cornell.assert_equals(3,editor.decodeStream(output))
+    cornell.assert_equals(b'abc',output.getvalue())
+    editor.clear()
+    editor.encodeStream(io.BytesIO(b'abc'))
+    cornell.assert_equals('abc',editor.decode())
+    
+    # Messages that do not fit are rejected untouched
+    editor.clear()
+    cornell.assert_false(editor.encodeStream(io.BytesIO(bytes(56))))
+    cornell.assert_false(editor.encodeStream(io.BytesIO(b'')))
+    for pos in range(60):
+        cornell.assert_equals(p[pos],editor.getCurrent().getFlatPixel(pos))
+    cornell.assert_equals(None,editor.decodeStream(io.BytesIO()))
+    
+    # On the command line, both failures exit with status 1
+    import os
+    import tempfile
+    import contextlib
+    main = load_main()
+    file = os.path.join(os.path.split(__file__)[0],'im_border.png')
+    with tempfile.TemporaryDirectory() as folder:
+        text = os.path.join(folder,'message.txt')
+        with open(text,'wb') as stream:
+            stream.write(bytes(64*64*3))
+        for call in [lambda: main.encode(file,text,os.path.join(folder,'output.png')),
+                     lambda: main.decode(file,os.path.join(folder,'message.out'))]:
+            errors = io.StringIO()
+            try:
+                with contextlib.redirect_stderr(errors):
+                    call()
+                cornell.assert_true(False)
+            except SystemExit as e:
+                cornell.assert_equals(1,e.code)
+            cornell.assert_true(errors.getvalue() != '')
+        cornell.assert_false(os.path.exists(os.path.join(folder,'output.png')))
+
+
+def test_editor_parallel():
+    """
+    Tests the method getHalo in class Editor and the strip executor in parallel
+    """
+    print('Testing editor parallel strips')
+    import a6image
+    import a6editor
+    import parallel
+    p = pixels.Pixels(60)
+    for pos in range(60):
+        p[pos] = ((pos*7) % 256, (pos*53) % 256, (pos*31) % 256)
+    
+    editor = a6editor.Editor(a6image.Image(p,5))
+    cornell.assert_equals(0,editor.getHalo('invert'))
+    cornell.assert_equals(0,editor.getHalo('monochromify',True))
+    cornell.assert_equals(None,editor.getHalo('transpose'))
+    
+    minimum = parallel.MINIMUM
+    parallel.MINIMUM = 0
+    try:
+        for action in [('invert',),('monochromify',True),('reflectHori',)]:
+            serial = a6editor.Editor(a6image.Image(p,5))
+            getattr(serial,action[0])(*action[1:])
+            editor = a6editor.Editor(a6image.Image(p,5))
+            parallel.run(editor,*action,workers=3)
+            cornell.assert_equals(serial.getCurrent().getPixels().buffer,
+                                  editor.getCurrent().getPixels().buffer)
+        
+        # A single worker does one strip at a time, publishing each in order
+        serial = a6editor.Editor(a6image.Image(p,5))
+        serial.blur(1)
+        for order, tiles in [('top-down',[(0,15),(15,30),(30,45),(45,60)]),
+                             ('center-out',[(15,30),(30,45),(0,15),(45,60)])]:
+            editor = a6editor.Editor(a6image.Image(p,5))
+            parallel.run(editor,'blur',1,workers=1,order=order)
+            cornell.assert_equals(serial.getCurrent().getPixels().buffer,
+                                  editor.getCurrent().getPixels().buffer)
+            cornell.assert_equals(tiles,editor.getCurrent().getPixels().tiles())
+            cornell.assert_equals([],editor.getCurrent().getPixels().tiles())
+    finally:
+        parallel.MINIMUM = minimum
+
+
+def test_editor_convolve():
+    """
+    Tests the convolution methods in class Editor
+    """
+    print('Testing editor convolution')
+    import a6image
+    import a6editor
+    import convolution
+    import rank
+    
+    cornell.assert_equals(([1,2,1],[-1,0,1]),convolution.separate([[-1,0,1],[-2,0,2],[-1,0,1]]))
+    cornell.assert_equals(None,convolution.separate([[0,-1,0],[-1,5,-1],[0,-1,0]]))
+    
+    # Filters preserve a flat image (and find no edges in it)
+    p = pixels.Pixels(20)
+    for pos in range(20):
+        p[pos] = (10, 128, 250)
+    editor = a6editor.Editor(a6image.Image(p,5))
+    for action in [('blur',3),('sharpen',),('unsharpMask',2,1),('convolve',[[0.25,0.5,0.25]])]:
+        getattr(editor,action[0])(*action[1:])
+        for pos in range(20):
+            cornell.assert_equals((10, 128, 250),editor.getCurrent().getFlatPixel(pos))
+    editor.edges()
+    for pos in range(20):
+        cornell.assert_equals((0, 0, 0),editor.getCurrent().getFlatPixel(pos))
+    
+    # A single bright pixel spreads according to the kernel
+    p = pixels.Pixels(9)
+    p[4] = (200, 100, 40)
+    kernel = [[0,1,0],[1,4,1],[0,1,0]]
+    for edge in ['clamp','black']:
+        editor = a6editor.Editor(a6image.Image(p,3))
+        editor.convolve([[value/8 for value in row] for row in kernel], edge)
+        for pos in range(9):
+            weight = kernel[pos//3][pos % 3]
+            cornell.assert_equals((25*weight, round(12.5*weight), 5*weight),
+                                  editor.getCurrent().getFlatPixel(pos))
+    
+    # A median removes the bright pixel entirely
+    editor = a6editor.Editor(a6image.Image(p,3))
+    editor.median(1)
+    for pos in range(9):
+        cornell.assert_equals((0, 0, 0),editor.getCurrent().getFlatPixel(pos))
+    
+    # Erosion removes the bright pixel, and dilation spreads it everywhere
+    editor = a6editor.Editor(a6image.Image(p,3))
+    editor.dilate(1)
+    for pos in range(9):
+        cornell.assert_equals((200, 100, 40),editor.getCurrent().getFlatPixel(pos))
+    editor.erode(1)
+    for pos in range(9):
+        cornell.assert_equals((200, 100, 40),editor.getCurrent().getFlatPixel(pos))
+    for action in ['erode','opening']:
+        editor = a6editor.Editor(a6image.Image(p,3))
+        getattr(editor,action)(1)
+        for pos in range(9):
+            cornell.assert_equals((0, 0, 0),editor.getCurrent().getFlatPixel(pos))
+    
+    # Closing fills a dark gap, but keeps a large dark area
+    line = [200,200,0,200,200,0,0,0,0,0]
+    cornell.assert_equals([200,200,200,200,200,0,0,0,0,0],
+                          rank.min_plane(rank.max_plane(line,10,1,1),10,1,1))
+    cornell.assert_equals(rank.min_plane(line,10,1,2),rank.min_plane(line,1,10,2))
+    
+    # Small and large windows slide differently, but must agree
+    plane = [(pos*37) % 256 for pos in range(35)]
+    for radius, order in [(1,4),(2,0),(2,24),(3,20)]:
+        cornell.assert_equals(rank._huang(plane,7,5,radius,order),
+                              rank._perreault(plane,7,5,radius,order))
+    
+    # A big box costs nothing extra, and wraps around the image
+    editor = a6editor.Editor(a6image.Image(p,3))
+    editor.convolve([[1/9]*9], 'wrap')
+    for pos in range(9):
+        cornell.assert_equals((67, 33, 13) if pos//3 == 1 else (0, 0, 0),
+                              editor.getCurrent().getFlatPixel(pos))
+
+
+def test_editor_resize():
+    """
+    Tests the resize method in class Editor
+    """
+    print('Testing editor resize')
+    import a6image
+    import a6editor
+    import resample
+    
+    # A 4x2 image with a different color in each column
+    p = pixels.Pixels(8)
+    for pos in range(8):
+        p[pos] = (pos % 4*80, 40, 255-pos % 4*80)
+    
+    for method in resample.METHODS:
+        editor = a6editor.Editor(a6image.Image(p,4))
+        editor.resize(4,2,method)
+        cornell.assert_equals(list(p),list(editor.getCurrent().getPixels()))
+    
+    # Shrinking by a power of two averages 2x2 blocks
+    editor = a6editor.Editor(a6image.Image(p,4))
+    editor.increment()
+    editor.resize(2,1,'area')
+    cornell.assert_equals(2,editor.getCurrent().getWidth())
+    cornell.assert_equals(1,editor.getCurrent().getHeight())
+    cornell.assert_equals([(40, 40, 215),(200, 40, 55)],list(editor.getCurrent().getPixels()))
+    cornell.assert_equals(1.0,editor.getCurrent().getPixels().progress())
+    editor.undo()
+    cornell.assert_equals(4,editor.getCurrent().getWidth())
+    
+    # Area averages partial pixels too
+    editor.resize(3,2,'area')
+    cornell.assert_equals((20, 40, 235),editor.getCurrent().getPixel(0,0))
+    cornell.assert_equals((220, 40, 35),editor.getCurrent().getPixel(1,2))
+    
+    # Enlarging copies or blends
+    editor = a6editor.Editor(a6image.Image(p,4))
+    editor.resize(8,3,'nearest')
+    cornell.assert_equals(24,editor.getCurrent().getLength())
+    for row in range(3):
+        for col in range(8):
+            cornell.assert_equals(p[col//2],editor.getCurrent().getPixel(row,col))
+    editor = a6editor.Editor(a6image.Image(p,4))
+    editor.resize(8,2,'bilinear')
+    cornell.assert_equals((0, 40, 255),editor.getCurrent().getPixel(0,0))
+    cornell.assert_equals((20, 40, 235),editor.getCurrent().getPixel(0,1))
+    cornell.assert_equals((60, 40, 195),editor.getCurrent().getPixel(1,2))
+    cornell.assert_equals((240, 40, 15),editor.getCurrent().getPixel(1,7))
+
+
+def test_editor_affine():
+    """
+    Tests the affine methods in class Editor
+    """
+    print('Testing editor affine transforms')
+    import a6image
+    import a6editor
+    
+    p = pixels.Pixels(9)
+    for pos in range(9):
+        p[pos] = (pos*20, 255-pos*20, pos)
+    
+    # Right angles agree with the provided rotations, for either method
+    expected = a6editor.Editor(a6image.Image(p,3))
+    expected.rotateLeft()
+    for method in ['nearest','bilinear']:
+        editor = a6editor.Editor(a6image.Image(p,3))
+        editor.rotate(90,method)
+        cornell.assert_equals(list(expected.getCurrent().getPixels()),
+                              list(editor.getCurrent().getPixels()))
+        editor.rotate(-90,method)
+        cornell.assert_equals(list(p),list(editor.getCurrent().getPixels()))
+    
+    # Zooming in copies the center, and zooming out leaves a black border
+    editor = a6editor.Editor(a6image.Image(p,3))
+    editor.scale(3,method='nearest')
+    for pos in range(9):
+        cornell.assert_equals(p[4],editor.getCurrent().getFlatPixel(pos))
+    editor = a6editor.Editor(a6image.Image(p,3))
+    editor.scale(0.5,method='nearest')
+    cornell.assert_equals(p[4],editor.getCurrent().getFlatPixel(4))
+    cornell.assert_equals((0, 0, 0),editor.getCurrent().getFlatPixel(0))
+    
+    # A shear shifts rows by their distance from the center
+    editor = a6editor.Editor(a6image.Image(p,3))
+    editor.shear(1,method='nearest')
+    cornell.assert_equals([p[1],p[2],(0, 0, 0),p[3],p[4],p[5],(0, 0, 0),p[6],p[7]],
+                          list(editor.getCurrent().getPixels()))
+    
+    # Half a pixel to the right blends neighbors
+    editor = a6editor.Editor(a6image.Image(p,3))
+    editor.shear(0.5)
+    cornell.assert_equals((10, 245, 1),editor.getCurrent().getFlatPixel(0))
+    cornell.assert_equals(p[4],editor.getCurrent().getFlatPixel(4))
+    
+    # Maps are compact, and the cache stays within its byte budget
+    import resample
+    table = resample.affine_map(40,30,[[0.8,0.6],[-0.6,0.8]])
+    cornell.assert_equals(8*40*30,resample._nbytes(table))
+    cornell.assert_true(table is resample.affine_map(40,30,[[0.8,0.6],[-0.6,0.8]]))
+    budget = resample.MAP_BUDGET
+    try:
+        resample.MAP_BUDGET = 3*8*40*30
+        for angle in range(5):
+            resample.affine_map(40,30,[[1,angle],[0,1]])
+        cornell.assert_equals(3,len(resample._maps))
+        resample.affine_map(400,300,[[1,0.5],[0,1]])
+        cornell.assert_true(all(key[0] == 40 for key in resample._maps))
+    finally:
+        resample.MAP_BUDGET = budget
+        resample._maps.clear()
+
+
+def test_editor_tone():
+    """
+    Tests the histogram and tone adjustment methods in class Editor
+    """
+    print('Testing editor tone adjustments')
+    import a6image
+    import a6editor
+    
+    p = pixels.Pixels(4)
+    p[0] = (50, 100, 100)
+    p[1] = (50, 100, 200)
+    p[2] = (150, 100, 100)
+    p[3] = (100, 100, 150)
+    editor = a6editor.Editor(a6image.Image(p,2))
+    
+    red, green, blue, luma = editor.histogram()
+    cornell.assert_equals(2,red[50])
+    cornell.assert_equals(4,green[100])
+    cornell.assert_equals([2,1,1],[blue[100],blue[150],blue[200]])
+    cornell.assert_equals([1,1,1,1],[luma[85],luma[95],luma[105],luma[115]])
+    cornell.assert_equals(4,sum(luma))
+    cornell.assert_equals(3,len(editor.histogram(False)))
+    
+    # The luma of every pixel is its grey value in monochromify
+    data = bytes((n*97+n*n) % 256 for n in range(3*500))
+    other = a6editor.Editor(a6image.Image(pixels.Pixels.frombytes(data),25))
+    luma = other.histogram()[3]
+    other.increment()
+    other.monochromify(False)
+    cornell.assert_equals(other.histogram(False)[0],luma)
+    
+    # Levels stretch each channel, but leave a flat channel alone
+    editor.autoLevels(0)
+    cornell.assert_equals([(0, 100, 0),(0, 100, 255),(255, 100, 0),(128, 100, 128)],
+                          list(editor.getCurrent().getPixels()))
+    
+    # Equalizing spreads the values by their rank
+    editor = a6editor.Editor(a6image.Image(p,2))
+    editor.equalize()
+    cornell.assert_equals([(0, 100, 0),(0, 100, 255),(255, 100, 0),(128, 100, 128)],
+                          list(editor.getCurrent().getPixels()))
+
+
+def test_editor_fixed():
+    """
+    Tests that the integer versions of monochromify and vignette match the float ones
+    """
+    print('Testing editor fixed-point arithmetic')
+    import a6image
+    import a6editor
+    
+    # Every red and green value, with blues that put the brightness on an edge
+    data = []
+    for red in range(256):
+        for green in range(0,256,3):
+            blue = -(3*red+6*green) % 50
+            data.extend((red,green,blue))
+            data.extend((red,green,(blue+25) % 50+200))
+            data.extend((red,green,(red+green) % 256))
+    p = pixels.Pixels.frombytes(bytes(data))
+    
+    for sepia in [False,True]:
+        editor = a6editor.Editor(a6image.Image(p,256))
+        editor.monochromify(sepia)
+        for pos in range(len(p)):
+            red, green, blue = p[pos]
+            brightness = 0.3 * red + 0.6 * green + 0.1 * blue
+            if sepia:
+                rgb = (int(brightness),int(0.6*brightness),int(0.4*brightness))
+            else:
+                rgb = (int(brightness),int(brightness),int(brightness))
+            cornell.assert_equals(rgb,editor.getCurrent().getFlatPixel(pos))
+    
+    # Try odd sizes, as the centers are computed with //
+    for width, height in [(1,1),(17,11),(11,17),(40,3),(256,len(p)//256)]:
+        data = pixels.Pixels(width*height)
+        for pos in range(width*height):
+            data[pos] = p[pos]
+        editor = a6editor.Editor(a6image.Image(data,width))
+        editor.vignette()
+        hfD = (width**2 + height**2)**0.5
+        for row in range(height):
+            for col in range(width):
+                d = ((row - width//2)**2 + (col - height//2)**2)**0.5
+                vigt = max(0, 1 - (d/hfD)**2)
+                rgb = tuple(int(value*vigt) for value in data[row*width+col])
+                cornell.assert_equals(rgb,editor.getCurrent().getPixel(row,col))
+
+
+def test_editor_fusion():
+    """
+    Tests that point operations in class Editor are fused, but still have their own edits
+    """
+    print('Testing editor point operation fusion')
+    import a6image
+    import a6editor
+    import pointops
+    
+    p = pixels.Pixels(6)
+    for pos in range(6):
+        p[pos] = (pos*40, 250-pos*30, (pos*77) % 256)
+    
+    # The steps one at a time, from the original float formulas
+    steps = [list(p)]
+    steps.append([(255-r, 255-g, 255-b) for (r, g, b) in steps[-1]])
+    steps.append([(int(0.3*r+0.6*g+0.1*b),int(0.6*(0.3*r+0.6*g+0.1*b)),
+                   int(0.4*(0.3*r+0.6*g+0.1*b))) for (r, g, b) in steps[-1]])
+    steps.append([(255-r, 255-g, 255-b) for (r, g, b) in steps[-1]])
+    
+    editor = a6editor.Editor(a6image.Image(p,3))
+    for action in [('invert',),('monochromify',True),('invert',)]:
+        editor.increment()
+        getattr(editor,action[0])(*action[1:])
+        cornell.assert_true(editor.isPending())
+    cornell.assert_equals(3,len(editor._pending[-1][0]))
+    cornell.assert_equals(steps[3],list(editor.getCurrent().getPixels()))
+    cornell.assert_false(editor.isPending())
+    for pos in range(2,-1,-1):
+        editor.undo()
+        cornell.assert_equals(steps[pos],list(editor.getCurrent().getPixels()))
+    
+    # Tables fuse, and undo each other
+    cornell.assert_equals([],pointops.append([pointops.INVERT],pointops.INVERT))
+    stages = pointops.append([pointops.mono(False)],pointops.INVERT)
+    stages = pointops.append(stages,pointops.mono(True))
+    cornell.assert_equals(['mono','lut'],[kind for kind, _ in stages])
+
+
+def test_editor_symmetry():
+    """
+    Tests that symmetries in class Editor are composed, but still have their own edits
+    """
+    print('Testing editor symmetry composition')
+    import a6image
+    import a6editor
+    import dihedral
+    
+    # A 3x2 image, and its rows after each step
+    p = pixels.Pixels(6)
+    for pos in range(6):
+        p[pos] = (pos, pos+10, pos+20)
+    steps = [[0,1,2,3,4,5],[2,5,1,4,0,3],[5,2,4,1,3,0],[5,4,3,2,1,0]]
+    widths = [3,2,2,3]
+    
+    editor = a6editor.Editor(a6image.Image(p,3))
+    for action in ['rotateLeft','reflectHori','transpose']:
+        editor.increment()
+        getattr(editor,action)()
+        cornell.assert_true(editor.isPending())
+    cornell.assert_equals(dihedral.HALF_TURN,editor._pending[-1][1])
+    cornell.assert_equals(steps[3],[r for (r, g, b) in editor.getCurrent().getPixels()])
+    cornell.assert_equals(widths[3],editor.getCurrent().getWidth())
+    cornell.assert_false(editor.isPending())
+    for pos in range(2,-1,-1):
+        editor.undo()
+        image = editor.getCurrent()
+        cornell.assert_equals(steps[pos],[r for (r, g, b) in image.getPixels()])
+        cornell.assert_equals(widths[pos],image.getWidth())
+        cornell.assert_equals(2*3//widths[pos],image.getHeight())
+    
+    # Four turns (or two reflections) do nothing
+    for action in ['rotateRight']*4+['reflectVert']*2:
+        getattr(editor,action)()
+    cornell.assert_false(editor.isPending())
+    
+    # Point operations are applied with the symmetry
+    editor.invert()
+    editor.rotateLeft()
+    cornell.assert_equals([255-v for v in steps[1]],
+                          [r for (r, g, b) in editor.getCurrent().getPixels()])
+    
+    # Every composition is one of the eight elements
+    elements = [dihedral.IDENTITY,dihedral.TRANSPOSE,dihedral.REFLECT_HORI,
+                dihedral.REFLECT_VERT,dihedral.ROTATE_LEFT,dihedral.ROTATE_RIGHT,
+                dihedral.HALF_TURN,dihedral.ANTI_DIAGONAL]
+    for first in elements:
+        for second in elements:
+            cornell.assert_true(dihedral.compose(first,second) in elements)
+
+
+def test_editor_memo():
+    """
+    Tests the content hash of class Pixels and the result cache of the module memo
+    """
+    print('Testing editor result cache')
+    import a6image
+    import a6editor
+    import memo
+    
+    # The digest only depends on the contents, and follows every kind of change
+    p = pixels.Pixels(2*pixels.Pixels.BLOCK+5)
+    q = pixels.Pixels(2*pixels.Pixels.BLOCK+5)
+    cornell.assert_equals(p.digest(),q.digest())
+    hashes = list(p._hashes)
+    p[-1] = (1,2,3)
+    cornell.assert_equals(bytearray([0,0,1]),p._dirty)
+    cornell.assert_true(p.digest() != q.digest())
+    cornell.assert_equals(hashes[:2],p._hashes[:2])
+    cornell.assert_equals(bytearray(3),p._dirty)
+    q.buffer[-3:] = pixels.Pixels.frombytes(bytes([1,2,3])).buffer
+    q.mark(len(q)-1,len(q))
+    cornell.assert_equals(p.digest(),q.digest())
+    cornell.assert_equals(p._hashes,p[:]._hashes)
+    
+    # Results are reused, even after undo
+    p = pixels.Pixels(12)
+    for pos in range(12):
+        p[pos] = (pos*20, 100, 255-pos*20)
+    editor = a6editor.Editor(a6image.Image(p,4))
+    cache  = memo.ResultCache()
+    editor.increment()
+    memo.run(cache,editor,'pixellate',2)
+    first = list(editor.getCurrent().getPixels())
+    cornell.assert_equals(1,len(cache))
+    editor.undo()
+    editor.increment()
+    memo.run(cache,editor,'pixellate',2,runner=lambda editor, op, *args: None)
+    cornell.assert_equals(first,list(editor.getCurrent().getPixels()))
+    
+    # Waiting point operations are part of the key, and a miss applies both in one pass
+    import pointops
+    apply = pointops.apply
+    passes = []
+    def counted(planes, stages):
+        passes.append(len(stages))
+        return apply(planes, stages)
+    expect = a6editor.Editor(a6image.Image(p[:],4))
+    expect.invert()
+    expect.getCurrent()
+    expect.monochromify(True)
+    expect = list(expect.getCurrent().getPixels())
+    pointops.apply = counted
+    try:
+        for attempt in range(2):
+            editor = a6editor.Editor(a6image.Image(p[:],4))
+            editor.increment()
+            editor.invert()
+            editor.increment()
+            memo.run(cache,editor,'monochromify',True)
+            cornell.assert_equals([2] if attempt == 0 else [],passes)
+            passes.clear()
+            cornell.assert_equals(expect,list(editor.getCurrent().getPixels()))
+        editor = a6editor.Editor(a6image.Image(p[:],4))
+        cornell.assert_true(not memo.editkey(editor,'monochromify',True) in cache)
+    finally:
+        pointops.apply = apply
+    
+    # Results that do not fit are thrown away, oldest first
+    cache = memo.ResultCache(72)
+    for step in range(3):
+        memo.run(cache,editor,'rotateLeft')
+    cornell.assert_equals(2,len(cache))
+    cornell.assert_equals(72,cache.getSize())
+    cache.put(('big',),a6image.Image(pixels.Pixels(25),5))
+    cornell.assert_equals(2,len(cache))
+    
+    # Files are known by their path, time and size
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory() as folder:
+        file = os.path.join(folder,'image.npy')
+        with open(file,'wb') as stream:
+            stream.write(b'old')
+        name = memo.filekey(file)
+        cornell.assert_equals(name,memo.filekey(os.path.relpath(file)))
+        os.utime(file,ns=(0,0))
+        cornell.assert_not_equals(name,memo.filekey(file))
+
+
+def test_editor_cancel():
+    """
+    Tests cancelling operations in class Editor, with and without the module parallel
+    """
+    print('Testing editor cancellation')
+    import a6image
+    import a6editor
+    import parallel
+    import convolution
+    import rank
+    import resample
+    p = pixels.Pixels(60)
+    for pos in range(60):
+        p[pos] = ((pos*7) % 256, (pos*53) % 256, (pos*31) % 256)
+    
+    editor = a6editor.Editor(a6image.Image(p,5))
+    for action in [('blur',1),('pixellate',2),('vignette',),('median',1),('erode',1),
+                   ('edges',),('jail',),('resize',8,8),('rotate',10),('scale',2)]:
+        editor.increment()
+        cornell.assert_false(editor.isCancelled())
+        editor.cancel()
+        cornell.assert_true(editor.isCancelled())
+        try:
+            getattr(editor,action[0])(*action[1:])
+            cornell.assert_true(False)
+        except a6editor.Cancelled:
+            pass
+        editor.undo()
+        cornell.assert_equals(p.buffer,editor.getCurrent().getPixels().buffer)
+    
+    minimum = parallel.MINIMUM
+    parallel.MINIMUM = 0
+    try:
+        editor.increment()
+        editor.cancel()
+        try:
+            parallel.run(editor,'blur',1,workers=1)
+            cornell.assert_true(False)
+        except a6editor.Cancelled:
+            pass
+        cornell.assert_equals([],editor.getCurrent().getPixels().tiles())
+    finally:
+        parallel.MINIMUM = minimum
+    
+    # Long passes stop between rows, not just between channels
+    rows = []
+    def checkpoint():
+        rows.append(len(rows))
+        if len(rows) == 3:
+            raise a6editor.Cancelled()
+    plane = list(range(60))
+    for call in [lambda: convolution.filter_plane(plane,5,12,[[1,2,1]],checkpoint=checkpoint),
+                 lambda: convolution.gaussian(plane,5,12,2,checkpoint=checkpoint),
+                 lambda: rank.median_plane(plane,5,12,1,checkpoint),
+                 lambda: rank.max_plane(plane,5,12,1,checkpoint),
+                 lambda: resample.resize(p.buffer,5,12,10,24,'bilinear',checkpoint),
+                 lambda: resample.affine_map(5,12,[[1,0.5],[0,1]],'bilinear',checkpoint)]:
+        rows.clear()
+        try:
+            call()
+            cornell.assert_true(False)
+        except a6editor.Cancelled:
+            pass
+        cornell.assert_equals(3,len(rows))
+    
+    # A new edit is not cancelled
+    editor.undo()
+    editor.increment()
+    editor.blur(1)
+    cornell.assert_true(p.buffer != editor.getCurrent().getPixels().buffer)
+
+
+def test_imagefile():
+    """
+    Tests the image file support in the module imagefile
+    """
+    print('Testing image files')
+    import os.path
+    import imagefile
+    import a6history
+    import a6editor
+    from array import array
+    from PIL import Image as CoreImage
+    
+    file = os.path.join(os.path.split(__file__)[0],'im_walker.png')
+    image = imagefile.read_image(file)
+    expect = CoreImage.open(file).convert('RGB')
+    cornell.assert_equals(expect.size,(image.getWidth(),image.getHeight()))
+    cornell.assert_equals([tuple(pixel) for pixel in expect.getdata()],list(image.getPixels()))
+    cornell.assert_equals(0,image.getPixels().progress())
+    
+    # Saving is lossless at every setting
+    import tempfile
+    with tempfile.TemporaryDirectory() as folder:
+        for level, strategy in [(6,'default'),(1,'rle'),(0,'huffman')]:
+            output = os.path.join(folder,'output.png')
+            imagefile.write_png(image,output,level,strategy)
+            copy = imagefile.read_image(output)
+            cornell.assert_equals(image.getWidth(),copy.getWidth())
+            cornell.assert_equals(image.getPixels().buffer,copy.getPixels().buffer)
+        
+        # Photographs are no larger than PIL makes them at the same level
+        for level in [1,6]:
+            imagefile.write_png(image,output,level)
+            theirs = os.path.join(folder,'theirs.png')
+            expect.save(theirs,'PNG',compress_level=level)
+            cornell.assert_true(os.path.getsize(output) <= os.path.getsize(theirs))
+        os.remove(theirs)
+        
+        # Odd shapes, with progress after each band
+        import a6image
+        band = imagefile.BAND
+        imagefile.BAND = 6
+        try:
+            for width in [1,2,7]:
+                data  = bytes((n*37) % 256 for n in range(63*width))
+                small = a6image.Image(pixels.Pixels.frombytes(data),width)
+                seen = []
+                imagefile.write_png(small,output,progress=seen.append)
+                copy = imagefile.read_image(output)
+                cornell.assert_equals(width,copy.getWidth())
+                cornell.assert_equals(small.getPixels().buffer,copy.getPixels().buffer)
+                cornell.assert_equals(1,seen[-1])
+                cornell.assert_equals(sorted(seen),seen)
+        finally:
+            imagefile.BAND = band
+        
+        # Single rows and columns (including a row longer than a band) decode in PIL
+        lines = os.path.join(folder,'lines.png')
+        for width, height in [(1,1),(1,3001),(3001,1),(imagefile.BAND//3+5,1)]:
+            data = bytes((n*101) % 256 for n in range(3*width*height))
+            line = a6image.Image(pixels.Pixels.frombytes(data),width)
+            imagefile.write_png(line,lines)
+            with CoreImage.open(lines) as decoded:
+                cornell.assert_equals(('RGB',(width,height)),(decoded.mode,decoded.size))
+                cornell.assert_equals(data,decoded.tobytes())
+        os.remove(lines)
+        
+        # Empty images cannot be saved as PNG, and leave any old file alone
+        before = os.path.getsize(output)
+        try:
+            imagefile.write_png(a6image.Image(pixels.Pixels(0),1),output)
+            cornell.assert_true(False)
+        except ValueError:
+            pass
+        cornell.assert_equals(before,os.path.getsize(output))
+        cornell.assert_equals(['output.png'],os.listdir(folder))
+        
+        # A failed save leaves the old file alone, and no temporary files
+        def fail(fraction):
+            raise RuntimeError('stop')
+        try:
+            imagefile.write_png(image,output,progress=fail)
+            cornell.assert_true(False)
+        except RuntimeError:
+            pass
+        cornell.assert_equals(['output.png'],os.listdir(folder))
+        cornell.assert_equals(7,imagefile.read_image(output).getWidth())
+        
+        # Raw files are read straight into the buffer, others a band at a time
+        band = imagefile.BAND
+        imagefile.BAND = 1000
+        try:
+            for format in ['PPM','TIFF','BMP','JPEG']:
+                output = os.path.join(folder,'output.'+format.lower())
+                expect.save(output,format)
+                image = imagefile.read_image(output)
+                decoded = CoreImage.open(output).convert('RGB').tobytes()
+                cornell.assert_equals(expect.size,(image.getWidth(),image.getHeight()))
+                cornell.assert_equals(decoded,image.getPixels().buffer.tobytes())
+        finally:
+            imagefile.BAND = band
+        
+        # JPEG files can be decoded at a smaller size, but never smaller than asked
+        image = imagefile.read_image(output,(100,100))
+        cornell.assert_equals((150,188),(image.getWidth(),image.getHeight()))
+        
+        # Other files are shrunk by a whole factor after decoding, also never too small
+        image = imagefile.read_image(file,(100,100))
+        cornell.assert_equals((120,150),(image.getWidth(),image.getHeight()))
+        cornell.assert_equals(expect.reduce(5).tobytes(),image.getPixels().buffer.tobytes())
+        image = imagefile.read_image(file,(300,400))
+        cornell.assert_equals(expect.size,(image.getWidth(),image.getHeight()))
+        gif = os.path.join(folder,'output.gif')
+        expect.save(gif)
+        image = imagefile.read_image(gif,(100,100))
+        cornell.assert_equals((120,150),(image.getWidth(),image.getHeight()))
+        
+        # Drafts are only read when they are smaller
+        image = imagefile.read_draft(output,(100,100))
+        cornell.assert_equals((150,188),(image.getWidth(),image.getHeight()))
+        cornell.assert_equals(None,imagefile.read_draft(output,(1000,1000)))
+        cornell.assert_equals(None,imagefile.read_draft(file,(100,100)))
+        
+        # Sizes are read from the header alone
+        cornell.assert_equals(expect.size,imagefile.read_size(output))
+        cornell.assert_equals(expect.size,imagefile.read_size(file))
+
+        # Native files are mapped into memory, and changes never reach the file
+        output = os.path.join(folder,'output.npy')
+        imagefile.write_image(image,output,progress=seen.append)
+        cornell.assert_equals(1,seen[-1])
+        with open(output,'rb') as stream:
+            cornell.assert_equals(b'\x93NUMPY\x01\x00',stream.read(8))
+        copy = imagefile.read_image(output)
+        cornell.assert_equals(memoryview,type(copy.getPixels().buffer))
+        cornell.assert_equals(image.getWidth(),copy.getWidth())
+        cornell.assert_equals(image.getPixels().buffer.tobytes(),copy.getPixels().buffer.tobytes())
+        
+        # Copies are new mappings until the image is changed, and then real copies
+        other = copy.getPixels()[:]
+        cornell.assert_equals(memoryview,type(other.buffer))
+        history = a6history.ImageHistory(copy)
+        cornell.assert_equals(memoryview,type(history.getCurrent().getPixels().buffer))
+        history.getCurrent().getPixels()[0] = (4,5,6)
+        copy.getPixels()[0] = (1,2,3)
+        cornell.assert_equals((1,2,3),copy.getPixels()[0])
+        cornell.assert_equals(image.getPixels()[0],other[0])
+        cornell.assert_equals((4,5,6),history.getCurrent().getPixels()[0])
+        cornell.assert_equals(image.getPixels()[0],imagefile.read_image(output).getPixels()[0])
+        cornell.assert_equals(array,type(copy.getPixels()[:].buffer))
+        cornell.assert_equals((1,2,3),copy.getPixels()[:][0])
+        del other, history
+        
+        # Saving over a mapped file leaves the mapping alone
+        imagefile.write_image(a6image.Image(pixels.Pixels.frombytes(bytes(6)),1),output)
+        cornell.assert_equals((1,2,3),copy.getPixels()[0])
+        cornell.assert_equals(2,imagefile.read_image(output).getHeight())
+        
+        editor = a6editor.Editor(copy)
+        editor.invert()
+        cornell.assert_equals((254,253,252),editor.getCurrent().getPixels()[0])
+        del copy, editor
+
+
+def test_thumbnail():
+    """
+    Tests the thumbnail cache in the module thumbnail
+    """
+    print('Testing thumbnails')
+    import os
+    import tempfile
+    import threading
+    import imagefile
+    import thumbnail
+    
+    file = os.path.join(os.path.split(__file__)[0],'im_walker.png')
+    with tempfile.TemporaryDirectory() as folder:
+        cache = thumbnail.ThumbnailCache(os.path.join(folder,'cache'))
+        path = cache.get(file)
+        cornell.assert_equals(os.path.join(folder,'cache'),os.path.split(path)[0])
+        image = imagefile.read_image(path)
+        cornell.assert_equals((102,128),(image.getWidth(),image.getHeight()))
+        cornell.assert_equals(path,cache.get(file))
+        cornell.assert_equals(os.path.getsize(path),cache.getSize())
+        
+        # A changed file gets a new thumbnail, and old ones are evicted
+        image = os.path.join(folder,'image.png')
+        with open(file,'rb') as source, open(image,'wb') as target:
+            target.write(source.read())
+        cache = thumbnail.ThumbnailCache(os.path.join(folder,'cache'),budget=cache.getSize()+1)
+        os.utime(path,ns=(0,0))
+        first = cache.get(image)
+        os.utime(image,ns=(0,0))
+        second = cache.get(image)
+        cornell.assert_not_equals(first,second)
+        cornell.assert_equals([os.path.split(second)[1]],os.listdir(os.path.join(folder,'cache')))
+        cornell.assert_equals(os.path.getsize(second),cache.getSize())
+        
+        # Thumbnails are made in the background, in order
+        text = os.path.join(folder,'text.txt')
+        with open(text,'w') as stream:
+            stream.write('no image')
+        seen = []
+        done = threading.Event()
+        def report(file, path):
+            seen.append((file,path))
+            if len(seen) == 2:
+                done.set()
+        cache.request([text,image],report)
+        cornell.assert_true(done.wait(10))
+        cornell.assert_equals([(text,None),(image,second)],seen)
+        
+        # Cancelling drops the files still waiting, but finishes the current one
+        seen = []
+        busy = threading.Event()
+        release = threading.Event()
+        def hold(file, path):
+            seen.append(file)
+            busy.set()
+            release.wait(10)
+        cache.request([text,image,text],hold)
+        cornell.assert_true(busy.wait(10))
+        worker = cache._thread
+        cache.cancel()
+        release.set()
+        worker.join(10)
+        cornell.assert_equals([text],seen)
+        
+        cache.clear()
+        cornell.assert_equals([],os.listdir(os.path.join(folder,'cache')))
+        cornell.assert_equals(0,cache.getSize())
+
+
+def test_batch():
+    """
+    Tests batch processing in the module batch
+    """
+    print('Testing batch processing')
+    import os
+    import tempfile
+    import imagefile
+    import a6editor
+    import batch
+    
+    cornell.assert_equals(('monochromify',(True,)),batch.parse_action('monochromify:True'))
+    cornell.assert_equals(('resize',(10,20,'area')),batch.parse_action('resize:10, 20,area'))
+    cornell.assert_equals(('vignette',()),batch.parse_action('vignette'))
+    for text in ['nothing','_flush','resize:100','pixellate:"20"','blur:0','rotate:90,cubic']:
+        try:
+            batch.parse_action(text)
+            cornell.assert_true(False)
+        except ValueError:
+            pass
+    
+    file = os.path.join(os.path.split(__file__)[0],'im_border.png')
+    actions = [batch.parse_action('invert'),batch.parse_action('reflectHori')]
+    with tempfile.TemporaryDirectory() as folder:
+        files = [file,os.path.join(folder,'bad.jpg')]
+        with open(files[1],'w') as stream:
+            stream.write('no image')
+        output = os.path.join(folder,'output')
+        lines = []
+        cornell.assert_equals(1,batch.run(files,output,actions,1,lines.append))
+        cornell.assert_equals(3,len(lines))
+        cornell.assert_true(lines[-1].startswith('Processed 2 files (1 failed)'))
+        
+        editor = a6editor.Editor(imagefile.read_image(file))
+        editor.invert()
+        editor.reflectHori()
+        result = imagefile.read_image(batch.targets(files,output)[0])
+        cornell.assert_equals(editor.getCurrent().getPixels().buffer,result.getPixels().buffer)
+        
+        # Files that only differ by extension get different outputs
+        twins = [os.path.join(folder,'gries.jpg'),os.path.join(folder,'gries.png')]
+        names = batch.targets(twins,output)
+        cornell.assert_equals([os.path.join(output,'gries.jpg.png'),
+                               os.path.join(output,'gries.png.png')],names)
+        
+        # Finished files are skipped until they (or the actions) change
+        lines = []
+        cornell.assert_equals(1,batch.run(files,output,actions,1,lines.append))
+        cornell.assert_equals('Skipped 1 unchanged files',lines[0])
+        cornell.assert_equals(3,len(lines))
+        lines = []
+        batch.run(files[:1],output,actions[:1],1,lines.append)
+        cornell.assert_equals(2,len(lines))
+        os.utime(files[1],ns=(0,0))
+        with open(files[1],'wb') as stream, open(file,'rb') as source:
+            stream.write(source.read())
+        lines = []
+        cornell.assert_equals(0,batch.run(files,output,actions,1,lines.append))
+        cornell.assert_equals(3,len(lines))
+        lines = []
+        cornell.assert_equals(0,batch.run(files,output,actions,1,lines.append))
+        cornell.assert_equals(['Skipped 2 unchanged files'],lines)
+        
+        # Pipelines name their arguments, and are checked before anything is run
+        pipeline = os.path.join(folder,'pipeline.json')
+        with open(pipeline,'w') as stream:
+            stream.write('{"steps": [{"op": "pixellate", "step": 20}, {"op": "jail"},'+
+                         ' {"op": "shear", "x": 0.5, "method": "nearest"}]}')
+        cornell.assert_equals([('pixellate',(20,)),('jail',()),('shear',(0.5,0,'nearest'))],
+                              batch.load_pipeline(pipeline))
+        cornell.assert_equals(batch.fingerprint([('pixellate',(20,))]),
+                              batch.fingerprint([batch.parse_action('pixellate:20')]))
+        for step in [{'op': 'pixellate'},{'op': 'jail', 'step': 2},{'op': 'undo'},['jail'],
+                     {'op': 'pixellate', 'step': '20'},{'op': 'affine', 'matrix': [[1,2],[2,4]]}]:
+            try:
+                batch.parse_step(step)
+                cornell.assert_true(False)
+            except ValueError:
+                pass
+        
+        # Bad arguments are reported with their step before any file is read
+        with open(pipeline,'w') as stream:
+            stream.write('[{"op": "jail"}, {"op": "pixellate", "step": "20"}]')
+        try:
+            batch.load_pipeline(pipeline)
+            cornell.assert_true(False)
+        except ValueError as e:
+            cornell.assert_true(str(e).startswith('Step 2 of'))
+            cornell.assert_true("step='20'" in str(e))
+
+        # A worker count below 1 is a usage error, checked before any file is read
+        import io
+        import contextlib
+        main = load_main()
+        for workers in [0,-1]:
+            errors = io.StringIO()
+            try:
+                with contextlib.redirect_stderr(errors):
+                    main.batch(file,['invert'],output,workers)
+                cornell.assert_true(False)
+            except SystemExit as e:
+                cornell.assert_equals(2,e.code)
+            cornell.assert_true('workers' in errors.getvalue())
+        cornell.assert_true(test_assert(batch.run,[files,output,actions,0],
+                                        'Invalid workers are not rejected'))
+
+
 def test_all():
     """
     Execute all of the test cases.
@@ -361,3 +1352,19 @@ def test_all():
     test_hist_init()
     test_hist_edit()
     print('Class ImageHistory appears to be working correctly')
+    print()
+    test_editor_stream()
+    test_editor_parallel()
+    test_editor_convolve()
+    test_editor_resize()
+    test_editor_affine()
+    test_editor_tone()
+    test_editor_fixed()
+    test_editor_fusion()
+    test_editor_symmetry()
+    test_editor_memo()
+    test_editor_cancel()
+    test_imagefile()
+    test_thumbnail()
+    test_batch()
+    print('Class Editor appears to be working correctly')
@@ -0,0 +1,389 @@
+"""
+Batch processing for the imager application
+
+Applying the same filters to a whole folder of photos should not take a click per file.
+This module performs a list of Editor operations on every file matching a pattern, and
+saves the results as PNG files in an output folder.  It never imports Kivy, so it can
+run on a machine without a display.
+
+The files are shared out among worker processes, each of which reads, edits, and saves
+a whole file at a time.  This is simpler (and scales better) than splitting each image
+into strips like the module parallel does, as there are many files to go around.  The
+time taken by each file is reported as it is finished, followed by a summary of the
+throughput at the end.
+
+An action is written as the name of an Editor method, followed by a colon and the
+arguments separated by commas (such as 'monochromify:True' or 'pixellate:10').  The
+arguments are read as Python literals where possible, and as strings otherwise.
+
+Longer lists of actions can be kept in a JSON pipeline file (see load_pipeline), where
+each step gives its arguments by name, like {"op": "pixellate", "step": 20}.  Every
+action is checked before any file is read (see check_action), so that a typo does not
+fail every file in turn.
+
+Each run keeps a journal in the output folder, recording every file finished with its
+modification time and size, and a hash of the actions (see fingerprint).  A file whose
+entry still matches (and whose output is still there) is skipped.  So a run that was
+interrupted picks up where it stopped, and running the same pipeline again only
+processes the files that have changed.
+"""
+import os
+
+
+# The name of the journal file in the output folder
+JOURNAL = '.journal'
+
+# The Editor methods that are not image operations
+_CONTROLS = ('getCurrent','isPending','getWaiting','isCancelled','getHalo','histogram','undo',
+             'clear','increment','restore','cancel','checkpoint','decode','encodeStream',
+             'decodeStream')
+
+
+def parse_action(text):
+    """
+    Returns: The action (op, args) for the given text
+    
+    If the text does not name an Editor operation, this function raises a ValueError.
+    
+    Parameter text: The action, written as op or op:arg,arg,...
+    Precondition: text is a string
+    """
+    import ast
+    op, _, rest = text.partition(':')
+    _operation(op)
+    
+    args = []
+    for arg in rest.split(',') if rest else []:
+        try:
+            args.append(ast.literal_eval(arg.strip()))
+        except (ValueError, SyntaxError):
+            args.append(arg.strip())
+    check_action(op, args)
+    return (op, tuple(args))
+
+
+def parse_step(step):
+    """
+    Returns: The action (op, args) for the given pipeline step
+    
+    The step is a dictionary with the name of an Editor method under 'op', and its
+    arguments under their parameter names.  Arguments with defaults may be left out.
+    If the step does not match the signature of the method, or its arguments are not
+    valid (see check_action), this function raises a ValueError.
+    
+    Parameter step: The pipeline step
+    Precondition: step is a dictionary
+    """
+    import inspect
+    if type(step) != dict or type(step.get('op')) != str:
+        raise ValueError(repr(step)+' is not a pipeline step')
+    
+    params = dict(step)
+    op = params.pop('op')
+    try:
+        bound = inspect.signature(_operation(op)).bind(None,**params)
+    except TypeError as e:
+        raise ValueError(repr(op)+': '+str(e))
+    bound.apply_defaults()
+    check_action(op, bound.args[1:])
+    return (op, bound.args[1:])
+
+
+def load_pipeline(file):
+    """
+    Returns: The list of actions (op, args) in the given pipeline file
+    
+    The file is JSON, holding either a list of steps or an object with the list of
+    steps under 'steps' (see parse_step).  For example
+        
+        {"steps": [{"op": "pixellate", "step": 20}, {"op": "jail"}]}
+    
+    If the file is not a valid pipeline, this function raises a ValueError naming the
+    first bad step.
+    
+    Parameter file: The pipeline file
+    Precondition: file is a string naming an existing file
+    """
+    import json
+    with open(file) as stream:
+        spec = json.load(stream)
+    steps = spec.get('steps') if type(spec) == dict else spec
+    if type(steps) != list:
+        raise ValueError(repr(file)+' does not have a list of steps')
+    result = []
+    for pos, step in enumerate(steps):
+        try:
+            result.append(parse_step(step))
+        except ValueError as e:
+            raise ValueError('Step '+str(pos+1)+' of '+repr(file)+': '+str(e))
+    return result
+
+
+def check_action(op, args):
+    """
+    Checks that the given action can be performed, raising a ValueError if not.
+    
+    The Editor methods check their arguments with assert statements.  So the action is
+    tried on a 1x1 image, with the editor already cancelled so that the operation stops
+    at its first checkpoint, once its arguments have been checked.  The error names
+    the arguments in the failed check.
+    
+    Parameter op: The name of the Editor operation
+    Precondition: op is a string
+    
+    Parameter args: The arguments to the operation
+    Precondition: args is a sequence
+    """
+    import re
+    import inspect
+    import traceback
+    import pixels
+    import a6image
+    import a6editor
+    try:
+        bound = inspect.signature(_operation(op)).bind(None,*args)
+    except TypeError as e:
+        raise ValueError(repr(op)+': '+str(e))
+    
+    editor = a6editor.Editor(a6image.Image(pixels.Pixels(1),1))
+    editor.increment()
+    editor.cancel()
+    try:
+        getattr(editor,op)(*args)
+        editor.getCurrent()
+    except a6editor.Cancelled:
+        pass
+    except Exception as e:
+        check = traceback.extract_tb(e.__traceback__)[-1].line or type(e).__name__
+        names = [name for name in list(bound.arguments)[1:] if re.search(r'\b'+name+r'\b',check)]
+        bad = ', '.join(name+'='+repr(bound.arguments[name]) for name in names)
+        msg = str(e) if str(e) else 'failed '+repr(check)
+        raise ValueError(repr(op)+': '+('bad '+bad+' ('+msg+')' if bad else msg))
+
+
+def fingerprint(actions):
+    """
+    Returns: A hash of the given actions, as a string
+    
+    Two lists of actions have the same hash exactly when they perform the same
+    operations with the same arguments.
+    
+    Parameter actions: The operations to perform
+    Precondition: actions is a list of (op, args) made by parse_action or parse_step
+    """
+    import hashlib
+    return hashlib.sha256(repr([(op,tuple(args)) for op, args in actions]).encode()).hexdigest()
+
+
+def targets(files, output):
+    """
+    Returns: The output file for each of the given files
+    
+    The outputs mirror the folders of the files below the folder they all share, so
+    that files with the same name in different folders do not overwrite each other.
+    Each output is a PNG file named after the whole input name (so gries.jpg is saved
+    as gries.jpg.png), as files may share a name with different extensions.
+    
+    Parameter files: The files to process
+    Precondition: files is a non-empty list of strings
+    
+    Parameter output: The output folder
+    Precondition: output is a string
+    """
+    files = [os.path.abspath(file) for file in files]
+    root  = os.path.commonpath([os.path.dirname(file) for file in files])
+    return [os.path.join(output,os.path.relpath(file,root)+'.png') for file in files]
+
+
+def process(file, target, actions):
+    """
+    Returns: A report (file, pixels, seconds, error) on processing the given file
+    
+    The file is read, edited with each action in order, and saved to target.  The
+    report has the number of pixels in the image, the time taken, and a message if
+    anything went wrong (or None if it did not).
+    
+    This is the function performed by the worker processes.
+    
+    Parameter file: The file to process
+    Precondition: file is a string
+    
+    Parameter target: The file to save the result to
+    Precondition: target is a string
+    
+    Parameter actions: The operations to perform
+    Precondition: actions is a list of (op, args) made by parse_action
+    """
+    import time
+    import imagefile
+    import a6editor
+    start = time.perf_counter()
+    size  = 0
+    try:
+        editor = a6editor.Editor(imagefile.read_image(file))
+        size = editor.getCurrent().getLength()
+        for op, args in actions:
+            editor.increment()
+            getattr(editor,op)(*args)
+        os.makedirs(os.path.dirname(target),exist_ok=True)
+        imagefile.write_png(editor.getCurrent(),target)
+        error = None
+    except Exception as e:
+        error = type(e).__name__+': '+str(e)
+    return (file, size, time.perf_counter()-start, error)
+
+
+def run(files, output, actions, workers=None, report=print):
+    """
+    Returns: The number of files that could not be processed
+    
+    Each file is processed (see process) by a pool of worker processes.  A line is
+    reported for each file as it is finished, and a summary is reported at the end.
+    
+    Files that the journal shows were finished with the same actions, and have not
+    changed since, are skipped.  Every file finished is added to the journal as soon
+    as its output is saved.
+    
+    Parameter files: The files to process
+    Precondition: files is a list of strings
+    
+    Parameter output: The output folder
+    Precondition: output is a string
+    
+    Parameter actions: The operations to perform
+    Precondition: actions is a list of (op, args) made by parse_action
+    
+    Parameter workers: The number of worker processes (parallel.WORKERS if None)
+    Precondition: workers is an int > 0 or None
+    
+    Parameter report: The function to report progress with
+    Precondition: report is a function taking a string
+    """
+    import time
+    import parallel
+    from multiprocessing import Pool
+    assert workers is None or type(workers) == int, repr(workers)+' is not an int'
+    assert workers is None or workers > 0, repr(workers)+' is not a valid number of workers'
+    
+    if not files:
+        report('No files to process')
+        return 0
+    
+    import memo
+    workers = parallel.WORKERS if workers is None else workers
+    journal = os.path.join(output,JOURNAL)
+    done = _read_journal(journal)
+    digest = fingerprint(actions)
+    
+    # The keys are taken before processing, so files changed during the run are redone
+    tasks = []
+    jobs  = {}
+    for file, target in zip(files,targets(files,output)):
+        key = list(memo.filekey(file))
+        entry = done.get(key[0])
+        if (entry and entry['key'] == key and entry['actions'] == digest and
+            entry['target'] == os.path.abspath(target) and os.path.isfile(target)):
+            continue
+        tasks.append((file, target, actions))
+        jobs[file] = (key, os.path.abspath(target))
+    if len(tasks) < len(files):
+        report('Skipped {} unchanged files'.format(len(files)-len(tasks)))
+    if not tasks:
+        return 0
+    
+    start = time.perf_counter()
+    failed = 0
+    pixels = 0
+    os.makedirs(output,exist_ok=True)
+    with Pool(min(workers,len(tasks))) as pool, open(journal,'a') as stream:
+        for file, size, seconds, error in pool.imap_unordered(_process,tasks):
+            if error is None:
+                pixels += size
+                _write_journal(stream,*jobs[file],digest)
+                report('{}: {:.3f}s'.format(file,seconds))
+            else:
+                failed += 1
+                report('{}: failed ({})'.format(file,error))
+    
+    elapsed = time.perf_counter()-start
+    msg = 'Processed {} files ({} failed) in {:.2f}s with {} workers: {:.2f} files/s, {:.2f} megapixels/s'
+    report(msg.format(len(tasks),failed,elapsed,min(workers,len(tasks)),
+                      (len(tasks)-failed)/elapsed,pixels/elapsed/1e6))
+    return failed
+
+
+# HELPERS
+def _operation(op):
+    """
+    Returns: The Editor method for the given image operation
+    
+    If op is not the name of an image operation, this function raises a ValueError.
+    
+    Parameter op: The name of the operation
+    Precondition: op is a string
+    """
+    import a6editor
+    method = getattr(a6editor.Editor,op,None)
+    if op.startswith('_') or op in _CONTROLS or not callable(method):
+        raise ValueError(repr(op)+' is not an Editor operation')
+    return method
+
+
+def _read_journal(journal):
+    """
+    Returns: The entries of the given journal, by absolute input file
+    
+    Lines that cannot be read (such as a last line cut short when a run was killed)
+    are ignored.  If there is no journal, the result is empty.
+    
+    Parameter journal: The journal file
+    Precondition: journal is a string
+    """
+    import json
+    result = {}
+    try:
+        with open(journal) as stream:
+            for line in stream:
+                try:
+                    entry = json.loads(line)
+                    result[entry['file']] = entry
+                except (ValueError, KeyError, TypeError):
+                    pass
+    except FileNotFoundError:
+        pass
+    return result
+
+
+def _write_journal(stream, key, target, digest):
+    """
+    Adds an entry for a finished file to the journal, and forces it to disk.
+    
+    Parameter stream: The journal, open for appending
+    Precondition: stream is a text file
+    
+    Parameter key: The key of the file that was processed (see memo.filekey)
+    Precondition: key is a list [path, time, size]
+    
+    Parameter target: The absolute path of the output file
+    Precondition: target is a string
+    
+    Parameter digest: The fingerprint of the actions
+    Precondition: digest is a string
+    """
+    import json
+    entry = {'file': key[0], 'key': key, 'actions': digest, 'target': target}
+    stream.write(json.dumps(entry)+'\n')
+    stream.flush()
+    os.fsync(stream.fileno())
+
+
+def _process(task):
+    """
+    Returns: The report of process for the given task
+    
+    Pool.imap_unordered only passes a single argument, so this unpacks it.
+    
+    Parameter task: The arguments to process
+    Precondition: task is a tuple (file, target, actions)
+    """
+    return process(*task)
@@ -0,0 +1,448 @@
+"""
+Convolution support for the imager application
+
+The neighborhood filters in Editor (blur, sharpen, edge detection) are all built on the
+functions in this module.  These functions do not work on Image objects.  Instead they
+work on planes: flat lists holding a single color channel of the image in row-major
+order.  Splitting the image into planes lets us do the arithmetic a whole row (or a
+whole column) at a time with map and itertools, instead of one tuple at a time.
+
+A plane is never normalized along the way.  The filters return unscaled sums (as ints
+whenever the weights are ints), and combine divides by the total weight only once, at
+the very end.  So chaining several passes loses no precision.
+
+Kernels are applied as-is (this is correlation, as is usual for image filters), and
+the pixels past the edge of the image are chosen according to one of the EDGES modes:
+
+    'clamp'    repeats the pixel on the edge
+    'reflect'  mirrors the image about the edge pixel
+    'wrap'     wraps around to the opposite side of the image
+    'black'    treats the missing pixels as 0
+"""
+from itertools import accumulate, repeat
+from operator import add, sub, mul, truediv
+
+
+# The supported edge modes
+EDGES = ('clamp', 'reflect', 'wrap', 'black')
+
+
+# PLANE CONVERSION
+def planes(buffer):
+    """
+    Returns: the three color planes (red, green, blue) of a pixel buffer
+
+    Parameter buffer: The pixel buffer
+    Precondition: buffer is the byte buffer of a Pixels object
+    """
+    return [list(buffer[0::3]), list(buffer[1::3]), list(buffer[2::3])]
+
+
+def combine(buffer, plane, channel, divisor=1):
+    """
+    Stores a plane, divided by divisor, as the given color channel of a pixel buffer
+
+    The values are rounded to the nearest int and clamped to 0..255.
+
+    Parameter buffer: The pixel buffer
+    Precondition: buffer is the byte buffer of a Pixels object
+
+    Parameter plane: The plane to store
+    Precondition: plane is a list of numbers with one element per pixel
+
+    Parameter channel: The color channel (0 for red, 1 for green, 2 for blue)
+    Precondition: channel is 0, 1, or 2
+
+    Parameter divisor: The total weight of the plane
+    Precondition: divisor is a number > 0
+    """
+    from array import array
+    values = map(round, map(truediv, plane, repeat(divisor)))
+    values = map(min, map(max, values, repeat(0)), repeat(255))
+    buffer[channel::3] = array('B', values)
+
+
+# KERNEL ANALYSIS
+def separate(kernel):
+    """
+    Returns: a pair (column, row) of 1D kernels whose product is kernel, or None
+
+    A 2D kernel is separable if every row is a multiple of the same row.  Convolving
+    with a separable kernel is the same as convolving each row with row, and then
+    each column with column, which is much faster.
+
+    Parameter kernel: The 2D kernel
+    Precondition: kernel is a non-empty list of equal length lists of numbers
+    """
+    pivot = None
+    for y in range(len(kernel)):
+        for x in range(len(kernel[y])):
+            if kernel[y][x] != 0 and pivot is None:
+                pivot = (y,x)
+    if pivot is None:
+        return ([0]*len(kernel), [0]*len(kernel[0]))
+
+    py, px = pivot
+    row = kernel[py]
+    column = [kernel[y][px] for y in range(len(kernel))]
+    scale  = max(abs(value) for line in kernel for value in line)
+    for y in range(len(kernel)):
+        for x in range(len(row)):
+            # Compare cross products to avoid division
+            if abs(kernel[y][x]*row[px]-column[y]*row[x]) > 1e-9*scale*scale:
+                return None
+
+    if type(row[px]) == int and all(type(value) == int for value in column):
+        if all(value % row[px] == 0 for value in column):
+            return ([value//row[px] for value in column], row)
+    return ([value/row[px] for value in column], row)
+
+
+def box_radii(sigma, passes=3):
+    """
+    Returns: the list of box filter radii approximating a Gaussian blur
+
+    Repeatedly applying a box filter converges to a Gaussian.  This chooses the box
+    sizes so that the passes have (as close as possible) the standard deviation sigma.
+
+    Parameter sigma: The standard deviation of the Gaussian
+    Precondition: sigma is a number > 0
+
+    Parameter passes: The number of box filters
+    Precondition: passes is an int > 0
+    """
+    ideal = (12*sigma*sigma/passes+1)**0.5
+    lower = int(ideal)
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower+2
+    split = round((12*sigma*sigma-passes*lower*lower-4*passes*lower-3*passes)/(-4*lower-4))
+    return [(lower if pos < split else upper)//2 for pos in range(passes)]
+
+
+# ONE DIMENSIONAL PASSES
+def filter_rows(plane, width, height, weights, edge='clamp', checkpoint=None):
+    """
+    Returns: a new plane with every row convolved with the given weights
+
+    If all of the weights are the same (a box filter), this uses running sums.  So
+    the cost does not depend on the number of weights.
+
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of numbers of length width*height
+
+    Parameter width: The plane width
+    Precondition: width is an int > 0
+
+    Parameter height: The plane height
+    Precondition: height is an int > 0
+
+    Parameter weights: The 1D kernel
+    Precondition: weights is a list of numbers of odd length
+
+    Parameter edge: The edge mode
+    Precondition: edge is one of EDGES
+
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    radius = len(weights)//2
+    if len(set(weights)) == 1:
+        result = box_rows(plane, width, height, radius, edge, checkpoint)
+        return result if weights[0] == 1 else list(map(mul, result, repeat(weights[0])))
+
+    result = []
+    for row in range(height):
+        if checkpoint:
+            checkpoint()
+        line = _pad(plane[row*width:(row+1)*width], radius, edge)
+        total = [0]*width
+        for pos in range(len(weights)):
+            if weights[pos]:
+                total = list(map(add, total, map(mul, line[pos:pos+width],
+                                                 repeat(weights[pos]))))
+        result.extend(total)
+    return result
+
+
+def filter_cols(plane, width, height, weights, edge='clamp', checkpoint=None):
+    """
+    Returns: a new plane with every column convolved with the given weights
+
+    The columns are processed a whole row at a time.  If all of the weights are the
+    same (a box filter), this uses running sums.  So the cost does not depend on the
+    number of weights.
+
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of numbers of length width*height
+
+    Parameter width: The plane width
+    Precondition: width is an int > 0
+
+    Parameter height: The plane height
+    Precondition: height is an int > 0
+
+    Parameter weights: The 1D kernel
+    Precondition: weights is a list of numbers of odd length
+
+    Parameter edge: The edge mode
+    Precondition: edge is one of EDGES
+
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    radius = len(weights)//2
+    if len(set(weights)) == 1:
+        result = box_cols(plane, width, height, radius, edge, checkpoint)
+        return result if weights[0] == 1 else list(map(mul, result, repeat(weights[0])))
+
+    rows = _pad_rows(plane, width, height, radius, edge)
+    result = []
+    for row in range(height):
+        if checkpoint:
+            checkpoint()
+        total = [0]*width
+        for pos in range(len(weights)):
+            if weights[pos]:
+                total = list(map(add, total, map(mul, rows[row+pos], repeat(weights[pos]))))
+        result.extend(total)
+    return result
+
+
+def box_rows(plane, width, height, radius, edge='clamp', checkpoint=None):
+    """
+    Returns: a new plane where each value is the sum of the 2*radius+1 values in its row
+
+    This uses a running sum, so the cost does not depend on the radius.
+
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of numbers of length width*height
+
+    Parameter width: The plane width
+    Precondition: width is an int > 0
+
+    Parameter height: The plane height
+    Precondition: height is an int > 0
+
+    Parameter radius: The box radius
+    Precondition: radius is an int >= 0
+
+    Parameter edge: The edge mode
+    Precondition: edge is one of EDGES
+
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    size = 2*radius+1
+    result = []
+    for row in range(height):
+        if checkpoint:
+            checkpoint()
+        sums = list(accumulate(_pad(plane[row*width:(row+1)*width], radius, edge), initial=0))
+        result.extend(map(sub, sums[size:], sums[:width]))
+    return result
+
+
+def box_cols(plane, width, height, radius, edge='clamp', checkpoint=None):
+    """
+    Returns: a new plane where each value is the sum of the 2*radius+1 values in its column
+
+    This keeps a running sum of whole rows, so the cost does not depend on the radius.
+
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of numbers of length width*height
+
+    Parameter width: The plane width
+    Precondition: width is an int > 0
+
+    Parameter height: The plane height
+    Precondition: height is an int > 0
+
+    Parameter radius: The box radius
+    Precondition: radius is an int >= 0
+
+    Parameter edge: The edge mode
+    Precondition: edge is one of EDGES
+
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    size = 2*radius+1
+    rows = _pad_rows(plane, width, height, radius, edge)
+    total = [0]*width
+    for pos in range(size):
+        total = list(map(add, total, rows[pos]))
+
+    result = list(total)
+    for row in range(1,height):
+        if checkpoint:
+            checkpoint()
+        total = list(map(sub, map(add, total, rows[row+size-1]), rows[row-1]))
+        result.extend(total)
+    return result
+
+
+# TWO DIMENSIONAL PASSES
+def filter_plane(plane, width, height, kernel, edge='clamp', checkpoint=None):
+    """
+    Returns: a new plane convolved with the given 2D kernel
+
+    Separable kernels are done in two 1D passes.  All other kernels are done directly,
+    one kernel weight at a time.
+
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of numbers of length width*height
+
+    Parameter width: The plane width
+    Precondition: width is an int > 0
+
+    Parameter height: The plane height
+    Precondition: height is an int > 0
+
+    Parameter kernel: The 2D kernel
+    Precondition: kernel is a non-empty list of equal length lists of numbers, with
+    an odd number of rows and columns
+
+    Parameter edge: The edge mode
+    Precondition: edge is one of EDGES
+
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    pair = separate(kernel)
+    if not pair is None:
+        plane = filter_rows(plane, width, height, pair[1], edge, checkpoint)
+        return filter_cols(plane, width, height, pair[0], edge, checkpoint)
+
+    ry = len(kernel)//2
+    rx = len(kernel[0])//2
+    rows = _pad_rows(plane, width, height, ry, edge)
+    rows = [_pad(line, rx, edge) for line in rows]
+    result = []
+    for row in range(height):
+        if checkpoint:
+            checkpoint()
+        total = [0]*width
+        for ky in range(len(kernel)):
+            line = rows[row+ky]
+            for kx in range(len(kernel[ky])):
+                if kernel[ky][kx]:
+                    total = list(map(add, total, map(mul, line[kx:kx+width],
+                                                     repeat(kernel[ky][kx]))))
+        result.extend(total)
+    return result
+
+
+def gaussian(plane, width, height, sigma, edge='clamp', checkpoint=None):
+    """
+    Returns: a pair (plane, divisor) with the plane blurred by a Gaussian
+
+    The blur is three box filters in each direction.  The plane returned is not
+    normalized; divide it by divisor (or give divisor to combine).
+
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of numbers of length width*height
+
+    Parameter width: The plane width
+    Precondition: width is an int > 0
+
+    Parameter height: The plane height
+    Precondition: height is an int > 0
+
+    Parameter sigma: The standard deviation of the Gaussian
+    Precondition: sigma is a number > 0
+
+    Parameter edge: The edge mode
+    Precondition: edge is one of EDGES
+
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    divisor = 1
+    for radius in box_radii(sigma):
+        plane = box_rows(plane, width, height, radius, edge, checkpoint)
+        divisor *= 2*radius+1
+    for radius in box_radii(sigma):
+        plane = box_cols(plane, width, height, radius, edge, checkpoint)
+        divisor *= 2*radius+1
+    return (plane, divisor)
+
+
+# HELPERS
+def _index(pos, size, edge):
+    """
+    Returns: the position inside 0..size-1 that stands in for pos, or None if black
+
+    Parameter pos: A position, possibly outside of the image
+    Precondition: pos is an int
+
+    Parameter size: The length of the row or column
+    Precondition: size is an int > 0
+
+    Parameter edge: The edge mode
+    Precondition: edge is one of EDGES
+    """
+    if 0 <= pos < size:
+        return pos
+    elif edge == 'clamp':
+        return 0 if pos < 0 else size-1
+    elif edge == 'wrap':
+        return pos % size
+    elif edge == 'reflect':
+        if size == 1:
+            return 0
+        pos = pos % (2*size-2)
+        return pos if pos < size else 2*size-2-pos
+    return None
+
+
+def _pad(line, radius, edge):
+    """
+    Returns: a copy of line with radius extra values at each end
+
+    Parameter line: The row or column to pad
+    Precondition: line is a non-empty list of numbers
+
+    Parameter radius: The amount to pad on each side
+    Precondition: radius is an int >= 0
+
+    Parameter edge: The edge mode
+    Precondition: edge is one of EDGES
+    """
+    size = len(line)
+    before = [_index(pos, size, edge) for pos in range(-radius,0)]
+    after  = [_index(pos, size, edge) for pos in range(size,size+radius)]
+    before = [0 if pos is None else line[pos] for pos in before]
+    after  = [0 if pos is None else line[pos] for pos in after]
+    return before+line+after
+
+
+def _pad_rows(plane, width, height, radius, edge):
+    """
+    Returns: the list of rows of the plane, with radius extra rows at each end
+
+    The extra rows are not copies.  They refer to the same lists as the rows that
+    they stand in for.
+
+    Parameter plane: The plane
+    Precondition: plane is a list of numbers of length width*height
+
+    Parameter width: The plane width
+    Precondition: width is an int > 0
+
+    Parameter height: The plane height
+    Precondition: height is an int > 0
+
+    Parameter radius: The number of rows to pad on each side
+    Precondition: radius is an int >= 0
+
+    Parameter edge: The edge mode
+    Precondition: edge is one of EDGES
+    """
+    rows  = [plane[row*width:(row+1)*width] for row in range(height)]
+    black = [0]*width
+    result = []
+    for pos in range(-radius,height+radius):
+        pos = _index(pos, height, edge)
+        result.append(black if pos is None else rows[pos])
+    return result
@@ -15,6 +15,7 @@ Date:   October 20, 2017 (Python 3 Version)
 # These are the kivy parent classes
 from kivy.uix.boxlayout import BoxLayout
 from kivy.properties import *
+from kivy.clock import mainthread
 
 class LoadDialog(BoxLayout):
     """
@@ -32,6 +33,67 @@ class LoadDialog(BoxLayout):
     loadchoice  = ObjectProperty(None)
     # The cancel button
     exitchoice  = ObjectProperty(None)
+    # The thumbnail of the selected file
+    preview     = ObjectProperty(None)
+    # The thumbnail maker (a ThumbnailCache object)
+    thumbnails  = ObjectProperty(None,allownone=True)
+    # The selected file
+    selected    = StringProperty('')
+    
+    # The number of files on either side of the selection to make thumbnails for
+    NEIGHBORS = 2
+    
+    def show_preview(self, selection):
+        """
+        Shows the thumbnail of the selected file, once it is ready.
+        
+        Thumbnails are made in the background (see thumbnail.ThumbnailCache), so the
+        dialog stays responsive.  The thumbnails of the NEIGHBORS files after (and then
+        before) the selected one are made next, so that clicking through them is quick.
+        Any thumbnails still waiting from the previous selection are dropped.
+        
+        Parameter selection: The selected files
+        Precondition: selection is a list of strings
+        """
+        self.selected = selection[0] if selection else ''
+        self.preview.source = ''
+        if self.thumbnails is None or not self.selected:
+            return
+        
+        files = [self.selected]
+        folder = list(self.filechooser.files)
+        if self.selected in folder:
+            pos = folder.index(self.selected)
+            files.extend(folder[pos+1:pos+1+self.NEIGHBORS])
+            files.extend(folder[max(0,pos-self.NEIGHBORS):pos][::-1])
+        self.thumbnails.request(files,self.place_preview)
+    
+    def cancel_preview(self, *args):
+        """
+        Stops making the thumbnails that are still waiting.
+        
+        This is called when the dialog is dismissed, so that no more images are read
+        for a dialog that is gone.
+        
+        Parameter args: The arguments of the dismiss event (ignored)
+        Precondition: NONE
+        """
+        if not self.thumbnails is None:
+            self.thumbnails.cancel()
+    
+    @mainthread
+    def place_preview(self, file, path):
+        """
+        Shows a thumbnail in the main event thread, if its file is still selected.
+        
+        Parameter file: The file of the thumbnail
+        Precondition: file is a string
+        
+        Parameter path: The thumbnail file, or None if there is none
+        Precondition: path is a string or None
+        """
+        if file == self.selected and path:
+            self.preview.source = path
 
 
 class SaveDialog(BoxLayout):
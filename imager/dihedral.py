@@ -0,0 +1,89 @@
+"""
+Dihedral transform support for the imager application
+
+The methods transpose, reflectHori, reflectVert, rotateLeft and rotateRight in Editor
+only move pixels around.  Together with doing nothing (and the two other reflections
+and a half turn) they make up the eight symmetries of a rectangle, which is known as
+the dihedral group.  Any chain of them is one of these eight, so there is no reason to
+move the pixels more than once.  Editor keeps the symmetry waiting to be applied to
+each image, and composes each new one with it.
+
+A symmetry (called an element) is a 2x2 matrix (a,b,c,d), stored as a tuple.  The
+pixel x columns right and y rows below the center of the image moves to the position
+(a*x+b*y, c*x+d*y) relative to the center.  Every entry is 0, 1, or -1.
+
+Like the convolution module, the pixels are moved a plane (a single color channel) at
+a time.  Each row of the result is a row or column of the original image, read forwards
+or backwards, so this is done with slices.
+"""
+
+
+# The eight elements
+IDENTITY     = (1, 0, 0, 1)
+TRANSPOSE    = (0, 1, 1, 0)
+REFLECT_HORI = (-1, 0, 0, 1)
+REFLECT_VERT = (1, 0, 0, -1)
+ROTATE_LEFT  = (0, 1, -1, 0)
+ROTATE_RIGHT = (0, -1, 1, 0)
+HALF_TURN    = (-1, 0, 0, -1)
+ANTI_DIAGONAL = (0, -1, -1, 0)
+
+
+def compose(first, second):
+    """
+    Returns: the element that performs first, followed by second
+    
+    Parameter first: The element to perform first
+    Precondition: first is one of the eight elements
+    
+    Parameter second: The element to perform second
+    Precondition: second is one of the eight elements
+    """
+    a, b, c, d = second
+    e, f, g, h = first
+    return (a*e+b*g, a*f+b*h, c*e+d*g, c*f+d*h)
+
+
+def swaps(element):
+    """
+    Returns: True if the element swaps the width and height of an image
+    
+    Parameter element: The element to check
+    Precondition: element is one of the eight elements
+    """
+    return element[0] == 0
+
+
+def remap(plane, width, height, element):
+    """
+    Returns: the plane with its pixels moved by element
+    
+    If the element swaps the width and height, the result has width height.
+    
+    Parameter plane: The plane to move
+    Precondition: plane is a bytes-like object with width*height elements
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    
+    Parameter element: The element to perform
+    Precondition: element is one of the eight elements
+    """
+    a, b, c, d = element
+    lines = []
+    if not swaps(element):
+        # Each new row is an old row, read backwards if a is -1
+        for row in range(height):
+            old = row if d == 1 else height-1-row
+            line = plane[old*width:(old+1)*width]
+            lines.append(line if a == 1 else line[::-1])
+    else:
+        # Each new row is an old column, read backwards if b is -1
+        for row in range(width):
+            old = row if c == 1 else width-1-row
+            line = plane[old::width]
+            lines.append(line if b == 1 else line[::-1])
+    return b''.join(lines)
@@ -49,6 +49,9 @@ class EncoderPanel(AppPanel):
     # The edit drop-down menu
     editdrop  = ObjectProperty(None)
     
+    # Message files larger than this (in bytes) are encoded without showing them
+    TEXT_LIMIT = 1000000
+    
     def config(self):
         """
         Configures the application at start-up.
@@ -200,6 +203,10 @@ class EncoderPanel(AppPanel):
         else:
             file = os.path.join(path,filename)
         
+        if os.path.isfile(file) and os.path.getsize(file) > self.TEXT_LIMIT:
+            self.place_stream(file)
+            return
+        
         try:
             handle = open(file)
             text = handle.read()
@@ -215,6 +222,33 @@ class EncoderPanel(AppPanel):
         self.textpanel.hidden.height = height
         self.textpanel.select(True)
     
+    def place_stream(self, file):
+        """
+        Encodes the given file directly into the image, without showing it
+        
+        Large files are too big for the text panel, so they are streamed straight into
+        the pixels of the image instead.  The result is stored on the edit stack.
+        
+        Parameter file: An absolute filename
+        Precondition: file is a string
+        """
+        import os.path
+        try:
+            self.workspace.increment()
+            with open(file,'rb') as stream:
+                success = self.workspace.encodeStream(stream)
+            if not success:
+                self.error('The message could not be encoded')
+                self.workspace.undo()
+            else:
+                self.workimage.update(self.workspace.getCurrent())
+                self.textpanel.hidden.text = 'Encoded '+os.path.split(file)[1]+' into the image'
+        except:
+            traceback.print_exc()
+            self.error('The message could not be encoded')
+        
+        self.textpanel.select(False)
+    
     # Text saving helpers
     def check_save_txt(self, path, filename):
         """
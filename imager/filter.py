@@ -29,6 +29,12 @@ from dialogs import *
 from guibase import *
 
 
+# The number of leading arguments of each operation that are distances in pixels.
+# These are scaled down with the image when the operation is previewed (see async_proxy).
+_DISTANCES = {'pixellate': 1, 'median': 1, 'erode': 1, 'dilate': 1, 'opening': 1,
+              'closing': 1, 'blur': 1, 'unsharpMask': 1, 'resize': 2}
+
+
 class FilterPanel(AppPanel):
     """
     This class is a controller for the imager filter application.
@@ -45,6 +51,8 @@ class FilterPanel(AppPanel):
     menubar   = ObjectProperty(None)
     # The progress bar
     progress  = ObjectProperty(None)
+    # The cancel button
+    stopper   = ObjectProperty(None)
     
     # The file drop-down menu
     filedrop  = ObjectProperty(None)
@@ -54,10 +62,23 @@ class FilterPanel(AppPanel):
     axisdrop  = ObjectProperty(None)
     # The monochromify drop-down menu
     greydrop  = ObjectProperty(None)
+    # The tone drop-down menu
+    tonedrop  = ObjectProperty(None)
     # The rotate drop-down menu
     turndrop  = ObjectProperty(None)
     # The pixellate drop-down menu
     blockdrop = ObjectProperty(None)
+    # The median drop-down menu
+    mediandrop = ObjectProperty(None)
+    # The blur drop-down menu
+    blurdrop  = ObjectProperty(None)
+    # The sharpen drop-down menu
+    sharpdrop = ObjectProperty(None)
+    # The resize drop-down menu
+    sizedrop  = ObjectProperty(None)
+    
+    # Images that must shrink by at least this factor to fit the display are previewed
+    PROXY = 0.5
     
     def config(self):
         """
@@ -67,6 +88,9 @@ class FilterPanel(AppPanel):
         the other objects. This method does just that. It loads the currently selected 
         image file, and creates an editor for that file (if possible).
         """
+        # The image is loaded in the background (see place_image)
+        self.load_thread = None
+        self.load_count  = 0
         super().config()
         
         self.filedrop  = FileDropDown( choices=['load','save'], 
@@ -79,6 +103,9 @@ class FilterPanel(AppPanel):
         self.greydrop  = GreyDropDown( choices=['greyscale','sepia'],
                                        greyscale=[self.do_async,'monochromify',False], 
                                        sepia=[self.do_async,'monochromify',True])
+        self.tonedrop  = ToneDropDown( choices=['levels','equalize'],
+                                       levels=[self.do_async,'autoLevels'],
+                                       equalize=[self.do_async,'equalize'])
         self.turndrop  = TurnDropDown( choices=['left','right'],
                                        left= [self.do_async,'rotateLeft'],
                                        right=[self.do_async,'rotateRight'])
@@ -88,8 +115,28 @@ class FilterPanel(AppPanel):
                                        p50=[self.do_async,'pixellate',50],
                                        p100=[self.do_async,'pixellate',100],
                                        p200=[self.do_async,'pixellate',200])
+        self.mediandrop = MedianDropDown(choices=['m1','m2','m5'],
+                                       m1=[self.do_async,'median',1],
+                                       m2=[self.do_async,'median',2],
+                                       m5=[self.do_async,'median',5])
+        self.blurdrop  = BlurDropDown( choices=['b2','b5','b10','b20'],
+                                       b2=[self.do_async,'blur',2],
+                                       b5=[self.do_async,'blur',5],
+                                       b10=[self.do_async,'blur',10],
+                                       b20=[self.do_async,'blur',20])
+        self.sharpdrop = SharpDropDown(choices=['sharpen','unsharp','edges'],
+                                       sharpen=[self.do_async,'sharpen'],
+                                       unsharp=[self.do_async,'unsharpMask',2,1],
+                                       edges=[self.do_async,'edges'])
+        self.sizedrop  = SizeDropDown( choices=['half','quarter','double'],
+                                       half=[self.do_resize,0.5],
+                                       quarter=[self.do_resize,0.25],
+                                       double=[self.do_resize,2])
         self.async_action = None
         self.async_thread = None
+        
+        import memo
+        self.results = memo.ResultCache()
     
     def place_image(self, path, filename):
         """
@@ -98,6 +145,12 @@ class FilterPanel(AppPanel):
         If it cannot read the image (either Image is not defined or the file is not
         an image file), this method does nothing.
         
+        The file is read (and its editor created) by a separate thread, so that the
+        application stays responsive while large files load.  If the file can be
+        decoded at a smaller size (see imagefile.read_draft), a low resolution copy is
+        shown until the full image is ready.  The load may be cancelled (see do_cancel),
+        which keeps the old image.
+        
         Parameter path: The base path to the file
         Precondition: path is a string
         
@@ -105,6 +158,7 @@ class FilterPanel(AppPanel):
         Precondition: filename is a string
         """
         import os.path
+        import threading
         self.dismiss_popup()
         
         if os.path.isabs(filename):
@@ -112,21 +166,115 @@ class FilterPanel(AppPanel):
         else:
             file = os.path.join(path,filename)
         
-        import a6editor
-        self.picture = self.read_image(file)
-        try:
-            self.workspace = a6editor.Editor(self.picture)
+        # Any load still running is abandoned
+        self.load_count += 1
+        self.menubar.disabled = True
+        self.stopper.disabled = False
+        self.load_thread = threading.Thread(target=self.load_work,daemon=True,
+                                            args=(file,tuple(self.workimage.inside),self.load_count))
+        self.load_thread.start()
+    
+    def place_workspace(self):
+        """
+        Shows the images of the current workspace in the image panel(s)
+        
+        If there is no workspace, the picture is shown as the original image.
+        """
+        if self.workspace:
             self.workimage.setImage(self.workspace.getCurrent())
             if self.workspace.getOriginal():
                 self.origimage.setImage(self.workspace.getOriginal())
             else:
                 self.origimage.setImage(self.picture)
-        except:
-            self.workspace = None
+        else:
             self.workimage.setImage(None)
             self.origimage.setImage(self.picture)
         self.canvas.ask_update()
     
+    def load_work(self, file, size, count):
+        """
+        Reads the given image file, and creates an editor for it.
+        
+        This is the function that is launched in a separate thread by place_image.  It
+        stops early if the load has been abandoned.  Even if the file cannot be read, it
+        is guaranteed to call load_complete for clean-up.
+        
+        Parameter file: An absolute path to an image file
+        Precondition: file is a string
+        
+        Parameter size: The size of the image panels
+        Precondition: size is a pair of ints >= 0
+        
+        Parameter count: The number of this load
+        Precondition: count is an int
+        """
+        import imagefile
+        import a6editor
+        import memo
+        try:
+            # There is no need for a draft if the image is cached
+            with self.image_lock:
+                known = memo.filekey(file) in self.images
+            if min(size) > 0 and not known:
+                draft = imagefile.read_draft(file,size)
+                if draft and count == self.load_count:
+                    self.load_preview(draft,count)
+            if count != self.load_count:
+                return
+            
+            picture = self.fetch_image(file)
+            try:
+                workspace = a6editor.Editor(picture)
+            except:
+                workspace = None
+            self.load_complete(count,picture,workspace)
+            self.prefetch(file)
+        except:
+            traceback.print_exc()
+            self.load_complete(count,None,None)
+    
+    @mainthread
+    def load_preview(self, image, count):
+        """
+        Shows the low resolution copy of an image being loaded in the main event thread.
+        
+        Parameter image: The low resolution image
+        Precondition: image is an Image object
+        
+        Parameter count: The number of the load
+        Precondition: count is an int
+        """
+        if count == self.load_count:
+            self.workimage.setImage(image)
+            self.origimage.setImage(image)
+            self.canvas.ask_update()
+    
+    @mainthread
+    def load_complete(self, count, picture, workspace):
+        """
+        Shows the loaded image in the main event thread, unless the load was abandoned.
+        
+        Parameter count: The number of the load
+        Precondition: count is an int
+        
+        Parameter picture: The image read, or None if the file could not be read
+        Precondition: picture is an Image object or None
+        
+        Parameter workspace: The editor for picture (if it could be made)
+        Precondition: workspace is an Editor object or None
+        """
+        if count != self.load_count:
+            return
+        
+        self.load_thread = None
+        self.menubar.disabled = False
+        self.stopper.disabled = True
+        if picture is None:
+            self.error('Could not load the image file')
+        self.picture = picture
+        self.workspace = workspace
+        self.place_workspace()
+    
     def do_async(self,*action):
         """
         Launchs the given action in an asynchronous thread
@@ -135,19 +283,52 @@ class FilterPanel(AppPanel):
         and any other elements are parameters to the callable.
         
         The thread progress is monitored by async_monitor.  When the thread is done, it
-        will call async_complete in the main event thread.
+        will call async_complete in the main event thread.  Large images are previewed
+        at the size of the display first (see async_proxy).
         
         Parameter(s) *action: An expanded list defining the action
         Precondition: The first element of action is callable
         """
         import threading
         self.menubar.disabled = True
+        self.stopper.disabled = False
         self.workspace.increment()
         self.progress.value = 0
         self.async_action = Clock.schedule_interval(self.async_monitor,0.02)
         self.async_thread = threading.Thread(target=self.async_work,args=action)
         self.async_thread.start()
 
+    def do_resize(self,factor):
+        """
+        Launches an asynchronous resize of the current image by the given factor
+        
+        Shrinking averages the pixels covered, while enlarging blends the closest ones.
+        
+        Parameter factor: The amount to scale each dimension
+        Precondition: factor is a number > 0
+        """
+        current = self.workspace.getCurrent()
+        width  = max(1,int(current.getWidth()*factor))
+        height = max(1,int(current.getHeight()*factor))
+        self.do_async('resize',width,height,'area' if factor < 1 else 'bilinear')
+    
+    def do_cancel(self):
+        """
+        Cancels the action running in the asynchronous thread, if there is one.
+        
+        The action stops at its next checkpoint (see Editor.cancel), and its edit is
+        undone by async_work.  An image being loaded is abandoned instead, and the old
+        image is shown again.
+        """
+        if self.async_thread:
+            self.workspace.cancel()
+        elif self.load_thread:
+            self.load_count += 1
+            self.load_thread = None
+            self.menubar.disabled = False
+            self.stopper.disabled = True
+            self.place_workspace()
+    
     def async_work(self,*action):
         """
         Performs the given action asynchronously.
@@ -156,28 +337,107 @@ class FilterPanel(AppPanel):
         and any other elements are parameters to the callable.
         
         This is the function that is launched in a separate thread.  Even if the action
-        fails, it is guaranteed to call async_complete for clean-up
+        fails, it is guaranteed to call async_complete for clean-up.  If the action is
+        cancelled (see do_cancel), its edit is undone.
+        
+        Actions that can be split into strips are spread over several processes (see
+        the module parallel), as the thread on its own only gets a single core.  And
+        actions already performed on the same image are not performed again (see the
+        module memo).
         
         Parameter(s) *action: An expanded list defining the action
         Precondition: The first element of action is callable
         """
+        import parallel
+        import memo
+        import a6editor
         try:
-            getattr(self.workspace,action[0])(*action[1:])
+            self.async_proxy(*action)
+            memo.run(self.results,self.workspace,*action,runner=parallel.run)
+            # Point operations wait until the image is needed, so apply them here
+            # rather than in the event thread
+            self.workspace.getCurrent()
+        except a6editor.Cancelled:
+            self.workspace.undo()
         except:
             traceback.print_exc()
             self.error('Action '+action[0]+' could not be completed')
         self.async_complete()
     
+    def async_proxy(self,*action):
+        """
+        Performs the given action on a display-sized copy of the current image, and shows it.
+        
+        The copy is taken with nearest neighbor sampling, so the cost of the preview
+        depends on the size of the display and not the size of the image.  Arguments
+        that are distances in pixels (like the blur radius) are scaled down to match.
+        The full size image is left alone, and replaces the preview when it is done.
+        
+        Small images, and actions with a cached result (see the module memo), are not
+        previewed, as the real result will be ready soon enough.
+        
+        This is called from the thread launched by do_async.
+        
+        Parameter(s) *action: An expanded list defining the action
+        Precondition: The first element of action is the name of an Editor method
+        """
+        import memo
+        import pixels
+        import a6image
+        import a6editor
+        import resample
+        
+        op, args = action[0], list(action[1:])
+        if memo.editkey(self.workspace,*action) in self.results:
+            return
+        
+        current = self.workspace.getCurrent()
+        width  = current.getWidth()
+        height = current.getHeight()
+        factor = min(self.workimage.inside[0]/width,self.workimage.inside[1]/height)
+        if factor > self.PROXY:
+            return
+        
+        newwidth  = max(1,int(width*factor))
+        newheight = max(1,int(height*factor))
+        buffer = resample.resize(current.getPixels().buffer,width,height,
+                                 newwidth,newheight,'nearest')
+        proxy  = a6editor.Editor(a6image.Image(pixels.Pixels.frombytes(buffer),newwidth))
+        for pos in range(min(_DISTANCES.get(op,0),len(args))):
+            if type(args[pos]) == int:
+                args[pos] = max(1,round(args[pos]*factor))
+            else:
+                args[pos] = args[pos]*factor
+        getattr(proxy,op)(*args)
+        self.async_preview(proxy.getCurrent())
+    
+    @mainthread
+    def async_preview(self,image):
+        """
+        Shows the preview of an asynchronous action in the main event thread.
+        
+        Parameter image: The preview image
+        Precondition: image is an Image object
+        """
+        self.workimage.update(image)
+        self.canvas.ask_update()
+    
     def async_monitor(self,dt):
         """
         Updates the progress bar to represent the current processing state.
         
         This assumes that the worker thread is updating the pixels of the current image.
-        If the student is (mistakenly) modifying another image, it will not work.
+        If the student is (mistakenly) modifying another image, it will not work.  It
+        never applies waiting point operations itself, as that is the job of the worker.
+        
+        Any parts of the image that are already finished (see Pixels.publish) are drawn
+        on the screen, so the result builds up while the rest is computed.
         """
-        if self.async_action:
-            image = self.workspace.getCurrent()
+        if self.async_action and not self.workspace.isPending():
+            image = self.workspace.getCurrent(False)
             self.progress.value = int(image.getPixels().progress()*self.progress.max)
+            if self.workimage.refresh(image,image.getPixels().tiles()):
+                self.canvas.ask_update()
      
     @mainthread
     def async_complete(self):
@@ -191,8 +451,22 @@ class FilterPanel(AppPanel):
         self.async_thread = None
         self.async_action = None
         self.menubar.disabled = False
+        self.stopper.disabled = True
         self.canvas.ask_update()
     
+    def show_progress(self, fraction):
+        """
+        Shows the progress of a background task (like a save) on the progress bar.
+        
+        While an action is running, the progress bar belongs to it (see async_monitor),
+        so this method does nothing.
+        
+        Parameter fraction: The fraction of the task done
+        Precondition: fraction is a number 0..1
+        """
+        if not self.async_action:
+            self.progress.value = int(fraction*self.progress.max)
+    
     def load_image(self):
         """
         Opens a dialog to load an image file.
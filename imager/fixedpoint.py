@@ -0,0 +1,195 @@
+"""
+Fixed-point support for the imager application
+
+The methods monochromify and vignette in Editor were written with floats, and then
+truncated with int().  Float results are not always what they should be on paper.  For
+example 0.3*10 + 0.6*10 + 0.1*10 is 9.999999999999998 and not 10, so its brightness is
+9.  Any faster version of these methods has to make the same "mistakes", or the images
+will change.  This module computes exactly the same bytes, but with integers, so that
+the work can be done a whole channel at a time with map.
+
+For the brightness 0.3*r + 0.6*g + 0.1*b, the integer 3*r + 6*g + b (called the sum) is
+ten times the brightness on paper.  Dividing the sum by 10 gives the right answer,
+except when the brightness on paper is an integer (or, for sepia, when 0.6 or 0.4 times
+it is).  Only then can the tiny float error change the result.  For those pixels, we use
+integer tables of the exact float errors to find the float that the original code would
+have computed, and look up its result in a table.
+
+For vignette, each pixel is multiplied by a float factor.  We store the factor as an
+exact integer (scaled by 2**SHIFT), so the product is exact.  The float product can
+only differ when it rounds up to an integer, and that is an integer comparison as well.
+"""
+from itertools import compress, count, repeat
+from operator import add, mul, and_, rshift, ge
+
+
+# The scale of the exact vignette factors (this is enough for any factor that matters)
+SHIFT = 64
+
+
+def _error(value, total):
+    """
+    Returns: the float error of value (which should be total/10), as an integer
+    
+    The error is scaled by 10*2**60, which makes it exact.
+    
+    Parameter value: The float result
+    Precondition: value is a float with no bits below 2**-60
+    
+    Parameter total: Ten times the result on paper
+    Precondition: total is an int
+    """
+    return int(value*2**60)*10-(total << 60)
+
+
+# The float errors of 0.3*r + 0.6*g (index 256*r+g) and of 0.1*b (index b)
+_RG_ERROR = [_error(0.3*r+0.6*g, 3*r+6*g) for r in range(256) for g in range(256)]
+_B_ERROR  = [_error(0.1*b, b) for b in range(256)]
+
+# Multiplication tables for the sum
+_TIMES3   = [3*c for c in range(256)]
+_TIMES6   = [6*c for c in range(256)]
+_TIMES256 = [256*c for c in range(256)]
+
+# The results on paper for each sum (brightness, and sepia green and blue)
+_GREY  = [s//10 for s in range(2551)]
+_GREEN = [(6*s)//100 for s in range(2551)]
+_BLUE  = [(4*s)//100 for s in range(2551)]
+
+# The sums where the float error can matter, for greyscale and for sepia
+_GREY_EDGE  = [s % 10 == 0 for s in range(2551)]
+_SEPIA_EDGE = [s % 10 == 0 or s % 25 == 0 for s in range(2551)]
+
+# The float results for each sum and error (see _edge)
+_results = {}
+
+
+def monochrome(planes, sepia):
+    """
+    Returns: the color planes of the image converted to monochrome
+    
+    The result is exactly the same as the float formulas in Editor.monochromify.
+    
+    Parameter planes: The red, green and blue planes of the image
+    Precondition: planes is a list of three equal length lists of ints 0..255
+    
+    Parameter sepia: Whether to use sepia tone instead of greyscale
+    Precondition: sepia is a bool
+    """
+    red, green, blue = planes
+    sums = list(map(add, map(add, map(_TIMES3.__getitem__, red),
+                                  map(_TIMES6.__getitem__, green)), blue))
+    
+    grey = list(map(_GREY.__getitem__, sums))
+    if sepia:
+        result = [grey, list(map(_GREEN.__getitem__, sums)),
+                  list(map(_BLUE.__getitem__, sums))]
+        edges  = _SEPIA_EDGE
+    else:
+        result = [grey, grey, grey]
+        edges  = _GREY_EDGE
+    
+    # Only fix the pixels on the edge of a truncation
+    for pos in compress(count(), map(edges.__getitem__, sums)):
+        error = _RG_ERROR[_TIMES256[red[pos]]+green[pos]]+_B_ERROR[blue[pos]]
+        values = _edge(sums[pos], error)
+        for channel in range(3 if sepia else 1):
+            result[channel][pos] = values[channel]
+    return result
+
+
+def vignette_factors(width, height):
+    """
+    Returns: the vignette factor of each pixel, scaled by 2**SHIFT
+    
+    The factors are the exact values of the floats 1 - (d / hfD)**2 computed by
+    Editor.vignette, except that factors below 0 are 0.
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    """
+    # These deliberately match the (swapped) centers of Editor.vignette
+    middlerow = width//2
+    middlecol = height//2
+    hfD = (width**2+height**2)**0.5
+    rows = [(row-middlerow)**2 for row in range(height)]
+    cols = [(col-middlecol)**2 for col in range(width)]
+    
+    # The factor only depends on the squared distance, so make a table
+    factors = [0]*(max(rows)+max(cols)+1)
+    for dist in {drow+dcol for drow in set(rows) for dcol in set(cols)}:
+        vigt = 1 - ((dist**0.5)/hfD)**2
+        factors[dist] = int(vigt*2**SHIFT) if vigt > 0 else 0
+    
+    result = []
+    for drow in rows:
+        result.extend(map(factors.__getitem__, map(add, repeat(drow), cols)))
+    return result
+
+
+def scale(plane, factors):
+    """
+    Returns: the plane with each value multiplied by its factor and truncated
+    
+    The result is exactly int(value*factor) in float arithmetic, where factor is the
+    float that was scaled by 2**SHIFT.
+    
+    Parameter plane: The plane to scale
+    Precondition: plane is a list of ints 0..255
+    
+    Parameter factors: The factors for each value, scaled by 2**SHIFT
+    Precondition: factors is a list of ints 0..2**SHIFT, the result of vignette_factors
+    """
+    products = list(map(mul, plane, factors))
+    whole = list(map(rshift, products, repeat(SHIFT)))
+    
+    # The float product rounds up to the next integer if it is within half a float step
+    parts = map(and_, products, repeat((1 << SHIFT)-1))
+    return list(map(add, whole, map(ge, parts, map(_ROUNDUP.__getitem__, whole))))
+
+
+# HELPERS
+def _edge(total, error):
+    """
+    Returns: the results (grey, green, blue) of monochromify for the given sum and error
+    
+    The float brightness is total/10 plus the float error, rounded to the nearest float.
+    We work out which float that is (counted in float steps from total/10), and then
+    compute its results with floats, just like the original code.  These are cached, as
+    there are very few of them.
+    
+    Parameter total: The sum 3*r+6*g+b
+    Precondition: total is an int 0..2550 that is a multiple of 5
+    
+    Parameter error: The float error of the brightness, scaled by 10*2**60
+    Precondition: error is an int
+    """
+    from math import frexp
+    if total == 0:
+        return (0, 0, 0)
+    
+    # The float step just above (or below) total/10 is 2**(exp-52)
+    fraction, exp = frexp(total/10)
+    exp = exp-1
+    if fraction == 0.5 and error < 0:
+        exp = exp-1
+    unit = 10 << (exp+8)
+    
+    # Round to the nearest float step, with ties going to the even float
+    steps, remainder = divmod(error, unit)
+    if 2*remainder > unit or (2*remainder == unit and ((total << (52-exp))//10+steps) % 2):
+        steps = steps+1
+    
+    key = (total, steps)
+    if not key in _results:
+        brightness = total/10+steps*2.0**(exp-52)
+        _results[key] = (int(brightness), int(0.6*brightness), int(0.4*brightness))
+    return _results[key]
+
+
+# The smallest fraction (scaled by 2**SHIFT) that rounds up past each truncated product.
+# Half a float step below n+1 is 2**(b-53), where 2**b <= n (or b = -1 when n is 0).
+_ROUNDUP = [(1 << SHIFT)-(1 << (SHIFT-53+n.bit_length()-1)) for n in range(256)]
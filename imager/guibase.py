@@ -22,6 +22,7 @@ Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 Author: Walker M. White (wmw2)
 Date:   October 20, 2017 (Python 3 Version)
 """
+from kivy.clock import Clock, mainthread
 from kivy.properties import *
 from kivy.uix.widget import Widget
 from kivy.uix.boxlayout import BoxLayout
@@ -126,6 +127,7 @@ class ImagePanel(Widget):
         """
         try:
             assert picture.getWidth() == self.texture.width
+            assert picture.getHeight() == self.texture.height
             self.picture = picture
             self.texture.blit_buffer(self.picture.getPixels().buffer, colorfmt='rgb', bufferfmt='ubyte')
             return True
@@ -133,6 +135,35 @@ class ImagePanel(Widget):
             pass
         
         return self.setImage(picture)
+    
+    def refresh(self,picture,tiles):
+        """
+        Returns: True if the image panel displayed the given parts of picture
+        
+        This method only copies the rows holding the given tiles (see Pixels.publish)
+        to the screen, so it can be called often while the picture is being computed.
+        It does nothing if the panel is showing a picture of a different size (such as
+        a preview).
+        
+        Parameter picture: The image to display
+        Precondition: picture is an Image object
+        
+        Parameter tiles: The ranges (start, stop) of the pixels to display
+        Precondition: tiles is a list of pairs of ints within picture
+        """
+        width = picture.getWidth()
+        if (not self.texture or width != self.texture.width or
+            picture.getHeight() != self.texture.height):
+            return False
+        
+        buffer = picture.getPixels().buffer
+        for start, stop in tiles:
+            top = start//width
+            bottom = -(-stop//width)
+            self.texture.blit_buffer(buffer[top*width*3:bottom*width*3].tobytes(),
+                                     size=(width,bottom-top), pos=(0,top),
+                                     colorfmt='rgb', bufferfmt='ubyte')
+        return len(tiles) > 0
 
 
 class MessagePanel(Widget):
@@ -200,6 +231,19 @@ class AppPanel(BoxLayout):
     # The most recent file edit
     workimage = ObjectProperty(None,allownone=True)
     
+    # The PNG compression for saving (see imagefile.write_png).  This favors speed, as
+    # the user is waiting for the save to finish.
+    PNG_LEVEL    = 1
+    PNG_STRATEGY = 'default'
+    
+    # The number of files on each side of a loaded file to read ahead (see prefetch)
+    PREFETCH    = 2
+    # The bytes of decoded images to keep.  An image that is open costs another copy on
+    # top of this (see fetch_image).
+    IMAGE_BUDGET = 128*1024*1024
+    # The image files to read ahead (native files are mapped instead, so never cached)
+    IMAGE_TYPES = ('.png','.jpg','.jpeg','.gif')
+    
     def config(self):
         """
         Configures the application at start-up.
@@ -209,7 +253,21 @@ class AppPanel(BoxLayout):
         image file, and creates an editor for that file (if possible).
         """
         # For working with pop-ups (Hidden since not .kv aware)
+        import threading
+        import memo
+        import thumbnail
         self._popup = None
+        self.save_thread = None
+        self.save_action = None
+        
+        # Decoded images, shared with the read ahead thread
+        self.images = memo.ResultCache(self.IMAGE_BUDGET)
+        self.image_lock = threading.Lock()
+        self.prefetch_file   = None
+        self.prefetch_thread = None
+        
+        # Previews for the load dialog
+        self.thumbnails = thumbnail.ThumbnailCache()
         self.place_image('',self.source)
     
     def undo(self):
@@ -254,38 +312,110 @@ class AppPanel(BoxLayout):
         Parameter file: An absolute path to an image file
         Precondition: file is a string
         """
-        import pixels
-        import array
-        import a6image
-        from PIL import Image as CoreImage
-
         try:
-            image = CoreImage.open(file)
-            image = image.convert("RGB")
-            flatten = []
-            for pixel in image.getdata():
-                flatten.append(pixel[0])
-                flatten.append(pixel[1])
-                flatten.append(pixel[2])
-            buffer = array.array('B',flatten)
-            size  = image.size[0]*image.size[1]
-            width = image.size[0]
+            return self.fetch_image(file)
         except:
             traceback.print_exc()
             self.error('Could not load the image file')
-            buffer = None
+        return None
+    
+    def fetch_image(self, file):
+        """
+        Returns: An Image object for the given file, decoding it only if necessary
+        
+        Images already decoded (or read ahead by prefetch) are kept in a cache with a
+        budget of IMAGE_BUDGET bytes, so they are not read again.  The cache keeps its
+        own copy of each image.  ResultCache.get makes the copy returned here, and
+        ResultCache.put copies a newly decoded image.  So an open image that is cached
+        costs two buffers of pixels: the cached one, and the one being edited.
+        
+        This method is safe to call from any thread.  If the image cannot be read, the
+        error is raised to the caller.
         
-        result = None
-        if not buffer is None:
-            data = pixels.Pixels(0)
-            data._size   = size
-            data._buffer = buffer
+        Parameter file: An absolute path to an image file
+        Precondition: file is a string
+        """
+        import imagefile
+        import memo
+        if not file.lower().endswith(self.IMAGE_TYPES):
+            return imagefile.read_image(file)
+        
+        name = memo.filekey(file)
+        with self.image_lock:
+            image = self.images.get(name)
+        if image is None:
+            image = imagefile.read_image(file)
+            with self.image_lock:
+                self.images.put(name,image)
+        return image
+    
+    def prefetch(self, file):
+        """
+        Reads the image files next to the given one in the background.
+        
+        The files are the PREFETCH image files before and after file in its folder (in
+        the order of the load dialog), closest first.  They are decoded into the cache,
+        so that loading them later takes no time.  Files too large for the cache are not
+        read at all, as they would be thrown away right after being decoded.  If this
+        is called again before the files are read, the rest are skipped in favor of the
+        new neighbors.  This method is safe to call from any thread.
+        
+        Parameter file: An absolute path to an image file
+        Precondition: file is a string
+        """
+        import threading
+        with self.image_lock:
+            self.prefetch_file = file
+            start = self.prefetch_thread is None
+            if start:
+                self.prefetch_thread = threading.Thread(target=self.prefetch_work,daemon=True)
+        if start:
+            self.prefetch_thread.start()
+    
+    def prefetch_work(self):
+        """
+        Reads the neighbors of the most recent file given to prefetch.
+        
+        This is the function that is launched in a separate thread by prefetch.  It runs
+        until there are no more files to read ahead.  Files that cannot be read are
+        skipped.
+        """
+        import os
+        import memo
+        import imagefile
+        while True:
+            with self.image_lock:
+                file = self.prefetch_file
+                self.prefetch_file = None
+                if file is None:
+                    self.prefetch_thread = None
+                    return
+            
             try:
-                result = a6image.Image(data,width)
-            except:
-                traceback.print_exc()
-                result = None
-        return result
+                folder, name = os.path.split(file)
+                files = sorted(entry for entry in os.listdir(folder)
+                               if entry.lower().endswith(self.IMAGE_TYPES))
+                pos = files.index(name) if name in files else len(files)
+            except OSError:
+                continue
+            
+            order = []
+            for step in range(1,self.PREFETCH+1):
+                order.extend(files[pos+step:pos+step+1])
+                order.extend(files[pos-step:pos-step+1] if pos >= step else [])
+            for neighbor in order:
+                if self.prefetch_file:
+                    break
+                try:
+                    neighbor = os.path.join(folder,neighbor)
+                    with self.image_lock:
+                        known = memo.filekey(neighbor) in self.images
+                    if not known:
+                        width, height = imagefile.read_size(neighbor)
+                        if width*height*3 <= self.images.getBudget():
+                            self.fetch_image(neighbor)
+                except:
+                    pass
     
     def place_image(self, path, filename):
         """
@@ -317,6 +447,8 @@ class AppPanel(BoxLayout):
             self.workspace = None
             self.workimage.setImage(self.picture)
         self.canvas.ask_update()
+        if self.picture:
+            self.prefetch(file)
     
     # Dialog options
     def load(self,title,callback, filters=None):
@@ -331,10 +463,12 @@ class AppPanel(BoxLayout):
         Parameter callback: The callback to invoke on load
         Precondition: callback is callable
         """
-        content = LoadDialog(loadchoice=callback, exitchoice=self.dismiss_popup)
+        content = LoadDialog(loadchoice=callback, exitchoice=self.dismiss_popup,
+                             thumbnails=self.thumbnails)
         if filters:
             content.filechooser.filters = filters
         self._popup = Popup(title=title, content=content,size_hint=(0.8,0.9))
+        self._popup.bind(on_dismiss=content.cancel_preview)
         self._popup.open()
 
     def save(self,title,callback,filters=None):
@@ -402,7 +536,8 @@ class AppPanel(BoxLayout):
         Saves the current image to a file, checking first that the format is PNG
         
         If user uses another extension, or no extension at all, this method forces
-        the file to be a .png
+        the file to be a .png.  The one exception is .npy, the native format, which
+        is much faster to save and to load again.
         
         Parameter path: The base path to the file
         Precondition: path is a string
@@ -418,7 +553,7 @@ class AppPanel(BoxLayout):
         else:
             file = os.path.join(path,filename)
         
-        if file.lower().endswith('.png'):
+        if file.lower().endswith(('.png','.npy')):
             self.save_png(file)
         else:
             file = os.path.splitext(file)[0]+'.png'
@@ -435,7 +570,7 @@ class AppPanel(BoxLayout):
         Precondition: filename is a string
         """
         import os.path
-        assert filename.lower().endswith('.png')
+        assert filename.lower().endswith(('.png','.npy'))
         self.dismiss_popup()
         if os.path.isfile(filename):
             msg = 'File {} exists.\nOverwrite?'
@@ -445,24 +580,98 @@ class AppPanel(BoxLayout):
 
     def force_png(self, filename):
         """
-        Saves the current image, without user confirmation.
+        Saves the current image in the background, without user confirmation.
+        
+        The image is copied first, and the copy is saved by a separate thread.  So the
+        user can keep editing while the file is written.  The progress of the save is
+        shown with show_progress.
         
         Parameter filename: An absolute filename
         Precondition: filename is a string
         """
-        import os.path
-        import traceback
+        import threading
         self.dismiss_popup()
         
-        # prepare image for saving
-        from PIL import Image as CoreImage
-
-        # This worked (Unlike Kivy)!  But is slow.
-        current = self.workspace.getCurrent()
+        snapshot = self.workspace.getCurrent().copy()
+        self.save_done = 0
+        if self.save_action:
+            Clock.unschedule(self.save_action)
+        self.save_action = Clock.schedule_interval(self.save_monitor,0.02)
+        self.save_thread = threading.Thread(target=self.save_work,args=(snapshot,filename))
+        self.save_thread.start()
+    
+    def save_work(self, image, filename):
+        """
+        Saves the given image to a file.
+        
+        This is the function that is launched in a separate thread.  Even if the save
+        fails, it is guaranteed to call save_complete for clean-up.
+        
+        Parameter image: The image to save
+        Precondition: image is an Image object used by nothing else
+        
+        Parameter filename: An absolute filename
+        Precondition: filename is a string
+        """
+        import threading
+        import imagefile
+        thread = threading.current_thread()
         try:
-            im = CoreImage.new('RGBA',(current.getWidth(),current.getHeight()))
-            im.putdata(tuple(current.getPixels()))
-            im.save(filename,'PNG')
+            imagefile.write_image(image,filename,self.PNG_LEVEL,self.PNG_STRATEGY,
+                                  self.save_report)
+            self.save_complete(thread,None)
         except:
             traceback.print_exc()
-            self.error('Cannot save image file ' + os.path.split(filename)[1])
\ No newline at end of file
+            self.save_complete(thread,filename)
+    
+    def save_report(self, fraction):
+        """
+        Records the fraction of the image saved so far.
+        
+        This is called from the thread launched by force_png.
+        
+        Parameter fraction: The fraction saved
+        Precondition: fraction is a number 0..1
+        """
+        self.save_done = fraction
+    
+    def save_monitor(self, dt):
+        """
+        Shows the progress of the save running in the background.
+        """
+        self.show_progress(self.save_done)
+    
+    @mainthread
+    def save_complete(self, thread, failure):
+        """
+        Cleans up a save thread after completion.
+        
+        If a newer save was started in the meantime, the progress is left to it.
+        
+        Parameter thread: The thread that did the save
+        Precondition: thread is a Thread object
+        
+        Parameter failure: The file that could not be saved, if any
+        Precondition: failure is a string or None
+        """
+        import os.path
+        thread.join()
+        if thread is self.save_thread:
+            Clock.unschedule(self.save_action)
+            self.save_thread = None
+            self.save_action = None
+            self.show_progress(1)
+        if failure:
+            self.error('Cannot save image file ' + os.path.split(failure)[1])
+    
+    def show_progress(self, fraction):
+        """
+        Shows the progress of a background task.
+        
+        This application has nowhere to show it, so this method does nothing.  Subclasses
+        with a progress bar should override it.
+        
+        Parameter fraction: The fraction of the task done
+        Precondition: fraction is a number 0..1
+        """
+        pass
@@ -0,0 +1,492 @@
+"""
+Image file support for the imager application
+
+The GUI applications need to read and write image files, but so do the command line
+tools.  The command line tools cannot depend on Kivy, so the file handling lives in
+this module rather than in guibase.  PIL is used to decode the image formats.
+
+PNG files are written by this module directly, a band of rows at a time, so that the
+progress of a save can be reported.  Each row is stored as its difference from the row
+above (the PNG 'Up' filter), which helps zlib a great deal on photographs.  Python has
+no fast way to subtract two byte strings, so we spread the bytes of each band into
+16-bit lanes of a large int, and subtract the ints.  Adding 256 to each lane first means
+that no lane ever borrows from the next, and the low byte of each lane is the result.
+
+PIL cannot report progress, as it encodes the whole image in a single call.  It picks a
+filter for each row, but on photographs that does no better than Up alone.  For example,
+im_walker.png scaled up to 2392x3000 saves to 2.95 MB in 1.4s at level 6, where PIL
+takes 3.34 MB and 1.7s (at level 1, it is 3.93 MB against 4.21 MB, both in 0.5s).  Only
+small flat images come out a few percent larger.
+
+A file is written under a temporary name in the same folder, and then renamed over the
+target.  So a failed (or interrupted) save never leaves a half written file behind.
+
+Work in progress can also be saved in our native format, which is the NumPy .npy format
+(so NumPy can read it too).  This is a short header giving the shape (height, width, 3)
+and the byte type, followed by the raw pixel bytes.  There is nothing to decode, so the
+file is simply mapped into memory when it is opened (see Pixels.frombuffer).  The pages
+are copy-on-write, so editing the image never changes the file.
+"""
+import os
+import zlib
+import struct
+import pixels
+import a6image
+
+
+# The number of bytes of pixel data to read or compress at a time
+BAND = 1 << 20
+
+
+# The zlib compression strategies for PNG files.  'default' suits most photographs,
+# 'filtered' and 'rle' are faster and suit images with large flat areas, while
+# 'huffman' does no matching at all and is the fastest.
+STRATEGIES = {'default': zlib.Z_DEFAULT_STRATEGY, 'filtered': zlib.Z_FILTERED,
+              'huffman': zlib.Z_HUFFMAN_ONLY, 'rle': zlib.Z_RLE, 'fixed': zlib.Z_FIXED}
+
+# The PNG file signature
+_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# The start of the .npy file signature (followed by the version)
+_NPY = b'\x93NUMPY'
+
+# The permissions for new files (read without changing it, as this is process-wide)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def read_image(file, size=None):
+    """
+    Returns: An Image object for the given file.
+    
+    Unlike the GUI version of this function, this function does not recover from
+    errors.  If the file cannot be read, the error is raised to the caller.
+    
+    If size is given, the image only needs to be that large (say, to be looked at on
+    screen).  Decoders that can scale while decoding (like JPEG, by 1/2, 1/4 or 1/8) then
+    skip the detail that is not needed, which is much faster.  Other formats (like PNG
+    and GIF) have to be decoded at full size, but PIL then shrinks them by a whole
+    factor (averaging blocks of pixels) before they are copied.  The image returned is
+    still at least size.  Native files are mapped at full size, as that costs nothing.
+    
+    Files ending in .npy are opened with read_npy, which takes no time at all.
+    
+    The pixels are never looked at one at a time in Python.  Uncompressed RGB files
+    (like PPM and most TIFF) are read from disk straight into the pixel buffer, so the
+    memory used is not much more than the final image.  Other files are decoded by PIL
+    and then copied a band of rows at a time.  PIL decodes the whole image first, and
+    keeps 4 bytes per pixel, so these need a bit more than twice the memory of the
+    final image while they are read (see _read_bands).
+    
+    Parameter file: An absolute or relative path to an image file
+    Precondition: file is a string
+    
+    Parameter size: The smallest (width, height) needed, or None for full size
+    Precondition: size is None or a pair of ints > 0
+    """
+    from PIL import Image as CoreImage
+    if file.lower().endswith('.npy'):
+        return read_npy(file)
+    
+    image = CoreImage.open(file)
+    if not size is None:
+        image.draft('RGB',tuple(size))
+        factor = min(image.size[0]//size[0],image.size[1]//size[1])
+        if factor > 1:
+            image = (image if image.mode == 'RGB' else image.convert('RGB')).reduce(factor)
+    return _decode(image,file)
+
+
+def read_draft(file, size):
+    """
+    Returns: A quick low resolution Image object for the given file, or None
+    
+    This is meant for showing something on screen while the full image is read.  It
+    only reads the file if the decoder can skip detail while decoding (see read_image).
+    Otherwise it returns None right away, as the image would cost as much as the full
+    one.  The image returned is at least size, but may be much smaller than the file.
+    
+    Parameter file: An absolute or relative path to an image file
+    Precondition: file is a string
+    
+    Parameter size: The smallest (width, height) needed
+    Precondition: size is a pair of ints > 0
+    """
+    from PIL import Image as CoreImage
+    if file.lower().endswith('.npy'):
+        return None
+    
+    image = CoreImage.open(file)
+    full = image.size
+    if image.draft('RGB',tuple(size)) is None or image.size == full:
+        image.close()
+        return None
+    return _decode(image,file)
+
+
+def read_size(file):
+    """
+    Returns: The size (width, height) of the image in the given file
+    
+    Only the header of the file is read, so this is much faster than reading the
+    image.  If the file cannot be read, the error is raised to the caller.
+    
+    Parameter file: An absolute or relative path to an image file
+    Precondition: file is a string
+    """
+    from PIL import Image as CoreImage
+    if file.lower().endswith('.npy'):
+        image = read_npy(file)
+        return (image.getWidth(), image.getHeight())
+    
+    with CoreImage.open(file) as image:
+        return image.size
+
+
+def read_npy(file):
+    """
+    Returns: An Image object for the given file in the native (.npy) format.
+    
+    The file is mapped into memory rather than read, so this takes the same (very
+    short) time for any size of image.  The pixels are read from disk when they are
+    first used.  The image may be changed, but that never changes the file.  Copies
+    of the image made before it is changed (such as the first edit of an Editor) are
+    new mappings of the file, so they take no time either (see Pixels.frombuffer).
+    
+    The file stays open for as long as the image (or a copy) is mapped.
+    
+    Parameter file: An absolute or relative path to a .npy file
+    Precondition: file is a string
+    """
+    import ast
+    stream = open(file,'rb')
+    try:
+        magic = stream.read(8)
+        if magic[:6] != _NPY or not magic[6] in [1,2,3]:
+            raise ValueError(repr(file)+' is not a .npy file')
+        if magic[6] == 1:
+            length = struct.unpack('<H',stream.read(2))[0]
+        else:
+            length = struct.unpack('<I',stream.read(4))[0]
+        header = ast.literal_eval(stream.read(length).decode('latin1'))
+        offset = stream.tell()
+        
+        shape = header['shape']
+        if (not header['descr'] in ['|u1','u1','<u1','>u1'] or header['fortran_order'] or
+            len(shape) != 3 or shape[2] != 3):
+            raise ValueError(repr(file)+' is not an RGB image of bytes')
+        height, width = shape[0], shape[1]
+        if width*height == 0:
+            raise ValueError(repr(file)+' is an empty image')
+        
+        reopen = _mapper(stream,offset,width*height*3)
+        data = pixels.Pixels.frombuffer(reopen(),reopen)
+    except:
+        stream.close()
+        raise
+    return a6image.Image(data,width)
+
+
+def write_image(image, file, level=6, strategy='default', progress=None):
+    """
+    Saves the given image as a PNG file, or a native file if file ends in .npy
+    
+    See write_png and write_npy for the parameters.
+    """
+    if file.lower().endswith('.npy'):
+        write_npy(image,file,progress)
+    else:
+        write_png(image,file,level,strategy,progress)
+
+
+def write_npy(image, file, progress=None):
+    """
+    Saves the given image in the native (.npy) format.
+    
+    If the file already exists, it is replaced without warning.  But it is only
+    replaced once the new file is complete.
+    
+    Parameter image: The image to save
+    Precondition: image is an Image object that is not modified during the save
+    
+    Parameter file: An absolute or relative path to the .npy file
+    Precondition: file is a string
+    
+    Parameter progress: A function to call with the fraction of the image saved so far
+    Precondition: progress is None or a function taking a number 0..1
+    """
+    _replace(file,lambda stream: _write_npy(image,stream,progress))
+
+
+def write_png(image, file, level=6, strategy='default', progress=None):
+    """
+    Saves the given image as a PNG file.
+    
+    If the file already exists, it is replaced without warning.  But it is only
+    replaced once the new file is complete.
+    
+    The compression level and strategy trade the size of the file for the time it
+    takes to save.  Level 1 is fast, while level 9 is small.  The strategy tells zlib
+    what to expect of the (filtered) pixel data (see STRATEGIES).
+    
+    PNG files cannot be empty, so an image with no pixels raises a ValueError (and no
+    file is written).
+    
+    Parameter image: The image to save
+    Precondition: image is an Image object that is not modified during the save
+    
+    Parameter file: An absolute or relative path to the PNG file
+    Precondition: file is a string
+    
+    Parameter level: The compression level
+    Precondition: level is an int 0..9
+    
+    Parameter strategy: The compression strategy
+    Precondition: strategy is a key of STRATEGIES
+    
+    Parameter progress: A function to call with the fraction of the image saved so far
+    Precondition: progress is None or a function taking a number 0..1
+    """
+    assert type(level) == int and 0 <= level <= 9, repr(level)+' is not a valid level'
+    assert strategy in STRATEGIES, repr(strategy)+' is not a valid strategy'
+    if image.getLength() == 0:
+        raise ValueError('An empty image cannot be saved as '+repr(file))
+    _replace(file,lambda stream: _write_png(image,stream,level,STRATEGIES[strategy],progress))
+
+
+# HELPERS
+def _decode(image, file):
+    """
+    Returns: An Image object with the pixels of the given PIL image
+    
+    See read_image for how the pixels are read.
+    
+    Parameter image: The opened image file (or its shrunk copy)
+    Precondition: image is a PIL image
+    
+    Parameter file: The path to the image file
+    Precondition: file is a string
+    """
+    width, height = image.size
+    data = pixels.Pixels(width*height)
+    if not _read_raw(image,file,data.buffer):
+        _read_bands(image,data.buffer)
+    return a6image.Image(data,width)
+
+
+def _replace(file, write):
+    """
+    Writes a file under a temporary name, and then renames it to file.
+    
+    The new file gets the permissions of the file it replaces (if any).  If the write
+    fails, the temporary file is removed and file is left alone.
+    
+    Parameter file: An absolute or relative path to the file
+    Precondition: file is a string
+    
+    Parameter write: The function writing the contents to an open binary file
+    Precondition: write is a function taking a binary file-like object
+    """
+    import tempfile
+    folder, name = os.path.split(os.path.abspath(file))
+    handle, temp = tempfile.mkstemp(prefix='.'+name+'.',suffix='.tmp',dir=folder)
+    try:
+        with os.fdopen(handle,'wb') as stream:
+            write(stream)
+            stream.flush()
+            os.fsync(stream.fileno())
+        if os.path.exists(file):
+            os.chmod(temp,os.stat(file).st_mode & 0o7777)
+        else:
+            os.chmod(temp,0o666 & ~_UMASK)
+        os.replace(temp,file)
+    except:
+        os.remove(temp)
+        raise
+
+
+def _write_npy(image, stream, progress):
+    """
+    Writes the given image to stream in the native (.npy) format.
+    
+    See write_npy for the parameters.
+    """
+    width  = image.getWidth()
+    height = image.getHeight()
+    
+    # The header is padded with spaces so that the pixels start on a multiple of 64
+    header = "{'descr': '|u1', 'fortran_order': False, 'shape': (%d, %d, 3), }" % (height,width)
+    header = header+' '*(63-(len(header)+10) % 64)+'\n'
+    stream.write(_NPY+b'\x01\x00'+struct.pack('<H',len(header))+header.encode('latin1'))
+    
+    buffer = image.getPixels().buffer
+    with memoryview(buffer) as view:
+        for start in range(0,len(buffer),BAND):
+            stream.write(view[start:start+BAND])
+            if progress:
+                progress(min(start+BAND,len(buffer))/len(buffer))
+
+
+def _write_png(image, stream, level, strategy, progress):
+    """
+    Writes the given image to stream in the PNG format.
+    
+    See write_png for the parameters.  The strategy is the zlib value, not its name.
+    """
+    width  = image.getWidth()
+    height = image.getHeight()
+    buffer = image.getPixels().buffer
+    stride = width*3
+    rows   = max(1,BAND//stride)
+    
+    header = struct.pack('>IIBBBBB',width,height,8,2,0,0,0)
+    stream.write(_SIGNATURE+_chunk(b'IHDR',header))
+    
+    compressor = zlib.compressobj(level,zlib.DEFLATED,15,9,strategy)
+    above = bytes(stride)
+    for top in range(0,height,rows):
+        count = min(rows,height-top)
+        band  = buffer[top*stride:(top+count)*stride].tobytes()
+        
+        # Subtract the row above from every row (see the module description)
+        lanes = _spread(band)+int.from_bytes(b'\x00\x01'*len(band),'little')
+        lanes = lanes-_spread(above+band[:-stride])
+        diffs = lanes.to_bytes(2*len(band),'little')[::2]
+        
+        # Each row starts with its filter type (2 is Up)
+        data = bytearray((stride+1)*count)
+        data[0::stride+1] = b'\x02'*count
+        for row in range(count):
+            data[row*(stride+1)+1:(row+1)*(stride+1)] = diffs[row*stride:(row+1)*stride]
+        
+        data = compressor.compress(data)
+        if data:
+            stream.write(_chunk(b'IDAT',data))
+        above = band[-stride:]
+        if progress:
+            progress((top+count)/height)
+    
+    stream.write(_chunk(b'IDAT',compressor.flush())+_chunk(b'IEND',b''))
+
+
+def _read_raw(image, file, buffer):
+    """
+    Returns: True if the pixels of image could be read straight from file into buffer
+    
+    This is possible when every tile of the file holds whole rows of raw RGB bytes,
+    from top to bottom.  Otherwise (or if image is not read from a file, like a shrunk
+    image), nothing is read and this function returns False.
+    
+    Parameter image: The opened image
+    Precondition: image is a PIL Image object
+    
+    Parameter file: The image file
+    Precondition: file is a string
+    
+    Parameter buffer: The buffer to fill
+    Precondition: buffer is an array of 3*width*height bytes
+    """
+    width, height = image.size
+    tiles = getattr(image,'tile',None)
+    if image.mode != 'RGB' or not tiles:
+        return False
+    
+    # The raw arguments are the layout (rawmode, stride, orientation) or just rawmode
+    for codec, extents, offset, args in [tile[:4] for tile in tiles]:
+        args = args if type(args) == tuple else (args, 0, 1)
+        if codec != 'raw' or not tuple(args[:3]) in [('RGB',0,1),('RGB',width*3,1)]:
+            return False
+        if extents[0] != 0 or extents[2] != width:
+            return False
+    
+    stride = width*3
+    rows = max(1,BAND//stride)
+    with open(file,'rb') as stream, memoryview(buffer) as view:
+        for tile in tiles:
+            extents, offset = tile[1], tile[2]
+            stream.seek(offset)
+            for top in range(extents[1],min(extents[3],height),rows):
+                bottom = min(top+rows,extents[3],height)
+                if stream.readinto(view[top*stride:bottom*stride]) != (bottom-top)*stride:
+                    raise OSError('image file is truncated')
+    return True
+
+
+def _mapper(stream, offset, size):
+    """
+    Returns: A function that maps the pixels of an open .npy file into memory
+    
+    Each call makes a new copy-on-write mapping, and returns the pixel bytes as a
+    memoryview.  So changes to one mapping are never seen by the file or by any other
+    mapping.  The function keeps the file open.
+    
+    Parameter stream: The open file
+    Precondition: stream is a binary file object open for reading
+    
+    Parameter offset: The position of the pixels in the file
+    Precondition: offset is an int >= 0
+    
+    Parameter size: The number of bytes of pixels
+    Precondition: size is an int > 0
+    """
+    import mmap
+    def remap():
+        mapping = mmap.mmap(stream.fileno(),0,access=mmap.ACCESS_COPY)
+        if len(mapping) < offset+size:
+            raise OSError('image file is truncated')
+        return memoryview(mapping)[offset:offset+size]
+    return remap
+
+
+def _read_bands(image, buffer):
+    """
+    Decodes image with PIL and copies it into buffer, a band of rows at a time.
+    
+    This does not save memory on the decode itself.  Compressed formats like PNG and
+    JPEG are decoded from top to bottom in one go, and PIL keeps the whole result (4
+    bytes per pixel, as it pads RGB).  So while this runs, both that and the buffer
+    are held, about 2.3 times the final image.  Converting and copying a band at a
+    time only avoids a third full copy for the converted (or packed) bytes.
+    
+    Parameter image: The opened image
+    Precondition: image is a PIL Image object
+    
+    Parameter buffer: The buffer to fill
+    Precondition: buffer is an array of 3*width*height bytes
+    """
+    width, height = image.size
+    stride = width*3
+    rows = max(1,BAND//stride)
+    image.load()
+    with memoryview(buffer) as view:
+        for top in range(0,height,rows):
+            bottom = min(top+rows,height)
+            band = image.crop((0,top,width,bottom))
+            if band.mode != 'RGB':
+                band = band.convert('RGB')
+            view[top*stride:bottom*stride] = band.tobytes()
+
+
+def _chunk(kind, data):
+    """
+    Returns: the bytes of a PNG chunk of the given kind holding data
+    
+    Parameter kind: The chunk type
+    Precondition: kind is a 4 byte bytes object
+    
+    Parameter data: The chunk contents
+    Precondition: data is a bytes-like object
+    """
+    return struct.pack('>I',len(data))+kind+data+struct.pack('>I',zlib.crc32(kind+data))
+
+
+def _spread(data):
+    """
+    Returns: the int whose 16-bit lanes (least significant first) hold the bytes of data
+    
+    Parameter data: The bytes to spread
+    Precondition: data is a bytes-like object
+    """
+    lanes = bytearray(2*len(data))
+    lanes[::2] = data
+    return int.from_bytes(lanes,'little')
@@ -0,0 +1,248 @@
+"""
+Result caching for Editor operations
+
+Users often go back and forth between a few settings of the same filter (say the
+different block sizes of pixellate), undoing one to try another.  Each of these used to
+be computed from scratch, even when the very same result had been computed a moment
+before.  This module keeps the most recent results, so that they can be reused.
+
+A result is found by the contents of the image it was computed from (along with the
+operations still waiting on it, see Editor.getCurrent), and the name and arguments of
+the operation.  The contents are identified by Pixels.digest,
+which only rehashes the parts of an image that have changed.  So looking up a result
+never costs a full pass over an unchanged image.
+
+Results are kept until they no longer fit in the byte budget of the cache.  Then the
+least recently used ones are thrown away.
+
+The same cache also keeps images decoded from files (see filekey), so that going back
+to a file (or to one read ahead of time) does not decode it again.
+"""
+from collections import OrderedDict
+
+
+# The default number of bytes of pixel data to keep in a cache
+BUDGET = 256*1024*1024
+
+
+class ResultCache(object):
+    """
+    A class to remember the results of Editor operations
+    
+    The cache behaves like a dictionary from keys to images, except that it forgets the
+    least recently used images once their pixel data is more than the budget.  The keys
+    are made by the functions key and filekey in this module.
+    
+    Images are copied both going into and coming out of the cache.  So the cached images
+    can never be changed by an edit.
+    
+    IMMUTABLE ATTRIBUTES (Fixed after initialization)
+        _budget:  The maximum bytes of pixel data to keep [int >= 0]
+        _results: The cached images, from least to most recently used [OrderedDict]
+    
+    MUTABLE ATTRIBUTES (Can be changed at any time)
+        _size:    The bytes of pixel data currently kept [int >= 0]
+    """
+    
+    # GETTERS
+    def getBudget(self):
+        """
+        Returns: The maximum number of bytes of pixel data to keep
+        """
+        return self._budget
+    
+    
+    def getSize(self):
+        """
+        Returns: The number of bytes of pixel data currently kept
+        """
+        return self._size
+    
+    
+    # INITIALIZER
+    def __init__(self, budget=BUDGET):
+        """
+        Initializer: Creates an empty cache with the given byte budget
+        
+        Parameter budget: The maximum number of bytes of pixel data to keep
+        Precondition: budget is an int >= 0
+        """
+        assert type(budget) == int and budget >= 0, repr(budget)+' is not a valid budget'
+        self._budget  = budget
+        self._results = OrderedDict()
+        self._size    = 0
+    
+    
+    def __len__(self):
+        """
+        Returns: The number of results in this cache
+        """
+        return len(self._results)
+    
+    
+    def __contains__(self, key):
+        """
+        Returns: True if there is a result for key in this cache
+        
+        This does not count as a use of the result.
+        
+        Parameter key: The key to look for
+        Precondition: key is a key made by the function key or filekey
+        """
+        return key in self._results
+    
+    
+    # OPERATIONS
+    def get(self, key):
+        """
+        Returns: A copy of the image cached for key, or None if there is none
+        
+        The result becomes the most recently used one.
+        
+        Parameter key: The key to look for
+        Precondition: key is a key made by the function key or filekey
+        """
+        if not key in self._results:
+            return None
+        self._results.move_to_end(key)
+        return self._results[key].copy()
+    
+    
+    def put(self, key, image):
+        """
+        Caches a copy of image for key
+        
+        The result becomes the most recently used one.  Older results are thrown away
+        until the cache fits in its budget.  An image that is larger than the whole
+        budget is not cached at all.
+        
+        Parameter key: The key to cache the image under
+        Precondition: key is a key made by the function key or filekey
+        
+        Parameter image: The image to cache
+        Precondition: image is an Image object
+        """
+        self.discard(key)
+        size = len(image.getPixels().buffer)
+        if size > self._budget:
+            return
+        
+        # Hash before copying, so that the copy gets the hashes for free
+        image.getPixels().digest()
+        self._results[key] = image.copy()
+        self._size += size
+        while self._size > self._budget:
+            _, oldest = self._results.popitem(last=False)
+            self._size -= len(oldest.getPixels().buffer)
+    
+    
+    def discard(self, key):
+        """
+        Removes the result for key, if there is one.
+        
+        Parameter key: The key to remove
+        Precondition: key is a key made by the function key or filekey
+        """
+        if key in self._results:
+            self._size -= len(self._results.pop(key).getPixels().buffer)
+    
+    
+    def clear(self):
+        """
+        Removes every result from this cache.
+        """
+        self._results.clear()
+        self._size = 0
+
+
+def key(image, op, *args):
+    """
+    Returns: The cache key for the operation op applied to image
+    
+    The arguments are included by their repr, as some of them (like convolution
+    kernels) are lists, which cannot be dictionary keys.
+    
+    Parameter image: The image the operation is applied to
+    Precondition: image is an Image object
+    
+    Parameter op: The name of the Editor method
+    Precondition: op is a string
+    
+    Parameter(s) *args: The arguments to the operation
+    Precondition: args are valid arguments for op
+    """
+    return (image.getPixels().digest(), image.getWidth(), op, repr(args))
+
+
+def editkey(editor, op, *args):
+    """
+    Returns: The cache key for the operation op applied to the current image of editor
+    
+    The point operations and symmetries waiting on the current image (see the method
+    Editor.getCurrent) are not applied.  Instead, the key is made from the image that
+    they wait on, together with the waiting operations themselves.  So looking up a
+    result never applies them.
+    
+    Parameter editor: The editor the operation is applied to
+    Precondition: editor is an Editor object
+    
+    Parameter op: The name of the Editor method
+    Precondition: op is a string
+    
+    Parameter(s) *args: The arguments to the operation
+    Precondition: args are valid arguments for op
+    """
+    return key(editor.getCurrent(False), op, *args)+(repr(editor.getWaiting()),)
+
+
+def filekey(file):
+    """
+    Returns: The cache key for the image stored in the given file
+    
+    The key includes the modification time and size of the file, so that an image is
+    never found once its file has changed.
+    
+    Parameter file: An absolute or relative path to an image file
+    Precondition: file is a string naming an existing file
+    """
+    import os
+    info = os.stat(file)
+    return (os.path.abspath(file), info.st_mtime_ns, info.st_size)
+
+
+def run(cache, editor, op, *args, runner=None):
+    """
+    Performs the given operation on the current image of editor, reusing old results
+    
+    If the cache has the result of this operation on an image with the same contents
+    (and the same waiting operations, see editkey), it replaces the current image.
+    Otherwise, the operation is performed and its result is cached.  The waiting
+    operations are only applied in that case, together with the operation if it is a
+    point operation or symmetry as well.
+    
+    Parameter cache: The cache to use
+    Precondition: cache is a ResultCache object
+    
+    Parameter editor: The editor to modify
+    Precondition: editor is an Editor object
+    
+    Parameter op: The name of the Editor method to call
+    Precondition: op is a string
+    
+    Parameter(s) *args: The arguments to the operation
+    Precondition: args are valid arguments for op
+    
+    Parameter runner: The function to perform the operation (like parallel.run)
+    Precondition: runner is None or a function taking editor, op, and args
+    """
+    name = editkey(editor, op, *args)
+    result = cache.get(name)
+    if not result is None:
+        editor.restore(result)
+        return
+    
+    if runner is None:
+        getattr(editor, op)(*args)
+    else:
+        runner(editor, op, *args)
+    cache.put(name, editor.getCurrent())
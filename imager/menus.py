@@ -170,4 +170,84 @@ class BlockDropDown(MenuDropDown):
     # 100 pixel block
     choice100 = ObjectProperty(None)
     # 200 pixel block
-    choice200 = ObjectProperty(None)
\ No newline at end of file
+    choice200 = ObjectProperty(None)
+
+
+class MedianDropDown(MenuDropDown):
+    """
+    A controller for a Median drop-down, providing options for the median radius
+    
+    The View for this controller is defined in imager.kv.  This class simply contains
+    the hooks for the view properties
+    """
+    # These fields are 'hooks' to connect to the imager.kv file
+    # 1 pixel radius
+    choice1 = ObjectProperty(None)
+    # 2 pixel radius
+    choice2 = ObjectProperty(None)
+    # 5 pixel radius
+    choice5 = ObjectProperty(None)
+
+
+class BlurDropDown(MenuDropDown):
+    """
+    A controller for a Blur drop-down, providing options for the blur radius
+    
+    The View for this controller is defined in imager.kv.  This class simply contains
+    the hooks for the view properties
+    """
+    # These fields are 'hooks' to connect to the imager.kv file
+    # 2 pixel blur
+    choice2  = ObjectProperty(None)
+    # 5 pixel blur
+    choice5  = ObjectProperty(None)
+    # 10 pixel blur
+    choice10 = ObjectProperty(None)
+    # 20 pixel blur
+    choice20 = ObjectProperty(None)
+
+
+class SharpDropDown(MenuDropDown):
+    """
+    A controller for a Sharpen drop-down, providing a choice of sharpening filters
+    
+    The View for this controller is defined in imager.kv.  This class simply contains
+    the hooks for the view properties
+    """
+    # These fields are 'hooks' to connect to the imager.kv file
+    # Sharpen with a 3x3 kernel
+    sharpchoice   = ObjectProperty(None)
+    # Sharpen with an unsharp mask
+    unsharpchoice = ObjectProperty(None)
+    # Find the edges
+    edgechoice    = ObjectProperty(None)
+
+
+class SizeDropDown(MenuDropDown):
+    """
+    A controller for a Size drop-down, providing options for resizing the image
+    
+    The View for this controller is defined in imager.kv.  This class simply contains
+    the hooks for the view properties
+    """
+    # These fields are 'hooks' to connect to the imager.kv file
+    # Shrink to half size
+    halfchoice    = ObjectProperty(None)
+    # Shrink to quarter size
+    quarterchoice = ObjectProperty(None)
+    # Enlarge to double size
+    doublechoice  = ObjectProperty(None)
+
+
+class ToneDropDown(MenuDropDown):
+    """
+    A controller for a Tone drop-down, providing a choice of exposure corrections
+    
+    The View for this controller is defined in imager.kv.  This class simply contains
+    the hooks for the view properties
+    """
+    # These fields are 'hooks' to connect to the imager.kv file
+    # Stretch each channel to the full range
+    levelschoice   = ObjectProperty(None)
+    # Equalize each channel
+    equalizechoice = ObjectProperty(None)
@@ -0,0 +1,176 @@
+"""
+Multi-core execution of Editor operations
+
+The image processing methods in Editor are pure Python.  Because of the interpreter
+lock, a thread running one of them can only ever use a single core.  This module gets
+around that by splitting the current image into horizontal strips and running the
+operation on each strip in a separate worker process.
+
+The pixels are shared with the workers through multiprocessing.shared_memory, so the
+strips are never pickled.  Each worker copies its strip (plus any halo rows that the
+operation needs from its neighbors) into a private Editor, performs the operation, and
+writes the rows that it owns back to shared memory.  Operations that read neighboring
+pixels write to a second block of shared memory, so that no worker can see pixels that
+another worker has already changed.  As each strip is done, it is copied back into the
+current image in place, and published (see Pixels.publish) so that it can be shown
+before the rest of the image is finished.
+
+The strips are handed out in the order ORDER.  Starting from the center means that the
+part of the image the user is most likely looking at is finished first.
+
+Only the operations listed in Editor.HALO can be split this way.  Everything else
+runs in the calling thread as usual.
+"""
+import os
+
+
+# The number of worker processes to use
+WORKERS = os.cpu_count() or 1
+
+# Images with fewer pixels than this are not worth the cost of starting the workers
+MINIMUM = 250000
+
+# The number of strips to give each worker (more strips balance the load better)
+STRIPS = 4
+
+# The orders in which the strips can be processed
+ORDERS = ('top-down', 'center-out')
+
+# The order in which strips are processed by default
+ORDER = 'center-out'
+
+
+def run(editor, op, *args, workers=None, order=None):
+    """
+    Performs the given operation on the current image of editor, in parallel if possible
+    
+    The operation is split into strips when the editor allows it (see Editor.getHalo)
+    and the image has at least MINIMUM pixels.  In all other cases, this function
+    simply calls the operation.  With a single worker, the strips are processed one
+    at a time in this process.
+    
+    While the workers run, the strips are written to the current image as they are
+    completed, marked as modified, and published.  So the progress bar works as usual,
+    and the finished strips can be shown right away.  The editor may be cancelled (see
+    Editor.cancel) between any two strips, in which case the workers are stopped.
+    
+    Parameter editor: The editor to modify
+    Precondition: editor is an Editor object
+    
+    Parameter op: The name of the Editor method to call
+    Precondition: op is a string
+    
+    Parameter(s) *args: The arguments to the operation
+    Precondition: args are valid arguments for op
+    
+    Parameter workers: The number of worker processes (WORKERS if None)
+    Precondition: workers is an int > 0 or None
+    
+    Parameter order: The order to process the strips (ORDER if None)
+    Precondition: order is one of ORDERS or None
+    """
+    from multiprocessing import Pool
+    from multiprocessing import shared_memory
+    
+    workers = WORKERS if workers is None else workers
+    order   = ORDER if order is None else order
+    assert order in ORDERS, repr(order)+' is not a valid strip order'
+    current = editor.getCurrent()
+    halo = editor.getHalo(op, *args)
+    if halo is None or current.getLength() < MINIMUM:
+        return getattr(editor, op)(*args)
+    
+    data   = current.getPixels()
+    width  = current.getWidth()
+    height = current.getHeight()
+    size   = len(data.buffer)
+    rows   = max(1,-(-height//(workers*STRIPS)))
+    
+    source = shared_memory.SharedMemory(create=True,size=size)
+    target = source if halo == 0 else shared_memory.SharedMemory(create=True,size=size)
+    try:
+        source.buf[:size] = data.buffer
+        tasks = []
+        for top in range(0,height,rows):
+            bottom = min(top+rows,height)
+            tasks.append((source.name,target.name,width,height,top,bottom,halo,op,args))
+        if order == 'center-out':
+            tasks.sort(key=lambda task: abs(task[4]+task[5]-height))
+        
+        if workers < 2:
+            _gather(map(_work,tasks),editor,target,width)
+        else:
+            with Pool(min(workers,len(tasks))) as pool:
+                _gather(pool.imap_unordered(_work,tasks),editor,target,width)
+    finally:
+        for block in {source, target}:
+            block.close()
+            block.unlink()
+
+
+def _gather(strips, editor, block, width):
+    """
+    Copies each strip into the current image as it is completed, and publishes it
+    
+    This stops with Cancelled (see Editor.checkpoint) as soon as the editor is
+    cancelled, without waiting for the remaining strips.
+    
+    Parameter strips: The rows (top, bottom) of each strip, as they are completed
+    Precondition: strips is an iterable of pairs of ints
+    
+    Parameter editor: The editor whose current image is being computed
+    Precondition: editor is an Editor object
+    
+    Parameter block: The shared memory holding the results
+    Precondition: block is a SharedMemory object the size of the image buffer
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    """
+    data = editor.getCurrent(False).getPixels()
+    with memoryview(data.buffer) as view:
+        editor.checkpoint()
+        for top, bottom in strips:
+            view[top*width*3:bottom*width*3] = block.buf[top*width*3:bottom*width*3]
+            data.mark(top*width,bottom*width)
+            data.publish(top*width,bottom*width)
+            editor.checkpoint()
+
+
+def _work(task):
+    """
+    Returns: the rows (top, bottom) of the strip processed by this task
+    
+    This is the function run by each worker process.  It performs the operation on
+    rows top..bottom-1 of the source image, and writes the result to the same rows
+    of the target image.
+    
+    Parameter task: The strip to process
+    Precondition: task is a tuple (source, target, width, height, top, bottom, halo,
+    op, args) where source and target are the names of shared memory blocks
+    """
+    from multiprocessing import shared_memory
+    import pixels
+    import a6image
+    import a6editor
+    
+    source, target, width, height, top, bottom, halo, op, args = task
+    lo = max(0,top-halo)
+    hi = min(height,bottom+halo)
+    
+    block = shared_memory.SharedMemory(name=source)
+    try:
+        strip = pixels.Pixels.frombytes(block.buf[lo*width*3:hi*width*3])
+    finally:
+        block.close()
+    
+    editor = a6editor.Editor(a6image.Image(strip,width))
+    getattr(editor, op)(*args)
+    result = editor.getCurrent().getPixels().buffer
+    
+    block = shared_memory.SharedMemory(name=target)
+    try:
+        block.buf[top*width*3:bottom*width*3] = result[(top-lo)*width*3:(bottom-lo)*width*3]
+    finally:
+        block.close()
+    return (top, bottom)
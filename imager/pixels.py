@@ -13,6 +13,7 @@ Date:   October 20, 2017
 """
 from array import array             # Byte buffers
 from io import StringIO             # Making complex strings
+from collections import deque       # Thread-safe queues
 import traceback
 
 
@@ -34,15 +35,82 @@ class Pixels(object):
     The methods progress() and unmark() are used to track changes to this pixel list.
     These methods are used by the progress bar to display how much of the image has
     been modified.
+    
+    The methods publish() and tiles() let the code computing an image show parts of it
+    before it is done.  The code calls publish() for each finished part (a tile), and
+    the display calls tiles() to collect them.  These may be called from different
+    threads.
+    
+    The method digest() returns a hash of the pixel contents, for caching results.  The
+    pixels are hashed in blocks of BLOCK pixels.  A change only marks the blocks it
+    touches as dirty, and those are hashed again when digest() is next called.  So
+    writing a pixel stays cheap, and asking again after a small change (or no change)
+    does not rehash the whole image.
     """
     
+    # The number of pixels in each separately hashed block
+    BLOCK = 16384
+    
     @property
     def buffer(self):
         """
         The underlying byte buffer
+        
+        This is an array of bytes, unless the pixel list was made with frombuffer (or is
+        a copy of one that was never changed).
         """
         return self._buffer
     
+    @classmethod
+    def frombytes(cls,data):
+        """
+        Returns: A new pixel list holding a copy of the given bytes
+        
+        The bytes are the packed (r,g,b) values, so the pixel list has one third as
+        many elements as there are bytes.  This is much faster than filling the pixel
+        list one tuple at a time.
+        
+        Parameter data: the pixel bytes
+        Precondition: data is a bytes-like object whose length is a multiple of 3
+        """
+        assert len(data) % 3 == 0, 'the number of bytes is not a multiple of 3'
+        result = cls(0)
+        result._buffer.frombytes(data)
+        result._size = len(result._buffer)//3
+        result.unmark()
+        result._forget(0,result._size)
+        return result
+    
+    @classmethod
+    def frombuffer(cls,buffer,reopen=None):
+        """
+        Returns: A new pixel list that stores its pixels in the given buffer
+        
+        Unlike frombytes, this does not copy the buffer, so it takes no time at all.  It
+        is meant for memory mapped files.  The pixel list cannot change its length.
+        
+        Copies of the pixel list (made by slicing) are ordinary pixel lists.  But if
+        reopen is given and the pixel list has not been changed, a full copy uses the
+        buffer returned by reopen instead.  For a file mapped copy-on-write, that is a
+        new mapping of the same file, so nothing is copied until it is changed.
+        
+        Parameter buffer: the pixel bytes
+        Precondition: buffer is a writable memoryview of bytes whose length is a
+        multiple of 3
+        
+        Parameter reopen: A function returning a new buffer with the original contents
+        Precondition: reopen is None or a function taking no arguments and returning a
+        buffer like the given one, which does not share changes with it
+        """
+        assert len(buffer) % 3 == 0, 'the number of bytes is not a multiple of 3'
+        result = cls(0)
+        result._buffer = buffer
+        result._size = len(buffer)//3
+        result.unmark()
+        result._forget(0,result._size)
+        result._reopen = reopen
+        return result
+    
     # INITIALIZER
     def __init__(self,size):
         """
@@ -58,8 +126,14 @@ class Pixels(object):
         assert size >= 0, repr(size)+' is negative'
         
         self._size   = size
-        self._buffer = array('B',[0]*size*3)
+        self._buffer = array('B',bytes(size*3))
+        self._reopen = None
         self.unmark()
+        self._hashes = []
+        self._dirty  = bytearray()
+        self._digest = None
+        self._forget(0,size)
+        self._tiles  = deque()
     
     # DISPLAY METHODS
     def __str__(self):
@@ -120,8 +194,25 @@ class Pixels(object):
             stop  = self._size if index.stop is None else index.stop
             # Time to make a copy
             if index.step is None:
-                result = Pixels(stop-start)
-                result._buffer = self._buffer[start*3:stop*3]
+                # Start empty, as allocating the pixels only to replace them is slow
+                result = Pixels(0)
+                if type(self._buffer) == array:
+                    result._buffer = self._buffer[start*3:stop*3]
+                elif self._reopen and start == 0 and stop == self._size:
+                    # Nothing has been written, so a new mapping has the same contents
+                    result._buffer = self._reopen()
+                    result._reopen = self._reopen
+                else:
+                    result._buffer = array('B')
+                    result._buffer.frombytes(self._buffer[start*3:stop*3])
+                result._size = len(result._buffer)//3
+                result.unmark()
+                result._forget(0,result._size)
+                if start == 0 and stop == self._size:
+                    # A full copy has the same contents, so keep the hashes
+                    result._hashes = list(self._hashes)
+                    result._dirty  = bytearray(self._dirty)
+                    result._digest = self._digest
             else:
                 result = Pixels(len(range(start,stop,index.step)))
                 opos = 0
@@ -155,8 +246,11 @@ class Pixels(object):
                 self._buffer[index*3+1] = value[1]
                 self._buffer[index*3+2] = value[2]
                 if not self._marker[index]:
+                    # Every pixel is unmarked until the first write, so this is enough
                     self._marker[index] = 1
                     self._change += 1
+                    self._reopen = None
+                self._dirty[(index % self._size)//self.BLOCK] = 1
             except IndexError:
                 traceback.print_exc()
                 raise IndexError(repr(index)+' is not a valid pixel index')
@@ -166,6 +260,7 @@ class Pixels(object):
             if not type(value) == Pixels:
                 raise ValueError('attempt to assign a non-pixel sequence to a slice')
             size = len(range(index.start,index.stop,index.step))
+            self._reopen = None
             if len(value) == size:
                 npos = 0
                 for opos in range(index.start,index.stop,index.step):
@@ -176,6 +271,7 @@ class Pixels(object):
                     if not self._marker[opos]:
                         self._marker[opos] = 1
                         self._change += 1
+                self._forget(0, self._size)
             elif index.step is None:
                 self._buffer[index.start*3:index.stop*3] = value._buffer
                 self._size = len(self._buffer)//3
@@ -184,8 +280,9 @@ class Pixels(object):
                 for pos in range(index.start,index.stop):
                     if self._marker[pos]:
                         prev += 1
-                self._marker[index.start:index.stop] = [1]*len(value)
+                self._marker[index.start:index.stop] = b'\x01'*len(value)
                 self._change += len(value)-prev
+                self._forget(0, self._size)
             else:
                 raise ValueError('attempt to assign sequence of size '+str(len(value))+' to extended slice of size '+str(size))
         else:
@@ -209,14 +306,111 @@ class Pixels(object):
         """
         return self._change/self._size
     
+    def mark(self, start, stop):
+        """
+        Marks the pixels in the range start..stop-1 as modified.
+        
+        Code that writes to the byte buffer directly bypasses the change tracking of
+        this pixel list.  Such code should call this method afterwards so that the
+        progress bar remains accurate.
+        
+        Parameter start: The first pixel modified
+        Precondition: start is an int >= 0
+        
+        Parameter stop: The pixel after the last one modified
+        Precondition: stop is an int >= start and <= the length of this list
+        """
+        prev = self._marker[start:stop].count(1)
+        self._marker[start:stop] = b'\x01'*(stop-start)
+        self._change += (stop-start)-prev
+        self._reopen = None
+        self._forget(start, stop)
+    
     def unmark(self):
         """
         Resets the progress monitor to 0.
         
         This clears all change tracking.
         """
-        self._marker = [0]*self._size
+        self._marker = bytearray(self._size)
         self._change = 0
+    
+    # PARTIAL RESULTS
+    def publish(self, start, stop):
+        """
+        Announces that the pixels in the range start..stop-1 are finished.
+        
+        Unlike mark, this should only be called once every channel of these pixels
+        has its final value, as they may be shown right away.
+        
+        Parameter start: The first pixel finished
+        Precondition: start is an int >= 0
+        
+        Parameter stop: The pixel after the last one finished
+        Precondition: stop is an int >= start and <= the length of this list
+        """
+        self._tiles.append((start,stop))
+    
+    def tiles(self):
+        """
+        Returns: the list of ranges (start, stop) published since the last call
+        
+        Each range is removed once it is returned, so it is only returned once.
+        """
+        result = []
+        while self._tiles:
+            result.append(self._tiles.popleft())
+        return result
+    
+    # CONTENT HASH
+    def digest(self):
+        """
+        Returns: a hash of the contents of this pixel list, as a bytes object
+        
+        Two pixel lists with the same contents have the same digest.  Only the blocks
+        marked dirty since the last call are hashed again.  Code that writes to the byte
+        buffer directly must call mark() for this to notice.
+        """
+        from hashlib import blake2b
+        if len(self._dirty) != -(-self._size//self.BLOCK):
+            # The buffer was replaced behind our back
+            self._forget(0,self._size)
+        
+        pos = self._dirty.find(1)
+        if pos >= 0:
+            step = self.BLOCK*3
+            with memoryview(self._buffer) as view:
+                while pos >= 0:
+                    self._hashes[pos] = blake2b(view[pos*step:(pos+1)*step],digest_size=16).digest()
+                    pos = self._dirty.find(1,pos+1)
+            self._dirty  = bytearray(len(self._dirty))
+            self._digest = None
+        
+        if self._digest is None:
+            self._digest = blake2b(b''.join(self._hashes),digest_size=16).digest()
+        return self._digest
+    
+    def _forget(self, start, stop):
+        """
+        Marks the blocks holding the pixels start..stop-1 as dirty.
+        
+        The hashes are not touched until digest() is called.  If the length of this
+        list has changed, every block is marked.
+        
+        Parameter start: The first pixel changed
+        Precondition: start is an int >= 0
+        
+        Parameter stop: The pixel after the last one changed
+        Precondition: stop is an int >= start and <= the length of this list
+        """
+        blocks = -(-self._size//self.BLOCK)
+        if len(self._dirty) != blocks:
+            self._hashes = [None]*blocks
+            self._dirty  = bytearray(b'\x01'*blocks)
+        elif stop > start:
+            first = start//self.BLOCK
+            last  = (stop-1)//self.BLOCK+1
+            self._dirty[first:last] = b'\x01'*(last-first)
 
 
 class _PixelIterator(object):
@@ -0,0 +1,101 @@
+"""
+Point operation support for the imager application
+
+A point operation changes each pixel on its own, without looking at its neighbors or
+its position.  In Editor, these are invert and monochromify.  Applying several of them
+in a row (say invert, sepia, and invert again) should not take several passes over the
+image.  So Editor does not apply them right away.  It keeps a list of stages, and this
+module fuses each new operation into that list as it arrives.  The stages are applied
+all at once when the image is needed.
+
+There are two kinds of stage:
+
+    ('lut', tables)   replaces each value of each channel by its entry in a table
+                      (tables holds three bytes objects, for red, green, and blue)
+    ('mono', sepia)   converts the image to greyscale (or sepia) with monochromify
+
+Two tables in a row are fused into one with bytes.translate.  And once the image is
+known to be grey, monochromify only depends on a single value, so it is fused into a
+table as well.
+"""
+import fixedpoint
+
+
+# A table that leaves each value unchanged
+IDENTITY = bytes(range(256))
+
+# The stage for invert
+INVERT = ('lut', (bytes(range(255, -1, -1)),)*3)
+
+
+def mono(sepia):
+    """
+    Returns: the stage for monochromify
+    
+    Parameter sepia: Whether to use sepia tone instead of greyscale
+    Precondition: sepia is a bool
+    """
+    return ('mono', sepia)
+
+
+def append(stages, stage):
+    """
+    Returns: a new list of stages that performs stages followed by stage
+    
+    The new stage is fused with the last one if possible.  The list stages is not
+    modified, so it is safe to share it.
+    
+    Parameter stages: The current stages
+    Precondition: stages is a list of stages
+    
+    Parameter stage: The stage to add
+    Precondition: stage is a stage
+    """
+    kind, value = stage
+    if kind == 'mono' and _grey(stages):
+        tables = fixedpoint.monochrome([IDENTITY]*3, value)
+        stage = ('lut', tuple(bytes(table) for table in tables))
+    
+    if stage[0] == 'lut' and stages and stages[-1][0] == 'lut':
+        tables = tuple(first.translate(second) for first, second in zip(stages[-1][1], stage[1]))
+        stages = stages[:-1]
+        if tables != (IDENTITY,)*3:
+            stages.append(('lut', tables))
+        return stages
+    return stages+[stage]
+
+
+def apply(planes, stages):
+    """
+    Returns: the color planes after performing the given stages
+    
+    Parameter planes: The red, green and blue planes of the image
+    Precondition: planes is a list of three equal length bytes-like objects
+    
+    Parameter stages: The stages to perform
+    Precondition: stages is a list of stages
+    """
+    planes = [bytes(plane) for plane in planes]
+    for kind, value in stages:
+        if kind == 'lut':
+            planes = [plane.translate(table) for plane, table in zip(planes, value)]
+        else:
+            planes = [bytes(plane) for plane in fixedpoint.monochrome(planes, value)]
+    return planes
+
+
+# HELPERS
+def _grey(stages):
+    """
+    Returns: True if the stages are known to leave all three channels equal
+    
+    Parameter stages: The stages to check
+    Precondition: stages is a list of stages
+    """
+    grey = False
+    for kind, value in stages:
+        if kind == 'mono':
+            grey = not value
+        else:
+            grey = grey and value[0] == value[1] == value[2]
+    return grey
@@ -0,0 +1,369 @@
+"""
+Rank filter support for the imager application
+
+A rank filter replaces each pixel with the value of a given rank among the pixels in
+the square window around it (the median being the most useful).  Sorting every window
+is far too slow, so this module uses the sliding histogram algorithm of Perreault and
+Hebert.  There is a histogram for each column of the image, covering the rows of the
+window, and a histogram for the window itself.  Moving one pixel to the right adds one
+column histogram to the window and removes another, and moving down one row adds one
+pixel to each column histogram and removes another.  So the cost of each pixel does not
+depend on the size of the window.
+
+Adding histograms of 256 bins is still slow in Python, so each histogram also has a
+coarse version of 16 bins (one for each value >> 4), as Perreault and Hebert suggest.
+Only the coarse window is kept up to date at every pixel.  That is enough to find the
+coarse bin holding the value of the given rank, and only the fine window of that bin
+(16 more values) is brought up to date to find the value itself.  The fine windows of
+the other bins are caught up when they are next needed.  The rank usually stays in the
+same bin from one pixel to the next, so this is about 64 additions per pixel instead
+of 512.  Following Huang, the coarse bin is not searched for from scratch at each pixel,
+but is moved up or down from where it was.
+
+For narrow windows it is faster still to add and remove the values of each column one
+at a time, as in the original algorithm of Huang, whose cost grows with the height of
+the window.  Measured on a 200x200 plane, Huang takes 0.15s for a window of 3, 0.20s
+for 11, 0.34s for 27 and 1.2s for 101, while the histograms take 0.3s to 0.4s at any
+width.  So windows narrower than SPARSE use the algorithm of Huang.  This includes the
+radii offered by the GUI (1, 2 and 5), where Huang is about twice as fast.  The
+histograms are used for radius 13 and up.
+
+The smallest and largest values (rank 0 and the last rank) have a faster algorithm, by
+van Herk and Gil and Werman.  The window is square, so these can be done separably,
+first along the rows and then along the columns.  Each line is cut into blocks the size
+of the window, and we take the running extremes forwards and backwards through each
+block.  Any window covers the end of one block and the start of the next, so its
+extreme is the better of just two running values.  That is three comparisons per pixel
+in all, no matter the size of the window.  These comparisons are done a whole column
+(or row) at a time with map.
+
+Like the convolution module, this module works on planes (flat lists holding a single
+color channel of the image).  Pixels past the edge of the image repeat the pixel on the
+edge (the 'clamp' mode of convolution).
+"""
+from operator import add, sub
+
+
+# The window width at which column histograms become faster than column values (on a
+# 200x200 plane, best of 3: 0.31s against 0.35s for 25, and 0.34s for both at 27)
+SPARSE = 27
+
+
+def median_plane(plane, width, height, radius, checkpoint=None):
+    """
+    Returns: the plane with each value replaced by the median of its window
+    
+    The window is the square of pixels at most radius rows and columns away.
+    
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of ints 0..255 with width*height elements
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    
+    Parameter radius: The window radius
+    Precondition: radius is an int >= 0
+    
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    return rank_plane(plane, width, height, radius, (2*radius+1)**2//2, checkpoint)
+
+
+def rank_plane(plane, width, height, radius, rank, checkpoint=None):
+    """
+    Returns: the plane with each value replaced by the value of the given rank in its window
+    
+    The window is the square of pixels at most radius rows and columns away.  Rank 0
+    is the smallest value in the window, and rank (2*radius+1)**2-1 is the largest.
+    
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of ints 0..255 with width*height elements
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    
+    Parameter radius: The window radius
+    Precondition: radius is an int >= 0
+    
+    Parameter rank: The rank to select
+    Precondition: rank is an int with 0 <= rank < (2*radius+1)**2
+    
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    if 2*radius+1 < SPARSE:
+        return _huang(plane, width, height, radius, rank, checkpoint)
+    return _perreault(plane, width, height, radius, rank, checkpoint)
+
+
+def min_plane(plane, width, height, radius, checkpoint=None):
+    """
+    Returns: the plane with each value replaced by the smallest value in its window
+    
+    The window is the square of pixels at most radius rows and columns away.
+    
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of ints 0..255 with width*height elements
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    
+    Parameter radius: The window radius
+    Precondition: radius is an int >= 0
+    
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    return _extreme(plane, width, height, radius, min, checkpoint)
+
+
+def max_plane(plane, width, height, radius, checkpoint=None):
+    """
+    Returns: the plane with each value replaced by the largest value in its window
+    
+    The window is the square of pixels at most radius rows and columns away.
+    
+    Parameter plane: The plane to filter
+    Precondition: plane is a list of ints 0..255 with width*height elements
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    
+    Parameter radius: The window radius
+    Precondition: radius is an int >= 0
+    
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    return _extreme(plane, width, height, radius, max, checkpoint)
+
+
+# HELPERS
+def _extreme(plane, width, height, radius, better, checkpoint=None):
+    """
+    Returns: the plane with each value replaced by the best value in its window
+    
+    See min_plane for the parameters.  The function better is either min or max.
+    """
+    # Filter the columns of each row, working a whole column at a time
+    columns = _running([plane[x::width] for x in range(width)], radius, better, checkpoint)
+    rows = [list(row) for row in zip(*columns)]
+    
+    # Now filter the rows of each column, working a whole row at a time
+    rows = _running(rows, radius, better, checkpoint)
+    result = []
+    for row in rows:
+        result.extend(row)
+    return result
+
+
+def _running(lines, radius, better, checkpoint=None):
+    """
+    Returns: the list of lines where each line is the best of its neighbors
+    
+    Line i of the result is better applied to lines i-radius..i+radius (element-wise),
+    where the lines past either end repeat the end line.  This is the algorithm of
+    van Herk and Gil-Werman.
+    
+    Parameter lines: The lines to combine
+    Precondition: lines is a non-empty list of equal length lists of ints
+    
+    Parameter radius: The window radius
+    Precondition: radius is an int >= 0
+    
+    Parameter better: The function picking the best of two values
+    Precondition: better is min or max
+    
+    Parameter checkpoint: The function to call before each line (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    if radius == 0:
+        return lines
+    
+    size   = 2*radius+1
+    padded = [lines[0]]*radius+lines+[lines[-1]]*radius
+    count  = len(padded)
+    
+    # Running extremes forward from the start of each block
+    ahead = []
+    for pos, line in enumerate(padded):
+        if checkpoint:
+            checkpoint()
+        ahead.append(line if pos % size == 0 else list(map(better, ahead[-1], line)))
+    
+    # Running extremes backward from the end of each block
+    behind = [None]*count
+    for pos in range(count-1, -1, -1):
+        if checkpoint:
+            checkpoint()
+        if pos % size == size-1 or pos == count-1:
+            behind[pos] = padded[pos]
+        else:
+            behind[pos] = list(map(better, behind[pos+1], padded[pos]))
+    
+    # The window starting at pos ends at pos+size-1
+    return [list(map(better, behind[pos], ahead[pos+size-1])) for pos in range(len(lines))]
+
+
+def _huang(plane, width, height, radius, rank, checkpoint=None):
+    """
+    Returns: the rank filter of the plane, adding and removing one value at a time
+    
+    See rank_plane for the parameters.
+    """
+    # Pad the plane so that each window column is a slice
+    size   = 2*radius+1
+    stride = width+2*radius
+    padded = []
+    for y in range(-radius, height+radius):
+        row  = min(max(y, 0), height-1)*width
+        line = plane[row:row+width]
+        padded.extend([line[0]]*radius+line+[line[-1]]*radius)
+    
+    result = []
+    for y in range(height):
+        if checkpoint:
+            checkpoint()
+        start = y*stride
+        stop  = start+size*stride
+        
+        # The window for the first pixel of the row
+        window = [0]*256
+        for x in range(size):
+            for pixel in padded[start+x:stop:stride]:
+                window[pixel] += 1
+        value, below = _select(window, rank, 0, 0)
+        result.append(value)
+        
+        # Slide the window right, keeping track of how many values are below value
+        for x in range(size, width+size-1):
+            out  = padded[start+x-size:stop:stride]
+            into = padded[start+x:stop:stride]
+            for pixel in out:
+                window[pixel] -= 1
+            for pixel in into:
+                window[pixel] += 1
+            below += sum(map(value.__gt__, into))-sum(map(value.__gt__, out))
+            value, below = _select(window, rank, value, below)
+            result.append(value)
+    return result
+
+
+def _perreault(plane, width, height, radius, rank, checkpoint=None):
+    """
+    Returns: the rank filter of the plane, adding and removing column histograms
+    
+    See rank_plane for the parameters.
+    """
+    size = 2*radius+1
+    
+    # The column of each window position, clamped to the image
+    columns = [min(max(x, 0), width-1) for x in range(-radius, width+radius)]
+    
+    # Start each column histogram with the rows of the window for the first row
+    fine   = [[0]*256 for _ in range(width)]
+    coarse = [[0]*16 for _ in range(width)]
+    for y in range(-radius, radius+1):
+        row = min(max(y, 0), height-1)*width
+        for hist, tally, value in zip(fine, coarse, plane[row:row+width]):
+            hist[value] += 1
+            tally[value >> 4] += 1
+    
+    result = []
+    for y in range(height):
+        if checkpoint:
+            checkpoint()
+        if y > 0:
+            # Slide every column histogram down one row
+            old = min(max(y-radius-1, 0), height-1)*width
+            new = min(max(y+radius, 0), height-1)*width
+            if old != new:
+                for hist, tally, out, into in zip(fine, coarse, plane[old:old+width],
+                                                  plane[new:new+width]):
+                    hist[out]  -= 1
+                    hist[into] += 1
+                    tally[out >> 4]  -= 1
+                    tally[into >> 4] += 1
+        
+        # The coarse window for the first pixel of the row
+        window = [0]*16
+        for x in columns[:size]:
+            window = list(map(add, window, coarse[x]))
+        bin, below = _select(window, rank, 0, 0)
+        
+        # The fine window of each bin, and the position it was last brought up to date
+        segments = [None]*16
+        since    = [0]*16
+        for x in range(width):
+            if x > 0:
+                out  = columns[x-1]
+                into = columns[x+size-1]
+                if out != into:
+                    outtally  = coarse[out]
+                    intotally = coarse[into]
+                    window = list(map(sub, map(add, window, intotally), outtally))
+                    below += sum(intotally[:bin])-sum(outtally[:bin])
+                    bin, below = _select(window, rank, bin, below)
+            
+            # Catch up the fine window of the bin, or start it over if that is cheaper
+            start = bin << 4
+            stop  = start+16
+            segment = segments[bin]
+            if segment is None or x-since[bin] >= size:
+                segment = [0]*16
+                for pos in columns[x:x+size]:
+                    segment = list(map(add, segment, fine[pos][start:stop]))
+            else:
+                for pos in range(since[bin]+1, x+1):
+                    out  = columns[pos-1]
+                    into = columns[pos+size-1]
+                    if out != into:
+                        segment = list(map(sub, map(add, segment, fine[into][start:stop]),
+                                           fine[out][start:stop]))
+            segments[bin] = segment
+            since[bin] = x
+            
+            value, _ = _select(segment, rank-below, 0, 0)
+            result.append(start+value)
+    return result
+
+
+def _select(window, rank, value, below):
+    """
+    Returns: the pair (value, below) for the value of the given rank in window
+    
+    The search starts from a previous guess, where below is the number of elements
+    in the window less than value.  The result has the same meaning.
+    
+    Parameter window: The window histogram
+    Precondition: window is a list of ints, whose sum is more than rank
+    
+    Parameter rank: The rank to select
+    Precondition: rank is an int >= 0
+    
+    Parameter value: The starting guess
+    Precondition: value is an int 0..len(window)-1
+    
+    Parameter below: The number of elements in window less than value
+    Precondition: below == sum(window[:value])
+    """
+    while below > rank:
+        value -= 1
+        below -= window[value]
+    while below+window[value] <= rank:
+        below += window[value]
+        value += 1
+    return (value, below)
@@ -0,0 +1,434 @@
+"""
+Resampling support for the imager application
+
+This module changes the size of a pixel buffer.  Like the convolution module, it works
+a whole row at a time rather than a pixel at a time.  Resampling is separable, so it
+happens in two passes: first every source row is resampled to the new width, and then
+the new rows are blended together to make the new height.
+
+Each pass is driven by a table that is computed only once per call.  For every output
+column (or row), the table gives the source positions that contribute to it along with
+their (fixed-point) weights.  The tables are stored as taps: tap k is the list of the
+k-th source position and weight of every output column.  That way a tap can be applied
+to a whole row with a single itemgetter and map.
+
+The supported METHODS are
+
+    'nearest'   each new pixel is a copy of the closest source pixel
+    'bilinear'  each new pixel blends the 2x2 closest source pixels
+    'area'      each new pixel is the average of the source area that it covers
+
+Shrinking by a power of two with 'area' uses a fast path that averages 2x2 blocks.
+
+This module also supports affine transforms (rotation, shear and scaling) that keep the
+size of the image.  These are not separable, so they use a map that gives the source
+position and weights of every new pixel.  The source coordinates are computed a row at a
+time by adding the same step to each column, rather than with trig per pixel.  A map
+takes 8 bytes per pixel (4 for 'nearest').  Maps are expensive to build, so they are
+cached for reuse (e.g. when the same angle is applied to a batch of images of the same
+size), up to MAP_BUDGET bytes of them.
+"""
+from array import array
+from collections import OrderedDict
+from itertools import repeat, accumulate
+from operator import add, sub, mul, rshift, and_, itemgetter
+from math import floor
+
+
+# The supported resampling methods
+METHODS = ('nearest', 'bilinear', 'area')
+
+# The number of fraction bits in the fixed-point weights
+PRECISION = 12
+
+# The number of bytes of affine maps to keep for reuse
+MAP_BUDGET = 64*1024*1024
+
+# The cached affine maps, from least to most recently used
+_maps = OrderedDict()
+
+
+def resize(buffer, width, height, newwidth, newheight, method='bilinear', checkpoint=None):
+    """
+    Returns: a new pixel buffer with the image resized to newwidth x newheight
+    
+    Parameter buffer: The pixel buffer
+    Precondition: buffer is the byte buffer of a Pixels object of size width*height
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    
+    Parameter newwidth: The new image width
+    Precondition: newwidth is an int > 0
+    
+    Parameter newheight: The new image height
+    Precondition: newheight is an int > 0
+    
+    Parameter method: The resampling method
+    Precondition: method is one of METHODS
+    
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    assert method in METHODS, repr(method)+' is not a valid resampling method'
+    
+    if method == 'area':
+        while (width % 2 == 0 and height % 2 == 0 and
+               newwidth <= width//2 and newheight <= height//2):
+            buffer = halve(buffer, width, height, checkpoint)
+            width  = width//2
+            height = height//2
+    
+    if width == newwidth and height == newheight:
+        return array('B', buffer)
+    elif method == 'nearest':
+        return _nearest(buffer, width, height, newwidth, newheight, checkpoint)
+    
+    columns = _taps(weights(width, newwidth, method), 3)
+    rows    = weights(height, newheight, method)
+    shift = 2*PRECISION
+    round = 1 << (shift-1)
+    
+    # Resample each source row only once, and only when it is first needed
+    cache  = {}
+    result = array('B')
+    for contributions in rows:
+        if checkpoint:
+            checkpoint()
+        total = repeat(round)
+        for pos, weight in contributions:
+            if not pos in cache:
+                cache[pos] = _resample_row(buffer[pos*width*3:(pos+1)*width*3], columns)
+            total = map(add, total, map(mul, cache[pos], repeat(weight)))
+        result.extend(map(rshift, total, repeat(shift)))
+        
+        # Rows are visited in increasing order, so we can forget the old ones
+        first = contributions[0][0]
+        for pos in [pos for pos in cache if pos < first]:
+            del cache[pos]
+    return result
+
+
+def halve(buffer, width, height, checkpoint=None):
+    """
+    Returns: a new pixel buffer with the image shrunk to half its width and height
+    
+    Each new pixel is the (rounded) average of a 2x2 block.  If the width or height is
+    odd, the last column or row is dropped.
+    
+    Parameter buffer: The pixel buffer
+    Precondition: buffer is the byte buffer of a Pixels object of size width*height
+    
+    Parameter width: The image width
+    Precondition: width is an int > 1
+    
+    Parameter height: The image height
+    Precondition: height is an int > 1
+    
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    half = width//2
+    result = array('B', bytes(half*3*(height//2)))
+    out = 0
+    for row in range(0, height-1, 2):
+        if checkpoint:
+            checkpoint()
+        top = buffer[row*width*3:(row+1)*width*3]
+        bot = buffer[(row+1)*width*3:(row+2)*width*3]
+        for channel in range(3):
+            stop = half*6
+            total = map(add, map(add, top[channel:stop:6], top[channel+3:stop:6]),
+                             map(add, bot[channel:stop:6], bot[channel+3:stop:6]))
+            total = map(rshift, map(add, total, repeat(2)), repeat(2))
+            result[out+channel:out+half*3:3] = array('B', total)
+        out += half*3
+    return result
+
+
+def weights(size, newsize, method):
+    """
+    Returns: the resampling table for one dimension
+    
+    The table has one entry for each new position.  Each entry is a list of pairs
+    (pos, weight) where pos is a source position and weight is its contribution as
+    a fixed-point number.  The weights of each entry add up to 1 << PRECISION.
+    
+    Parameter size: The source length
+    Precondition: size is an int > 0
+    
+    Parameter newsize: The new length
+    Precondition: newsize is an int > 0
+    
+    Parameter method: The resampling method
+    Precondition: method is one of METHODS
+    """
+    one = 1 << PRECISION
+    table = []
+    for pos in range(newsize):
+        if method == 'nearest':
+            table.append([(min(size-1, (2*pos+1)*size//(2*newsize)), one)])
+        elif method == 'bilinear':
+            # Align the pixel centers, not the pixel edges
+            center = max(0.0, min(size-1.0, (pos+0.5)*size/newsize-0.5))
+            left   = min(int(center), size-2) if size > 1 else 0
+            frac   = int(round((center-left)*one))
+            table.append([(left, one-frac), (min(left+1,size-1), frac)])
+        else:
+            # The source interval covered is [pos*size/newsize, (pos+1)*size/newsize)
+            # We scale everything by newsize to stay in integers
+            start = pos*size
+            stop  = (pos+1)*size
+            entry = []
+            for src in range(start//newsize, -(-stop//newsize)):
+                overlap = min(stop,(src+1)*newsize)-max(start,src*newsize)
+                entry.append((src, overlap*one//size))
+            table.append(entry)
+        
+        # Give any rounding error to the largest weight
+        entry = table[-1]
+        error = one-sum(weight for _, weight in entry)
+        big = max(range(len(entry)), key=lambda k: entry[k][1])
+        entry[big] = (entry[big][0], entry[big][1]+error)
+    return table
+
+
+def affine_map(width, height, matrix, method='bilinear', checkpoint=None):
+    """
+    Returns: the map for the affine transform matrix of an image of size width x height
+    
+    The matrix is a 2x2 list [[a,b],[c,d]] applied to the position of each pixel
+    relative to the center of the image.  So the pixel x columns right and y rows below
+    the center moves to the position (a*x+b*y, c*x+d*y) relative to the center.
+    
+    The map is a tuple (width, height, positions, xweights, yweights).  The source
+    positions are indices into the image padded with a black border (see warp), one
+    per new pixel.  The weights are the fixed-point fractions of the source position
+    to the right of and below that index, as in weights.  For the method 'nearest',
+    the weights are None.  Sources outside of the image are moved onto the border, so
+    they only see black.
+    
+    Maps are cached, so asking for the same map again is free.
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    
+    Parameter matrix: The transform
+    Precondition: matrix is an invertible 2x2 list of numbers
+    
+    Parameter method: The sampling method
+    Precondition: method is 'nearest' or 'bilinear'
+    
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    assert method in METHODS[:2], repr(method)+' is not a valid sampling method'
+    (a, b), (c, d) = matrix
+    det = a*d-b*c
+    assert det != 0, repr(matrix)+' is not invertible'
+    
+    key = (width, height, a, b, c, d, method)
+    if key in _maps:
+        _maps.move_to_end(key)
+        return _maps[key]
+    
+    # The inverse takes each new pixel back to its source
+    a, b, c, d = d/det, -b/det, -c/det, a/det
+    midx = (width-1)/2
+    midy = (height-1)/2
+    stride = width+3
+    nearest = method == 'nearest'
+    
+    # Source coordinates are computed in fixed point (whole pixels for 'nearest')
+    one = 1 if nearest else 1 << PRECISION
+    positions = array('i')
+    xweights  = None if nearest else array('H')
+    yweights  = None if nearest else array('H')
+    for row in range(height):
+        if checkpoint:
+            checkpoint()
+        
+        # Step along the row from the source of its first pixel
+        xs = accumulate(repeat(a*one, width-1), initial=(midx+a*(-midx)+b*(row-midy))*one+0.5)
+        ys = accumulate(repeat(c*one, width-1), initial=(midy+c*(-midx)+d*(row-midy))*one+0.5)
+        xs = list(map(min, map(max, map(floor, xs), repeat(-one)), repeat(width*one)))
+        ys = list(map(min, map(max, map(floor, ys), repeat(-one)), repeat(height*one)))
+        if nearest:
+            lefts, tops = xs, ys
+        else:
+            lefts = map(rshift, xs, repeat(PRECISION))
+            tops  = map(rshift, ys, repeat(PRECISION))
+            xweights.extend(map(and_, xs, repeat(one-1)))
+            yweights.extend(map(and_, ys, repeat(one-1)))
+        positions.extend(map(add, map(add, map(mul, tops, repeat(stride)), lefts),
+                             repeat(stride+1)))
+    
+    result = (width, height, positions, xweights, yweights)
+    size = _nbytes(result)
+    if size <= MAP_BUDGET:
+        _maps[key] = result
+        while sum(map(_nbytes, _maps.values())) > MAP_BUDGET:
+            _maps.popitem(last=False)
+    return result
+
+
+def warp(buffer, table, channel):
+    """
+    Applies an affine map to one channel of a pixel buffer in place
+    
+    The channel is copied into a plane with a black border, one pixel wide on the top
+    and left and two pixels wide on the bottom and right, so that every position in
+    the map (and its neighbors to the right and below) is inside of the plane.
+    
+    Parameter buffer: The pixel buffer
+    Precondition: buffer is the byte buffer of a Pixels object, and table is a map for
+    an image of that size
+    
+    Parameter table: The affine map
+    Precondition: table is the result of affine_map
+    
+    Parameter channel: The color channel
+    Precondition: channel is 0, 1, or 2
+    """
+    width, height, positions, xweights, yweights = table
+    stride = width+3
+    source = buffer[channel::3]
+    plane  = bytearray(stride*(height+3))
+    for row in range(height):
+        start = (row+1)*stride+1
+        plane[start:start+width] = source[row*width:(row+1)*width]
+    
+    if xweights is None:
+        buffer[channel::3] = array('B', map(plane.__getitem__, positions))
+        return
+    
+    # Blend along each row, then between the two rows
+    one = 1 << PRECISION
+    shift = 2*PRECISION
+    right = plane[1:]
+    below = plane[stride:]
+    after = plane[stride+1:]
+    top = map(add, map(mul, map(plane.__getitem__, positions), map(sub, repeat(one), xweights)),
+                   map(mul, map(right.__getitem__, positions), xweights))
+    bot = map(add, map(mul, map(below.__getitem__, positions), map(sub, repeat(one), xweights)),
+                   map(mul, map(after.__getitem__, positions), xweights))
+    total = map(add, map(mul, top, map(sub, repeat(one), yweights)), map(mul, bot, yweights))
+    total = map(rshift, map(add, total, repeat(1 << (shift-1))), repeat(shift))
+    buffer[channel::3] = array('B', total)
+
+
+# HELPERS
+def _taps(table, channels):
+    """
+    Returns: the resampling table rearranged as a list of taps over the bytes of a row
+    
+    Each tap is a pair (getter, weights).  The getter pulls one source byte for each
+    byte of the new row, and weights is the list of their weights.  Short entries are
+    padded with weight 0.
+    
+    Parameter table: A resampling table (see weights)
+    Precondition: table is the result of weights
+    
+    Parameter channels: The number of bytes per pixel
+    Precondition: channels is an int > 0
+    """
+    count = max(len(entry) for entry in table)
+    taps = []
+    for k in range(count):
+        positions = []
+        values = []
+        for entry in table:
+            pos, weight = entry[k] if k < len(entry) else (entry[0][0], 0)
+            for channel in range(channels):
+                positions.append(pos*channels+channel)
+                values.append(weight)
+        taps.append((_getter(positions), values))
+    return taps
+
+
+def _getter(positions):
+    """
+    Returns: a function that takes a sequence and returns the items at positions as a tuple
+    
+    This is itemgetter, except that it always returns a tuple (even for one position).
+    
+    Parameter positions: The positions to get
+    Precondition: positions is a non-empty list of ints
+    """
+    if len(positions) == 1:
+        single = positions[0]
+        return lambda seq: (seq[single],)
+    return itemgetter(*positions)
+
+
+def _nbytes(table):
+    """
+    Returns: the number of bytes in the arrays of an affine map
+    
+    Parameter table: The affine map
+    Precondition: table is the result of affine_map
+    """
+    return sum(len(part)*part.itemsize for part in table[2:] if part is not None)
+
+
+def _resample_row(row, taps):
+    """
+    Returns: the row resampled with the given taps, as a list of fixed-point values
+    
+    Parameter row: The bytes of a single row
+    Precondition: row is an array of bytes
+    
+    Parameter taps: The taps for the new width (see _taps)
+    Precondition: taps is the result of _taps
+    """
+    total = None
+    for getter, values in taps:
+        part = map(mul, getter(row), values)
+        total = part if total is None else map(add, total, part)
+    return list(total)
+
+
+def _nearest(buffer, width, height, newwidth, newheight, checkpoint=None):
+    """
+    Returns: a new pixel buffer resized by copying the nearest pixels
+    
+    Parameter buffer: The pixel buffer
+    Precondition: buffer is the byte buffer of a Pixels object of size width*height
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    
+    Parameter newwidth: The new image width
+    Precondition: newwidth is an int > 0
+    
+    Parameter newheight: The new image height
+    Precondition: newheight is an int > 0
+    
+    Parameter checkpoint: The function to call before each row (see Editor.checkpoint)
+    Precondition: checkpoint is a function taking no arguments, or None
+    """
+    positions = []
+    for entry in weights(width, newwidth, 'nearest'):
+        positions.extend(range(entry[0][0]*3,entry[0][0]*3+3))
+    getter = _getter(positions)
+    
+    result = array('B')
+    last = None
+    for entry in weights(height, newheight, 'nearest'):
+        if checkpoint:
+            checkpoint()
+        pos = entry[0][0]
+        if pos != last:
+            row  = array('B', getter(buffer[pos*width*3:(pos+1)*width*3]))
+            last = pos
+        result.extend(row)
+    return result
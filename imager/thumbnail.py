@@ -0,0 +1,312 @@
+"""
+Thumbnail support for the imager application
+
+The load dialog shows a small preview of the selected file.  Reading a photo at full
+size just to show it at a hundred pixels or so would take far too long.  So thumbnails
+are read with imagefile.read_image at a reduced size.  JPEG files skip the detail while
+decoding.  Other formats like PNG and GIF must be decoded in full, but PIL shrinks them
+before they are copied into Pixels.  Native files are mapped, so only the rows sampled
+below are ever read.  The result is then shrunk in two steps: nearest neighbor sampling
+down to twice the thumbnail size, and bilinear blending the rest of the way.  The cost
+of the first step only depends on the size of the thumbnail, not on the size of the
+image.
+
+Thumbnails are kept as PNG files in a cache folder, so they survive between runs.  Each
+is named by a hash of the path, modification time, and size of its file (see the
+function memo.filekey).  So a file that changes gets a new thumbnail, and the old one
+is simply never used again.  The folder has a byte budget.  When it is over budget,
+the least recently used thumbnails are deleted.  Use is recorded in the modification
+time of each thumbnail, so it is shared by everything using the same folder.
+
+Thumbnails are made on a background thread (see ThumbnailCache.request), as the dialog
+has to stay responsive while the user clicks through files.  Only the selected file and
+a few of its neighbors are requested at a time, and the request is cancelled when the
+dialog is dismissed.
+"""
+import os
+import threading
+
+
+# The default number of bytes of thumbnails to keep on disk
+BUDGET = 64*1024*1024
+
+# The default size of the longest side of a thumbnail
+SIDE = 128
+
+# The files that can have thumbnails
+TYPES = ('.png','.jpg','.jpeg','.gif','.npy')
+
+
+def cache_folder():
+    """
+    Returns: The default cache folder for thumbnails
+    
+    This is the folder imager/thumbnails in the user cache folder ($XDG_CACHE_HOME, or
+    .cache in the home folder if that is not set).
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),'.cache')
+    return os.path.join(base,'imager','thumbnails')
+
+
+class ThumbnailCache(object):
+    """
+    A class to make thumbnails of image files, and keep them on disk
+    
+    Thumbnails are given by the path to their PNG file, which can be shown directly.
+    The folder is created when the first thumbnail is stored.
+    
+    IMMUTABLE ATTRIBUTES (Fixed after initialization)
+        _folder:  The folder to store thumbnails in [str]
+        _budget:  The maximum bytes of thumbnails to keep [int >= 0]
+        _side:    The size of the longest side of each thumbnail [int > 0]
+        _lock:    The lock guarding the mutable attributes [Lock]
+    
+    MUTABLE ATTRIBUTES (Can be changed at any time)
+        _size:    The bytes of thumbnails currently kept, or None if not yet known
+                  [int >= 0 or None]
+        _waiting: The files to make thumbnails for, with their callbacks [list of pairs]
+        _thread:  The thread making thumbnails, or None if there is none [Thread or None]
+    """
+    
+    # GETTERS
+    def getFolder(self):
+        """
+        Returns: The folder the thumbnails are stored in
+        """
+        return self._folder
+    
+    
+    def getBudget(self):
+        """
+        Returns: The maximum number of bytes of thumbnails to keep
+        """
+        return self._budget
+    
+    
+    def getSide(self):
+        """
+        Returns: The size of the longest side of each thumbnail
+        """
+        return self._side
+    
+    
+    def getSize(self):
+        """
+        Returns: The number of bytes of thumbnails currently kept
+        """
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            return self._size
+    
+    
+    # INITIALIZER
+    def __init__(self, folder=None, budget=BUDGET, side=SIDE):
+        """
+        Initializer: Creates a cache storing thumbnails in the given folder
+        
+        Parameter folder: The folder to store thumbnails in (None for the default)
+        Precondition: folder is a string or None
+        
+        Parameter budget: The maximum number of bytes of thumbnails to keep
+        Precondition: budget is an int >= 0
+        
+        Parameter side: The size of the longest side of each thumbnail
+        Precondition: side is an int > 0
+        """
+        assert type(budget) == int and budget >= 0, repr(budget)+' is not a valid budget'
+        assert type(side) == int and side > 0, repr(side)+' is not a valid side'
+        self._folder  = cache_folder() if folder is None else folder
+        self._budget  = budget
+        self._side    = side
+        self._lock    = threading.Lock()
+        self._size    = None
+        self._waiting = []
+        self._thread  = None
+    
+    
+    # OPERATIONS
+    def path(self, file):
+        """
+        Returns: The path of the thumbnail for file, whether or not it has been made
+        
+        Parameter file: An absolute or relative path to an image file
+        Precondition: file is a string naming an existing file
+        """
+        import hashlib
+        import memo
+        name = hashlib.blake2b(repr(memo.filekey(file)+(self._side,)).encode(),digest_size=16)
+        return os.path.join(self._folder,name.hexdigest()+'.png')
+    
+    
+    def get(self, file):
+        """
+        Returns: The path of the thumbnail for file, making it if necessary
+        
+        The thumbnail becomes the most recently used one.  If the file cannot be read,
+        the error is raised to the caller.
+        
+        Parameter file: An absolute or relative path to an image file
+        Precondition: file is a string naming an existing file
+        """
+        path = self.path(file)
+        try:
+            os.utime(path)
+            return path
+        except OSError:
+            pass
+        
+        import imagefile
+        os.makedirs(self._folder,exist_ok=True)
+        imagefile.write_png(self.make(file),path)
+        added = os.path.getsize(path)
+        with self._lock:
+            if not self._size is None:
+                self._size += added
+            if self._size is None or self._size > self._budget:
+                self._evict()
+        return path
+    
+    
+    def make(self, file):
+        """
+        Returns: A new thumbnail Image for the given file
+        
+        The thumbnail is not stored.  Images smaller than the thumbnail size are not
+        enlarged.
+        
+        Parameter file: An absolute or relative path to an image file
+        Precondition: file is a string naming an existing file
+        """
+        import imagefile
+        import resample
+        import pixels
+        import a6image
+        image  = imagefile.read_image(file,(self._side,self._side))
+        width  = image.getWidth()
+        height = image.getHeight()
+        scale  = self._side/max(width,height)
+        if scale >= 1:
+            return image
+        
+        buffer = image.getPixels().buffer
+        newwidth  = max(1,round(width*scale))
+        newheight = max(1,round(height*scale))
+        if scale < 0.5:
+            buffer = resample.resize(buffer,width,height,2*newwidth,2*newheight,'nearest')
+            width, height = 2*newwidth, 2*newheight
+        buffer = resample.resize(buffer,width,height,newwidth,newheight,'bilinear')
+        return a6image.Image(pixels.Pixels.frombytes(buffer),newwidth)
+    
+    
+    def request(self, files, callback):
+        """
+        Makes the thumbnails for the given files in the background.
+        
+        The thumbnails are made in order by a separate thread.  The callback is called
+        (in that thread) with each file and the path of its thumbnail, or None if it
+        could not be made.  Files that are not images (see TYPES) get None right away.
+        
+        The files replace any that are still waiting from an earlier request, so only
+        the most recent request is finished.
+        
+        Parameter files: The image files
+        Precondition: files is a list of strings
+        
+        Parameter callback: The function to call with each thumbnail
+        Precondition: callback is a function taking a file and a path (or None)
+        """
+        with self._lock:
+            self._waiting = [(file,callback) for file in files]
+            start = self._thread is None
+            if start:
+                self._thread = threading.Thread(target=self._work,daemon=True)
+        if start:
+            self._thread.start()
+    
+    
+    def cancel(self):
+        """
+        Drops the files still waiting from the last request.
+        
+        The thumbnail being made when this is called is still finished (and its
+        callback called), as reading an image cannot be interrupted.
+        """
+        with self._lock:
+            self._waiting = []
+    
+    
+    def clear(self):
+        """
+        Deletes every thumbnail in this cache.
+        """
+        with self._lock:
+            for path, _, _ in self._scan():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+    
+    
+    # HELPERS
+    def _work(self):
+        """
+        Makes the thumbnails waiting in this cache, until there are none left.
+        
+        This is the function that is launched in a separate thread by request.
+        """
+        while True:
+            with self._lock:
+                if not self._waiting:
+                    self._thread = None
+                    return
+                file, callback = self._waiting.pop(0)
+            
+            path = None
+            if file.lower().endswith(TYPES):
+                try:
+                    path = self.get(file)
+                except:
+                    pass
+            callback(file,path)
+    
+    
+    def _scan(self):
+        """
+        Returns: A list of (path, size, time) for each thumbnail in the folder
+        
+        The time is the last time the thumbnail was used.
+        """
+        result = []
+        try:
+            with os.scandir(self._folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.png'):
+                        try:
+                            info = entry.stat()
+                            result.append((entry.path,info.st_size,info.st_mtime_ns))
+                        except OSError:
+                            pass
+        except OSError:
+            pass
+        return result
+    
+    
+    def _evict(self):
+        """
+        Deletes the least recently used thumbnails until the cache fits in its budget.
+        
+        The folder is scanned again, as other programs may share it.  This must be
+        called with the lock held.
+        """
+        thumbnails = sorted(self._scan(),key=lambda item: item[2])
+        self._size = sum(size for _, size, _ in thumbnails)
+        for path, size, _ in thumbnails:
+            if self._size <= self._budget:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass